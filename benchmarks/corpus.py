@@ -0,0 +1,88 @@
+import itertools
+import subprocess
+from pathlib import Path
+
+# Sorgenti lavfi: immagine animata, immagine statica e zoom continuo (molti dettagli, difficile da comprimere)
+DEFAULT_SOURCES = ("testsrc2", "smptebars", "mandelbrot")
+DEFAULT_CODECS = ("libx264", "mpeg4", "libvpx-vp9")
+DEFAULT_RESOLUTIONS = ("640x360", "1280x720")
+DEFAULT_DURATIONS = (10, 30)
+
+# Contenitore usato per ciascun codec
+CODEC_EXTENSIONS = {
+    "libx264": ".mp4",
+    "libx265": ".mkv",
+    "mpeg4": ".avi",
+    "libvpx-vp9": ".webm",
+}
+
+# Opzioni per codificare in tempi ragionevoli i codec più lenti
+CODEC_OPTIONS = {
+    "libx264": ["-preset", "veryfast"],
+    "libx265": ["-preset", "ultrafast"],
+    "libvpx-vp9": ["-deadline", "realtime", "-cpu-used", "8", "-b:v", "1M"],
+}
+
+
+def encode(ffmpeg, input_args, output_path, codec, gop, duration=None, filters=None):
+    """Codifica un video con ffmpeg; input_args contiene le opzioni di ingresso (lavfi o file)."""
+    command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', *input_args]
+    if duration is not None:
+        command += ['-t', str(duration)]
+    if filters:
+        command += ['-vf', filters]
+    command += ['-c:v', codec, *CODEC_OPTIONS.get(codec, []), '-pix_fmt', 'yuv420p', '-g', str(gop), '-an', str(output_path)]
+    subprocess.run(command, check=True)
+
+
+def generate_corpus(ffmpeg, output_dir, sources=DEFAULT_SOURCES, codecs=DEFAULT_CODECS, resolutions=DEFAULT_RESOLUTIONS,
+                    durations=DEFAULT_DURATIONS, gop=250, rate=25):
+    """
+    Genera il corpus sintetico: un originale per ogni combinazione di sorgente, risoluzione e durata,
+    più le varianti ricodificate con gli altri codec, tagliate (primo 20% rimosso) e ridimensionate a metà.
+
+    I file già presenti vengono riusati, quindi lo stesso corpus serve per più esecuzioni.
+
+    Parameters:
+    ffmpeg (str): Percorso dell'eseguibile ffmpeg.
+    output_dir (Path): Cartella del corpus.
+    gop (int): Distanza massima tra keyframe; GOP lunghi rendono costosa la ricerca precisa.
+    rate (int): Frame al secondo.
+
+    Returns:
+    list: Dizionari con path, original (percorso dell'originale), variant, source, codec, resolution e duration.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    base_codec = codecs[0]
+    corpus = []
+
+    for source, resolution, duration in itertools.product(sources, resolutions, durations):
+        name = f"{source}_{resolution}_{duration}s"
+        original = output_dir / f"{name}{CODEC_EXTENSIONS.get(base_codec, '.mkv')}"
+        variants = [(original, "original", base_codec, ['-f', 'lavfi', '-i', f"{source}=size={resolution}:rate={rate}"], duration, None)]
+        for codec in codecs[1:]:
+            variants.append((output_dir / f"{name}_reencoded{CODEC_EXTENSIONS.get(codec, '.mkv')}", "reencoded", codec,
+                             ['-i', str(original)], None, None))
+        variants.append((output_dir / f"{name}_trimmed{original.suffix}", "trimmed", base_codec,
+                         ['-ss', str(duration * 0.2), '-i', str(original)], None, None))
+        variants.append((output_dir / f"{name}_scaled{original.suffix}", "scaled", base_codec,
+                         ['-i', str(original)], None, "scale=trunc(iw/4)*2:trunc(ih/4)*2"))
+
+        for path, variant, codec, input_args, variant_duration, filters in variants:
+            if not path.exists():
+                # Codifica su un file temporaneo: un'esecuzione interrotta non lascia file troncati nel corpus
+                partial = path.with_name(f"partial_{path.name}")
+                encode(ffmpeg, input_args, partial, codec, gop, variant_duration, filters)
+                partial.replace(path)
+            corpus.append({
+                "path": str(path),
+                "original": str(original),
+                "variant": variant,
+                "source": source,
+                "codec": codec,
+                "resolution": resolution,
+                "duration": duration * 0.8 if variant == "trimmed" else duration,
+            })
+
+    return corpus
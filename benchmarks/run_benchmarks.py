@@ -0,0 +1,376 @@
+"""
+Benchmark riproducibili delle fasi di probe, estrazione dei frame, combinazione degli hash e confronto.
+
+Genera un corpus sintetico con le sorgenti lavfi di ffmpeg, misura ogni fase separatamente
+e scrive i risultati in JSON, così da poter confrontare commit diversi.
+
+Esempio:
+    python benchmarks/run_benchmarks.py --scales 1000 10000 100000 --methods bktree mih numpy
+"""
+import argparse
+import configparser
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from corpus import DEFAULT_CODECS, DEFAULT_DURATIONS, DEFAULT_RESOLUTIONS, DEFAULT_SOURCES, generate_corpus
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+STAGES = ("probe", "extract", "hash", "combine", "compare")
+# Frame per chiamata del motore di hash a lotti nella fase "hash"
+HASH_BATCH = 1024
+# Frame a piena risoluzione (altezza, larghezza) della fase "hash", quanti al massimo per scala e quanti per chiamata
+FULL_FRAME_SHAPE = (360, 640)
+FULL_FRAME_LIMIT = 256
+FULL_FRAME_BATCH = 32
+SEEK_MODES = ("accurate", "fast")
+
+
+def percentile(sorted_samples, fraction):
+    """Percentile (per vicinanza) di una lista già ordinata."""
+    if not sorted_samples:
+        return None
+    return sorted_samples[min(len(sorted_samples) - 1, round(fraction * (len(sorted_samples) - 1)))]
+
+
+def summarize(samples, failures=0):
+    """Riassume le durate in secondi di una fase: conteggio, totale, media e percentili."""
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        "count": len(ordered),
+        "failures": failures,
+        "total_seconds": total,
+        "mean_seconds": total / len(ordered) if ordered else None,
+        "min_seconds": ordered[0] if ordered else None,
+        "p50_seconds": percentile(ordered, 0.5),
+        "p95_seconds": percentile(ordered, 0.95),
+        "max_seconds": ordered[-1] if ordered else None,
+    }
+
+
+def time_call(function, *args):
+    """Esegue la funzione e restituisce (secondi trascorsi, risultato); un'eccezione conta come risultato None."""
+    start = time.perf_counter()
+    try:
+        result = function(*args)
+    except Exception as e:
+        print(f"Errore in {function.__name__}{args}: {e}")
+        result = None
+    return time.perf_counter() - start, result
+
+
+def git_revision():
+    """Restituisce (commit corrente, True se ci sono modifiche non salvate), oppure (None, None) fuori da git."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        return commit, bool(status)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def prepare_workspace(workdir, args):
+    """
+    Crea la cartella di lavoro con un config.ini dedicato e vi si sposta.
+
+    I moduli leggono config.ini dalla cartella corrente al momento dell'importazione, quindi
+    vanno importati solo dopo questa funzione.
+    """
+    config = configparser.ConfigParser()
+    config.read(REPO_ROOT / 'config.ini')
+    config['Paths']['DIR_TO_PROCESS'] = str(workdir / 'corpus')
+    config['Paths']['FRAMES_DIR'] = str(workdir / 'frames')
+    config['Paths']['FFMPEG_PATH'] = args.ffmpeg
+    config['Paths']['FFPROBE_PATH'] = args.ffprobe
+    config['Database']['DB_FILE'] = 'benchmark.db'
+    if not config.has_section('Blocking'):
+        config.add_section('Blocking')
+    config['Blocking']['ENABLED'] = 'true' if args.blocking else 'false'
+
+    (workdir / 'frames').mkdir(parents=True, exist_ok=True)
+    with open(workdir / 'config.ini', 'w') as config_file:
+        config.write(config_file)
+    os.chdir(workdir)
+    sys.path.insert(0, str(REPO_ROOT))
+
+
+def bench_probe(corpus):
+    """Misura get_video_duration su ogni file del corpus."""
+    from moduli.extractor import get_video_duration
+
+    samples, failures = [], 0
+    for entry in corpus:
+        elapsed, duration = time_call(get_video_duration, Path(entry["path"]))
+        samples.append(elapsed)
+        failures += not duration
+    return summarize(samples, failures)
+
+
+def bench_extract(corpus, frames_dir, mode):
+    """
+    Misura attempt_frame_extraction a metà di ogni video con la ricerca precisa o veloce.
+
+    Returns:
+    tuple: (riepilogo dei tempi, dizionario percorso -> hash esadecimale del frame estratto)
+    """
+    from moduli.extractor import attempt_frame_extraction
+
+    samples, failures, hashes = [], 0, {}
+    for entry in corpus:
+        output_frame_path = frames_dir / f"{Path(entry['path']).name}.{mode}.png"
+        elapsed, phash = time_call(attempt_frame_extraction, Path(entry["path"]), entry["duration"] / 2, output_frame_path, mode == "fast")
+        samples.append(elapsed)
+        if phash is None:
+            failures += 1
+        else:
+            hashes[entry["path"]] = str(phash)
+    return summarize(samples, failures), hashes
+
+
+def fingerprint_stability(corpus, accurate_hashes, fast_hashes, distance_threshold):
+    """
+    Confronta gli hash della ricerca veloce con quelli della ricerca precisa, file per file.
+
+    Returns:
+    dict: Distanza Hamming media e massima, file entro la soglia e distanza media per variante del corpus.
+    """
+    distances, by_variant = [], {}
+    for entry in corpus:
+        accurate, fast = accurate_hashes.get(entry["path"]), fast_hashes.get(entry["path"])
+        if accurate is None or fast is None:
+            continue
+        distance = bin(int(accurate, 16) ^ int(fast, 16)).count('1')
+        distances.append(distance)
+        by_variant.setdefault(entry["variant"], []).append(distance)
+    return {
+        "files": len(distances),
+        "mean_distance": sum(distances) / len(distances) if distances else None,
+        "max_distance": max(distances, default=None),
+        "within_threshold": sum(distance <= distance_threshold for distance in distances),
+        "mean_distance_by_variant": {variant: sum(values) / len(values) for variant, values in sorted(by_variant.items())},
+    }
+
+
+def bench_combine(scales, rng):
+    """Misura combine_hashes_mode su terne di hash casuali, per ogni scala."""
+    import imagehash
+    import numpy as np
+    from moduli.hash_utils import combine_hashes_mode
+
+    results = []
+    for scale in scales:
+        bits = np.array([rng.getrandbits(1) for _ in range(scale * 3 * 64)], dtype=bool).reshape(scale, 3, 8, 8)
+        triples = [[imagehash.ImageHash(frame) for frame in triple] for triple in bits]
+        samples = [time_call(combine_hashes_mode, *triple)[0] for triple in triples]
+        results.append({"scale": scale, **summarize(samples)})
+        print(f"combine_hashes_mode su {scale} terne: {sum(samples):.3f}s")
+    return results
+
+
+def bench_hash(scales, rng):
+    """
+    Confronta imagehash (phash, dhash e average hash un frame alla volta) con batch_hash.hash_stack
+    e verifica che gli hash coincidano, su frame 32x32 (come in modalità 'raw') e a piena risoluzione
+    (come in modalità 'legacy', al massimo FULL_FRAME_LIMIT per scala).
+
+    Il phash si confronta con imagehash sul frame originale; dhash e average hash, che hash_stack ricava
+    dal buffer 32x32, con imagehash sullo stesso buffer. Per i frame a piena risoluzione si riporta
+    anche quanti dhash/average hash differiscono da imagehash sul frame originale (solo informativo).
+    """
+    import imagehash
+    import numpy as np
+    from PIL import Image
+    from moduli.batch_hash import hash_stack
+
+    generator = np.random.default_rng(rng.getrandbits(32))
+    functions = (imagehash.phash, imagehash.dhash, imagehash.average_hash)
+    results = []
+    for scale in scales:
+        for kind, (height, width), count, batch in (("32x32", (32, 32), scale, HASH_BATCH),
+                                                    ("full", FULL_FRAME_SHAPE, min(scale, FULL_FRAME_LIMIT), FULL_FRAME_BATCH)):
+            frames = generator.integers(0, 256, (count, height, width), dtype=np.uint8)
+
+            def per_frame(frame):
+                image = Image.fromarray(frame, mode='L')
+                buffer = image.resize((32, 32), Image.LANCZOS) if image.size != (32, 32) else image
+                return [int(str(function(source)), 16) for function, source in zip(functions, (image, buffer, buffer))]
+
+            timed_frames = [time_call(per_frame, frame) for frame in frames]
+            timed_batches = [time_call(hash_stack, frames[start:start + batch]) for start in range(0, count, batch)]
+            expected = np.array([hashes for _, hashes in timed_frames], dtype=np.uint64)
+            computed = np.stack([np.concatenate(columns) for columns in zip(*(hashes for _, hashes in timed_batches))], axis=1)
+
+            imagehash_seconds = sum(seconds for seconds, _ in timed_frames)
+            batch_seconds = sum(seconds for seconds, _ in timed_batches)
+            result = {
+                "scale": scale,
+                "frames": kind,
+                "count": count,
+                "imagehash": summarize([seconds for seconds, _ in timed_frames]),
+                "batch": summarize([seconds for seconds, _ in timed_batches]),
+                "speedup": imagehash_seconds / batch_seconds if batch_seconds else None,
+                "mismatched_hashes": int((expected != computed).sum()),
+            }
+            if kind == "full":
+                original = np.array([[int(str(function(Image.fromarray(frame, mode='L'))), 16) for function in functions[1:]]
+                                     for frame in frames], dtype=np.uint64)
+                result["differs_from_full_frame"] = {"dhash": int((original[:, 0] != computed[:, 1]).sum()),
+                                                     "average_hash": int((original[:, 1] != computed[:, 2]).sum())}
+            results.append(result)
+            print(f"Hash di {count} frame {kind}: imagehash {imagehash_seconds:.3f}s, a lotti {batch_seconds:.3f}s, "
+                  f"{result['mismatched_hashes']} hash diversi")
+    return results
+
+
+def build_hash_database(db_file, count, distance_threshold, rng):
+    """
+    Crea un database con count video sintetici (solo hash e metadati, nessun frame).
+
+    Circa il 10% degli hash è una copia di un hash precedente con meno di distance_threshold
+    bit cambiati, così il confronto trova un numero realistico di coppie.
+    """
+    from moduli import database_manager
+
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{db_file}{suffix}").unlink(missing_ok=True)
+    database_manager.DB_FILE = str(db_file)
+    database_manager.create_table()
+
+    hashes, rows = [], []
+    for idx in range(count):
+        if hashes and rng.random() < 0.1:
+            value = rng.choice(hashes)
+            for bit in rng.sample(range(64), rng.randrange(max(distance_threshold, 1))):
+                value ^= 1 << bit
+        else:
+            value = rng.getrandbits(64)
+        hashes.append(value)
+        width, height = rng.choice(((640, 360), (1280, 720), (1920, 1080), (720, 1280)))
+        rows.append((f"{width}x{height}", rng.randrange(10 ** 6, 10 ** 9), rng.uniform(5, 3600), f"/synthetic/{idx}.mp4",
+                     database_manager.hash_to_db(value), *database_manager.hash_bands(value), width, height))
+
+    with database_manager.connect_db() as conn:
+        conn.executemany(
+            "INSERT INTO videos (resolution, size, duration, video_path, combined_hash, "
+            "hash_band0, hash_band1, hash_band2, hash_band3, width, height) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+
+
+def bench_compare(scales, methods, distance_threshold, brute_limit, workdir, rng):
+    """Misura compare_hashes (confronto, salvataggio e raggruppamento) per ogni scala e metodo."""
+    from moduli import database_manager
+    from moduli.compare import compare_hashes
+
+    results = []
+    for scale in scales:
+        build_hash_database(workdir / 'database' / f"synthetic_{scale}.db", scale, distance_threshold, rng)
+        for method in methods:
+            if method == "brute" and scale > brute_limit:
+                results.append({"scale": scale, "method": method, "skipped": f"scala oltre --brute-limit {brute_limit}"})
+                continue
+            elapsed, _ = time_call(compare_hashes, distance_threshold, method)
+            with database_manager.connect_db() as conn:
+                pairs = conn.execute("SELECT COUNT(*) FROM similarities").fetchone()[0]
+            results.append({"scale": scale, "method": method, "seconds": elapsed, "pairs": pairs})
+            print(f"compare_hashes {method} su {scale} hash: {elapsed:.3f}s, {pairs} coppie")
+    return results
+
+
+def parse_args():
+    config = configparser.ConfigParser()
+    config.read(REPO_ROOT / 'config.ini')
+    parser = argparse.ArgumentParser(description="Benchmark delle fasi di elaborazione e confronto dei video.")
+    parser.add_argument('--workdir', type=Path, default=REPO_ROOT / 'benchmarks' / 'work', help="Cartella del corpus e dei database di prova")
+    parser.add_argument('--output', type=Path, help="File JSON dei risultati (predefinito: benchmarks/results/<data>-<commit>.json)")
+    parser.add_argument('--ffmpeg', default=config.get('Paths', 'FFMPEG_PATH', fallback='ffmpeg'))
+    parser.add_argument('--ffprobe', default=config.get('Paths', 'FFPROBE_PATH', fallback='ffprobe'))
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--sources', nargs='+', default=list(DEFAULT_SOURCES))
+    parser.add_argument('--codecs', nargs='+', default=list(DEFAULT_CODECS), help="Il primo codec è usato per gli originali")
+    parser.add_argument('--resolutions', nargs='+', default=list(DEFAULT_RESOLUTIONS))
+    parser.add_argument('--durations', nargs='+', type=int, default=list(DEFAULT_DURATIONS))
+    parser.add_argument('--gop', type=int, default=250, help="Distanza massima tra keyframe del corpus")
+    parser.add_argument('--seek-modes', nargs='+', choices=SEEK_MODES, default=list(SEEK_MODES),
+                        help="Modalità di ricerca misurate nell'estrazione dei frame")
+    parser.add_argument('--scales', nargs='+', type=int, default=[1000, 10000, 100000], help="Numero di hash sintetici")
+    parser.add_argument('--methods', nargs='+', default=["brute", "bktree", "mih", "numpy"])
+    parser.add_argument('--brute-limit', type=int, default=10000, help="Scala massima per il confronto a forza bruta")
+    parser.add_argument('--threshold', type=int, default=config.getint('Settings', 'DISTANCE_THRESHOLD', fallback=5))
+    parser.add_argument('--blocking', action='store_true', help="Confronta con la suddivisione in blocchi attiva")
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    workdir = args.workdir.resolve()
+    output = args.output.resolve() if args.output else None
+    prepare_workspace(workdir, args)
+    rng = random.Random(args.seed)
+
+    commit, dirty = git_revision()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "created": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        "stages": {},
+    }
+
+    corpus = []
+    if {"probe", "extract"} & set(args.stages):
+        print("Generazione del corpus sintetico...")
+        corpus = generate_corpus(args.ffmpeg, workdir / 'corpus', args.sources, args.codecs, args.resolutions, args.durations, args.gop)
+        results["corpus"] = corpus
+
+    if "probe" in args.stages:
+        results["stages"]["get_video_duration"] = bench_probe(corpus)
+    if "extract" in args.stages:
+        results["frame_hashes"] = {}
+        for mode in args.seek_modes:
+            summary, hashes = bench_extract(corpus, workdir / 'frames', mode)
+            results["stages"][f"attempt_frame_extraction[{mode}]"] = summary
+            results["frame_hashes"][mode] = hashes
+        if set(SEEK_MODES) <= set(args.seek_modes):
+            stability = fingerprint_stability(corpus, results["frame_hashes"]["accurate"], results["frame_hashes"]["fast"], args.threshold)
+            accurate_mean = results["stages"]["attempt_frame_extraction[accurate]"]["mean_seconds"]
+            fast_mean = results["stages"]["attempt_frame_extraction[fast]"]["mean_seconds"]
+            stability["speedup"] = accurate_mean / fast_mean if accurate_mean and fast_mean else None
+            results["seek_stability"] = stability
+            print(f"Ricerca veloce: {stability['speedup'] or 0:.1f}x più rapida, distanza media dall'estrazione precisa "
+                  f"{stability['mean_distance'] or 0:.1f} bit, {stability['within_threshold']}/{stability['files']} file entro la soglia")
+    if "hash" in args.stages:
+        results["stages"]["hash_frames"] = bench_hash(args.scales, rng)
+    if "combine" in args.stages:
+        results["stages"]["combine_hashes_mode"] = bench_combine(args.scales, rng)
+    if "compare" in args.stages:
+        results["stages"]["compare_hashes"] = bench_compare(args.scales, args.methods, args.threshold, args.brute_limit, workdir, rng)
+
+    for stage, summary in results["stages"].items():
+        if isinstance(summary, dict):
+            print(f"{stage}: {summary['count']} chiamate, media {summary['mean_seconds'] or 0:.4f}s, "
+                  f"p95 {summary['p95_seconds'] or 0:.4f}s, {summary['failures']} errori")
+
+    if output is None:
+        output = REPO_ROOT / 'benchmarks' / 'results' / f"{datetime.now():%Y%m%d-%H%M%S}-{(commit or 'nogit')[:7]}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"Risultati salvati in {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,15 @@
 from moduli.extractor import process_videos_in_directory
-from moduli.database_manager import create_table
+from moduli.database_manager import create_table, use_database, shard_database_file
+from moduli.sharding import ShardSelector, merge_shards, SHARD_INDEX, SHARD_COUNT, SHARD_PREFIXES, SHARD_NAME
+from moduli.query_service import query_files, serve, QUERY_PORT
+import argparse
+import glob
 import logging
-from moduli.compare import compare_hashes
+import subprocess
+import sys
+from moduli.compare import compare_hashes, compare_temporal
+from moduli.hash_index import COMPARE_METHODS
+from moduli.metrics import report_metrics
 import configparser
 from pathlib import Path
 
@@ -18,10 +26,13 @@ config.read(config_file)
 # Load directory and threshold values
 DIR_TO_PROCESS = config['Paths']['DIR_TO_PROCESS']
 DISTANCE_THRESHOLD = int(config['Settings']['DISTANCE_THRESHOLD'])
+COMPARE_METHOD = config['Settings'].get('COMPARE_METHOD', 'brute').strip().lower()
+TEMPORAL_FINGERPRINT = config.getboolean('Temporal', 'ENABLED', fallback=False)
 
 # Print the loaded values for verification
 print(f"DIRECTORY TO PROCESS: {DIR_TO_PROCESS}")
 print(f"DISTANCE THRESHOLD: {DISTANCE_THRESHOLD}")
+print(f"COMPARE METHOD: {COMPARE_METHOD}")
 
 # Check if the directory exists
 if not Path(DIR_TO_PROCESS).exists() or not Path(DIR_TO_PROCESS).is_dir():
@@ -35,24 +46,114 @@ if not isinstance(DISTANCE_THRESHOLD, int):
 else:
     print(f"Il valore di DISTANCE_THRESHOLD è valido: {DISTANCE_THRESHOLD}")
 
+# Check if the compare method is supported
+if COMPARE_METHOD not in COMPARE_METHODS:
+    print(f"Attenzione: COMPARE_METHOD '{COMPARE_METHOD}' non è supportato, verrà usato 'brute'.")
+    COMPARE_METHOD = 'brute'
+
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scansione dei video e ricerca dei duplicati.")
+    parser.add_argument('--dir', default=DIR_TO_PROCESS, help="Cartella da elaborare (predefinita: DIR_TO_PROCESS)")
+    parser.add_argument('--shard-index', type=int, default=SHARD_INDEX, help="Indice dello shard da elaborare, da 0 a --shard-count - 1")
+    parser.add_argument('--shard-count', type=int, default=SHARD_COUNT, help="Numero di shard in cui dividere i video per hash del percorso")
+    parser.add_argument('--prefix', action='append', help="Elabora solo i video sotto questo percorso relativo a --dir (ripetibile)")
+    parser.add_argument('--shard-name', default=SHARD_NAME, help="Nome del database dello shard (predefinito: <indice>of<numero>)")
+    parser.add_argument('--merge', nargs='+', metavar='SHARD_DB', help="Unisce i database degli shard nel database principale, poi confronta")
+    parser.add_argument('--local-shards', type=int, metavar='N', help="Scansiona con N processi shard su questa macchina, poi unisce e confronta")
+    parser.add_argument('--query', nargs='+', metavar='FILE', help="Controlla se i file sono duplicati di video della libreria, senza scansione")
+    parser.add_argument('--add', action='store_true', help="Con --query o --serve: aggiunge anche i file interrogati alla libreria")
+    parser.add_argument('--serve', action='store_true', help="Avvia il servizio HTTP locale delle interrogazioni ([Query] HOST e PORT)")
+    parser.add_argument('--port', type=int, default=QUERY_PORT, help="Porta del servizio HTTP (predefinita: [Query] PORT)")
+    return parser.parse_args()
+
+def run_local_shards(directory, count, prefixes=None):
+    """
+    Avvia count processi di scansione a shard su questa macchina, ne attende la fine e restituisce i database prodotti.
+
+    Solleva RuntimeError se un processo termina con errore: uno shard incompleto non va unito.
+    Nome e prefissi vengono passati a ogni processo, che altrimenti userebbe [Shard] NAME e PREFIXES
+    della configurazione e potrebbe scrivere in un database diverso da quello atteso.
+    """
+    processes, shard_files = [], []
+    for index in range(count):
+        shard = ShardSelector(directory, index, count, prefixes)
+        shard_files.append(shard_database_file(shard.name))
+        command = [sys.executable, str(Path(__file__).resolve()), '--dir', directory,
+                   '--shard-index', str(index), '--shard-count', str(count), '--shard-name', shard.name]
+        for prefix in prefixes or []:
+            command += ['--prefix', prefix]
+        processes.append(subprocess.Popen(command))
+
+    failed = []
+    for index, process in enumerate(processes):
+        if process.wait() != 0:
+            logging.error(f"Il processo dello shard {index} è terminato con codice {process.returncode}")
+            failed.append(index)
+    if failed:
+        raise RuntimeError(f"Shard non completati: {', '.join(map(str, failed))}; unione annullata")
+    return shard_files
+
+def compare_videos():
+    """Confronta gli hash dei video del database corrente e, se attivo, allinea le impronte temporali."""
+    compare_hashes(DISTANCE_THRESHOLD, COMPARE_METHOD)
+
+    # Allinea le impronte temporali per trovare video tagliati o rimontati
+    if TEMPORAL_FINGERPRINT:
+        compare_temporal()
+
 def main():
     """Funzione principale per creare la tabella nel database e processare i video in una directory specificata."""
+    args = parse_args()
     try:
+        if args.query or args.serve:
+            # Interrogazioni sull'indice residente: nessuna scansione e nessun confronto completo
+            create_table()
+            if args.query:
+                query_files(args.query, add=args.add)
+            else:
+                serve(port=args.port)
+            return
+
+        prefixes = args.prefix if args.prefix is not None else SHARD_PREFIXES
+        if args.local_shards:
+            shard_files = run_local_shards(args.dir, args.local_shards, prefixes)
+            # Tutti gli shard appena scansionati devono esserci: unirne solo una parte darebbe una libreria incompleta
+            merge_shards(shard_files, require_all=True)
+            compare_videos()
+            return
+
+        if args.merge:
+            # Espande i caratteri jolly anche dove la shell non lo fa (Windows)
+            merge_shards([match for pattern in args.merge for match in (sorted(glob.glob(pattern)) or [pattern])])
+            compare_videos()
+            return
+
+        shard = ShardSelector(args.dir, args.shard_index, args.shard_count, prefixes, args.shard_name)
+        if shard.active:
+            # Ogni shard scrive nel proprio database; il confronto avviene dopo l'unione (--merge)
+            use_database(shard_database_file(shard.name))
         create_table()  # Crea la tabella nel database se non esiste già
-        
 
-        logging.info(f"Inizio dell'elaborazione dei video nella directory: {DIR_TO_PROCESS}")
-        process_videos_in_directory(DIR_TO_PROCESS)
+        logging.info(f"Inizio dell'elaborazione dei video nella directory: {args.dir}")
+        process_videos_in_directory(args.dir, shard if shard.active else None)
         logging.info("Elaborazione completata.")
 
-        # Confronta gli hash dei video
-        compare_hashes(DISTANCE_THRESHOLD)
+        if shard.active:
+            print(f"Shard {shard.name} completato. Unire gli shard con: python main.py --merge <database degli shard>")
+            return
+
+        compare_videos()
 
     except Exception as e:
         logging.error(f"Si è verificato un errore durante l'elaborazione: {e}")
+        # Codice di uscita non nullo: chi ha avviato il processo (ad esempio --local-shards) deve sapere che è fallito
+        sys.exit(1)
+    finally:
+        # Riepilogo dei tempi per fase (solo con [Metrics] ENABLED = true)
+        report_metrics()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,169 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+import scipy.fftpack
+
+# Lato degli hash (8x8 = 64 bit) e dell'immagine da cui imagehash calcola il phash (hash_size * highfreq_factor)
+HASH_SIZE = 8
+PHASH_IMAGE_SIZE = 32
+
+# Precisione dei coefficienti a virgola fissa usati da Pillow per ridimensionare le immagini a 8 bit
+PRECISION_BITS = 32 - 8 - 2
+# Sotto questa distanza dalla mediana un coefficiente DCT è considerato in parità: il frame viene
+# ricalcolato con la DCT di scipy, perché in parità il bit dipende dagli arrotondamenti della FFT
+TIE_TOLERANCE = 1e-6
+
+
+def lanczos_filter(x):
+    """Filtro di Lanczos con supporto 3, identico a quello di Pillow (Image.LANCZOS)."""
+    if -3.0 <= x < 3.0:
+        return sinc(x) * sinc(x / 3)
+    return 0.0
+
+
+def sinc(x):
+    if x == 0.0:
+        return 1.0
+    x *= math.pi
+    return math.sin(x) / x
+
+
+@lru_cache(maxsize=None)
+def resample_matrix(in_size, out_size):
+    """
+    Matrice (out_size x in_size) dei coefficienti a virgola fissa con cui Pillow ridimensiona un asse con LANCZOS.
+
+    Riproduce precompute_coeffs e normalize_coeffs_8bpc di Pillow, così il ridimensionamento
+    vettoriale restituisce gli stessi byte di Image.resize.
+    """
+    scale = in_size / out_size
+    filterscale = max(scale, 1.0)
+    support = 3.0 * filterscale
+    matrix = np.zeros((out_size, in_size), dtype=np.int64)
+    for out_index in range(out_size):
+        center = (out_index + 0.5) * scale
+        xmin = max(int(center - support + 0.5), 0)
+        xmax = min(int(center + support + 0.5), in_size)
+        weights = [lanczos_filter((x - center + 0.5) * (1.0 / filterscale)) for x in range(xmin, xmax)]
+        total = sum(weights)
+        for x, weight in zip(range(xmin, xmax), weights):
+            if total != 0.0:
+                weight /= total
+            matrix[out_index, x] = int(weight * (1 << PRECISION_BITS) + (-0.5 if weight < 0 else 0.5))
+    matrix.flags.writeable = False
+    return matrix
+
+
+def clip8(values):
+    """Arrotonda e satura a 8 bit le somme a virgola fissa, come clip8 di Pillow."""
+    return np.clip((values + (1 << (PRECISION_BITS - 1))) >> PRECISION_BITS, 0, 255)
+
+
+def resize_stack(frames, width, height):
+    """
+    Ridimensiona una pila di frame in scala di grigi con LANCZOS, con gli stessi risultati di Image.resize.
+
+    Come Pillow, esegue prima il passaggio orizzontale e poi quello verticale, arrotondando a 8 bit dopo ciascuno.
+
+    Parameters:
+    frames (np.ndarray): Array uint8 di forma (n, altezza, larghezza).
+
+    Returns:
+    np.ndarray: Array uint8 di forma (n, height, width).
+    """
+    n, frame_height, frame_width = frames.shape
+    if (frame_width, frame_height) == (width, height):
+        return frames
+    resized = frames.astype(np.int64)
+    if width != frame_width:
+        resized = clip8(resized @ resample_matrix(frame_width, width).T)
+    if height != frame_height:
+        resized = clip8(resample_matrix(frame_height, height) @ resized)
+    return resized.astype(np.uint8)
+
+
+@lru_cache(maxsize=None)
+def dct_matrix(size, keep):
+    """Prime keep righe della matrice della DCT di tipo II non normalizzata (come scipy.fftpack.dct)."""
+    k = np.arange(keep)[:, None]
+    n = np.arange(size)
+    matrix = 2.0 * np.cos(np.pi * k * (2 * n + 1) / (2 * size))
+    matrix.flags.writeable = False
+    return matrix
+
+
+def bits_to_int(bits):
+    """Converte i bit (n, ...) in interi a 64 bit, con il primo bit come più significativo (come str(ImageHash))."""
+    return np.packbits(bits.reshape(len(bits), -1), axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+def phash_stack(frames):
+    """
+    Calcola il phash di tutti i frame con due prodotti matriciali, bit per bit uguale a imagehash.phash.
+
+    Della DCT servono solo le frequenze più basse (HASH_SIZE x HASH_SIZE), quindi il prodotto
+    usa solo le prime righe della matrice. I frame con un coefficiente in parità con la mediana
+    vengono ricalcolati con scipy.fftpack, come fa imagehash.
+
+    Parameters:
+    frames (np.ndarray): Array uint8 (n, altezza, larghezza); se non sono 32x32 vengono ridimensionati come in imagehash.
+
+    Returns:
+    np.ndarray: Hash uint64 dei frame.
+    """
+    frames = resize_stack(frames, PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE)
+    dct = dct_matrix(PHASH_IMAGE_SIZE, HASH_SIZE)
+    coefficients = (dct @ frames.astype(np.float64) @ dct.T).reshape(len(frames), -1)
+    medians = np.median(coefficients, axis=1, keepdims=True)
+
+    ties = np.nonzero((np.abs(coefficients - medians) < TIE_TOLERANCE).any(axis=1))[0]
+    if len(ties):
+        exact = scipy.fftpack.dct(scipy.fftpack.dct(frames[ties], axis=1), axis=2)[:, :HASH_SIZE, :HASH_SIZE]
+        coefficients[ties] = exact.reshape(len(ties), -1)
+        medians[ties] = np.median(coefficients[ties], axis=1, keepdims=True)
+    return bits_to_int(coefficients > medians)
+
+
+def dhash_stack(frames):
+    """
+    Calcola il dhash di tutti i frame: confronto tra pixel adiacenti su 9x8.
+
+    Coincide con imagehash.dhash applicato agli stessi frame. Da hash_stack riceve il buffer 32x32,
+    quindi non coincide con imagehash.dhash sul frame a piena risoluzione.
+    """
+    small = resize_stack(frames, HASH_SIZE + 1, HASH_SIZE)
+    return bits_to_int(small[:, :, 1:] > small[:, :, :-1])
+
+
+def ahash_stack(frames):
+    """
+    Calcola l'average hash di tutti i frame: pixel 8x8 sopra la media.
+
+    Coincide con imagehash.average_hash applicato agli stessi frame; come dhash_stack, in hash_stack
+    lavora sul buffer 32x32 e non sul frame a piena risoluzione.
+    """
+    small = resize_stack(frames, HASH_SIZE, HASH_SIZE)
+    return bits_to_int(small > small.reshape(len(small), -1).mean(axis=1)[:, None, None])
+
+
+def hash_stack(frames):
+    """
+    Calcola phash, dhash e average hash di una pila di frame in scala di grigi.
+
+    I frame vengono ridotti una sola volta a 32x32 come in imagehash.phash, quindi il phash è uguale
+    a imagehash.phash sul frame originale. dhash e average hash sono ricavati dallo stesso buffer
+    32x32 quasi senza costo: sono uguali a imagehash.dhash/average_hash sul buffer, non sul frame
+    originale, e vanno confrontati solo con hash calcolati allo stesso modo.
+
+    Returns:
+    tuple: Tre array uint64 (phash, dhash, ahash), uno per frame.
+    """
+    frames = resize_stack(frames, PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE)
+    return phash_stack(frames), dhash_stack(frames), ahash_stack(frames)
+
+
+def combine_bits_mode(values):
+    """Combina gli hash a 64 bit scegliendo per ogni bit il valore della maggioranza (come combine_hashes_mode)."""
+    bits = np.unpackbits(np.asarray(values, dtype=np.uint64).astype('>u8').view(np.uint8).reshape(len(values), 8), axis=1)
+    return int(bits_to_int((bits.sum(axis=0) * 2 > len(values))[None, :])[0])
@@ -0,0 +1,84 @@
+from collections import defaultdict
+
+
+class UnionFind:
+    """
+    Insiemi disgiunti (union-find) con compressione dei percorsi e unione per dimensione.
+
+    Gli elementi vengono aggiunti alla prima chiamata di find o union; ogni operazione
+    costa in pratica tempo costante, quindi raggruppare N coppie è lineare in N.
+    """
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, item):
+        """Restituisce il rappresentante dell'insieme che contiene l'elemento."""
+        parent = self.parent
+        if item not in parent:
+            parent[item] = item
+            self.size[item] = 1
+            return item
+
+        root = item
+        while parent[root] != root:
+            root = parent[root]
+        # Compressione dei percorsi: tutti gli elementi visitati puntano direttamente alla radice
+        while parent[item] != root:
+            next_item = parent[item]
+            parent[item] = root
+            item = next_item
+        return root
+
+    def union(self, item1, item2):
+        """Unisce gli insiemi dei due elementi e restituisce il nuovo rappresentante."""
+        root1, root2 = self.find(item1), self.find(item2)
+        if root1 == root2:
+            return root1
+        if self.size[root1] < self.size[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.size[root1] += self.size[root2]
+        return root1
+
+    def groups(self):
+        """Restituisce gli insiemi come liste di elementi."""
+        groups = defaultdict(list)
+        for item in self.parent:
+            groups[self.find(item)].append(item)
+        return list(groups.values())
+
+
+def cluster_pairs(pairs):
+    """
+    Unisce le coppie simili in gruppi connessi: se A~B e B~C, A, B e C finiscono nello stesso gruppo.
+
+    Parameters:
+    pairs (iterable): Tuple che iniziano con (id1, id2, ...).
+
+    Returns:
+    list: Gruppi di id (liste con almeno due elementi), in ordine del loro id più basso.
+    """
+    union_find = UnionFind()
+    for pair in pairs:
+        union_find.union(pair[0], pair[1])
+    return sorted((sorted(group) for group in union_find.groups()), key=lambda group: group[0])
+
+
+def rank_group(members, metadata):
+    """
+    Ordina i membri di un gruppo dal migliore al peggiore: il primo è il video consigliato da tenere.
+
+    Parameters:
+    members (list): Id dei video del gruppo.
+    metadata (dict): id -> (pixel, dimensione in byte, durata in secondi); i valori mancanti contano come 0.
+
+    Returns:
+    list: Id ordinati per risoluzione, dimensione e durata decrescenti; a parità vince l'id più basso.
+    """
+    def rank(video_id):
+        pixels, size, duration = metadata.get(video_id, (None, None, None))
+        return (-(pixels or 0), -(size or 0), -(duration or 0), video_id)
+
+    return sorted(members, key=rank)
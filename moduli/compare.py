@@ -1,8 +1,19 @@
 import json
 import logging
-from moduli.database_manager import fetch_videos
+import math
+from collections import defaultdict
+from moduli.database_manager import (fetch_videos_by_ids, fetch_sequences, fetch_block_metadata,
+                                     fetch_exact_duplicate_pairs, fetch_last_video_id, batched_writes, insert_similarities,
+                                     clear_similarities, get_compare_state, set_compare_state, iter_similarities,
+                                     fetch_keeper_metadata, save_duplicate_groups, fetch_duplicate_groups,
+                                     fetch_confirmation_hashes)
 from moduli.utils import format_size, format_duration
 from moduli.hash_utils import hamming_distance
+from moduli.hash_index import find_similar_pairs, popcount
+from moduli.hash_file import open_hash_index
+from moduli.temporal import find_temporal_matches
+from moduli.clustering import cluster_pairs, rank_group
+from moduli.metrics import metrics, timed
 from tqdm import tqdm
 import hashlib
 import configparser
@@ -24,88 +35,439 @@ try:
 except KeyError:
     raise KeyError("La configurazione 'DIR_TO_PROCESS' non è stata trovata nel file 'config.ini'.")
 
-# Calcola il nome del file del database usando un hash Blake2b a 128 bit, se non è definito nel file di configurazione
+# Nome dei file esportati dal confronto: hash Blake2b a 128 bit della directory, se DB_FILE non è definito nel file di configurazione
 DB_FILE = config['Database'].get('DB_FILE', None)
-JSON_FILE = "similarities.json"
+RESULTS_NAME = "similarities"
 if not DB_FILE:
-    # Calcola hash Blake2b con output di 128 bit per creare il nome del DB
-    JSON_FILE = hashlib.blake2b(DIR_TO_PROCESS.encode(), digest_size=16).hexdigest() + '.json'
+    RESULTS_NAME = hashlib.blake2b(DIR_TO_PROCESS.encode(), digest_size=16).hexdigest()
 
 # Crea la directory per il database se non esiste
 db_path = Path("database")
 db_path.mkdir(parents=True, exist_ok=True)
 
-# Costruisci il percorso completo del file del database
+# I file vengono scritti solo quando servono (EXPORT_NDJSON, impronte temporali): il percorso viene stampato allora
+RESULTS_BASE = (db_path / RESULTS_NAME).resolve()
 
-JSON_FILE = db_path / JSON_FILE
-# Converte il nome del file del database in un percorso assoluto e stampa
-JSON_FILE = str(Path(JSON_FILE).resolve())
-print(f"JSON_FILE: {JSON_FILE}")
+# Esportazione opzionale dei risultati, un oggetto JSON per riga
+NDJSON_FILE = str(RESULTS_BASE.with_suffix('.ndjson'))
+GROUPS_NDJSON_FILE = str(RESULTS_BASE.with_suffix('.groups.ndjson'))
+EXPORT_NDJSON = config['Settings'].getboolean('EXPORT_NDJSON', fallback=False)
+
+# Numero di coppie salvate per istruzione di inserimento
+SIMILARITY_BATCH_SIZE = 1000
+
+# File con le corrispondenze trovate dall'allineamento delle impronte temporali
+TEMPORAL_JSON_FILE = str(RESULTS_BASE.with_suffix('.temporal.json'))
+
+# Confronto a cascata: le coppie trovate con il phash devono avere anche dhash e/o average hash combinati
+# sotto CONFIRM_DISTANCE; i video elaborati prima della versione 9 dello schema non hanno questi hash e passano
+CONFIRM_HASHES = [name.strip() for name in config['Settings'].get('CONFIRM_HASHES', fallback='').split(',') if name.strip()]
+CONFIRM_DISTANCE = config['Settings'].getint('CONFIRM_DISTANCE', fallback=10)
+CONFIRM_COLUMNS = {"dhash": "combined_dhash", "ahash": "combined_ahash"}
+if set(CONFIRM_HASHES) - set(CONFIRM_COLUMNS):
+    raise ValueError(f"CONFIRM_HASHES non valido: {', '.join(CONFIRM_HASHES)} (valori ammessi: {', '.join(CONFIRM_COLUMNS)})")
+
+# Suddivisione in blocchi: si confrontano solo video con durata e rapporto d'aspetto compatibili
+BLOCKING_ENABLED = config.getboolean('Blocking', 'ENABLED', fallback=False)
+DURATION_TOLERANCE = config.getfloat('Blocking', 'DURATION_TOLERANCE', fallback=0.1)
+DURATION_TOLERANCE_SECONDS = config.getfloat('Blocking', 'DURATION_TOLERANCE_SECONDS', fallback=2.0)
+ASPECT_TOLERANCE = config.getfloat('Blocking', 'ASPECT_TOLERANCE', fallback=0.05)
+
+# Parametri dell'allineamento temporale
+TEMPORAL_INTERVAL = config.getfloat('Temporal', 'INTERVAL', fallback=2.0)
+TEMPORAL_FRAME_DISTANCE = config.getint('Temporal', 'FRAME_DISTANCE', fallback=6)
+TEMPORAL_MIN_OVERLAP = config.getfloat('Temporal', 'MIN_OVERLAP', fallback=0.5)
+TEMPORAL_MIN_FRAMES = config.getint('Temporal', 'MIN_FRAMES', fallback=3)
 
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', filename="video_comparison.log")
 
-def compare_video_pair(video1, video2, distance_threshold):
-    """Confronta una coppia di video e restituisce un dizionario con i dettagli se la somiglianza è sotto la soglia."""
-    id1, resolution1, size1, duration1, video_path1, combined_hash1, *frame_paths1 = video1
-    id2, resolution2, size2, duration2, video_path2, combined_hash2, *frame_paths2 = video2
+def video_details(video):
+    """Restituisce i dettagli di un video (record di fetch_videos_by_ids) nel formato dei risultati."""
+    video_id, resolution, size, duration, video_path, combined_hash, *frame_paths = video
+    return {
+        "id": video_id,
+        "video_path": video_path,
+        "resolution": resolution,
+        "size": format_size(size),
+        "duration": format_duration(duration),
+        "frame_paths": frame_paths,
+        "combined_hash": str(combined_hash)
+    }
 
-    # Calcola la distanza Hamming tra gli hash combinati
+def pair_distance(video1, video2):
+    """Calcola la distanza Hamming tra gli hash combinati di due video; None se non è calcolabile."""
     try:
-        distance = hamming_distance(combined_hash1, combined_hash2)
+        return hamming_distance(video1[5], video2[5])
     except Exception as e:
-        logging.warning(f"Errore nel calcolo della distanza Hamming tra {video_path1} e {video_path2}: {e}")
+        logging.warning(f"Errore nel calcolo della distanza Hamming tra {video1[4]} e {video2[4]}: {e}")
         return None
 
-    if distance < distance_threshold:
+def compare_video_pair(video1, video2, distance_threshold):
+    """Confronta una coppia di video e restituisce un dizionario con i dettagli se la somiglianza è sotto la soglia."""
+    distance = pair_distance(video1, video2)
+    if distance is not None and distance < distance_threshold:
         return {
-            "video1": {
-                "id": id1,
-                "video_path": video_path1,
-                "resolution": resolution1,
-                "size": format_size(size1),
-                "duration": format_duration(duration1),
-                "frame_paths": frame_paths1,
-                "combined_hash": str(combined_hash1)
-            },
-            "video2": {
-                "id": id2,
-                "video_path": video_path2,
-                "resolution": resolution2,
-                "size": format_size(size2),
-                "duration": format_duration(duration2),
-                "frame_paths": frame_paths2,
-                "combined_hash": str(combined_hash2)
-            },
+            "video1": video_details(video1),
+            "video2": video_details(video2),
             "hamming_distance": distance
         }
     return None
 
-def compare_hashes(distance_threshold: int) -> None:
-    """Confronta gli hash dei frame di tutti i video e genera un file JSON con i risultati di video simili."""
+def compare_hashes_brute(ids, hashes, distance_threshold, start=0):
+    """
+    Confronta tutte le coppie di video con un doppio ciclo (forza bruta).
+
+    Parameters:
+    ids (list): Id dei video in ordine crescente.
+    hashes (list): Hash combinati interi, nello stesso ordine.
+    distance_threshold (int): Soglia esclusiva sulla distanza Hamming.
+    start (int): Prima riga da confrontare, per riprendere un confronto interrotto.
+
+    Yields:
+    tuple: (id del video della riga, coppie (id1, id2, distanza) trovate confrontandolo con i video successivi)
+    """
+    count = len(hashes)
+    total_comparisons = (count * (count - 1)) // 2
+    done = total_comparisons - ((count - start) * (count - start - 1)) // 2
+
+    # Iterazione senza parallelismo
+    with tqdm(total=total_comparisons, initial=done, desc="Confronto dei video", unit="confronti") as pbar:
+        for i in range(start, count):
+            pairs = []
+            for j in range(i + 1, count):
+                distance = popcount(hashes[i] ^ hashes[j])
+                if distance < distance_threshold:
+                    pairs.append((ids[i], ids[j], distance))
+            pbar.update(count - i - 1)
+            yield ids[i], pairs
+
+def duration_scale(relative_tolerance, absolute_tolerance):
+    """
+    Restituisce (funzione, ampiezza) per raggruppare le durate in bucket.
+
+    Due durate compatibili (differenza entro la tolleranza relativa o assoluta) hanno valori
+    trasformati che distano al massimo un'ampiezza, quindi cadono in bucket uguali o adiacenti.
+    """
+    if relative_tolerance > 0:
+        relative_tolerance = min(relative_tolerance, 0.99)
+        offset = absolute_tolerance / relative_tolerance
+        return (lambda duration: math.log(max(duration + offset, 1e-9))), -math.log(1 - relative_tolerance)
+    return (lambda duration: duration), absolute_tolerance
+
+def is_compatible(meta1, meta2):
+    """Controlla se due video hanno durata e rapporto d'aspetto compatibili con le tolleranze configurate."""
+    (duration1, aspect1), (duration2, aspect2) = meta1, meta2
+    duration_limit = max(DURATION_TOLERANCE_SECONDS, DURATION_TOLERANCE * max(duration1, duration2))
+    if abs(duration1 - duration2) > duration_limit:
+        return False
+    if ASPECT_TOLERANCE > 0 and aspect1 is not None and aspect2 is not None:
+        return abs(aspect1 - aspect2) <= ASPECT_TOLERANCE
+    return True
+
+def build_blocks(metadata):
+    """
+    Raggruppa i video in blocchi sovrapposti per durata e rapporto d'aspetto.
+
+    Ogni video cade in un bucket (durata, aspetto); il blocco (k, a) contiene i bucket da k a k+1
+    e da a ad a+1, così ogni coppia compatibile si trova in almeno un blocco. I video con
+    rapporto d'aspetto sconosciuto entrano in tutti i blocchi della propria durata.
+
+    Parameters:
+    metadata (list): (durata, aspetto o None) per ogni video, nell'ordine degli indici.
+
+    Returns:
+    tuple: (dizionario blocco -> indici dei video, numero di coppie distinte coperte dai blocchi)
+    """
+    scale, width = duration_scale(DURATION_TOLERANCE, DURATION_TOLERANCE_SECONDS)
+    buckets = defaultdict(list)
+    for idx, (duration, aspect) in enumerate(metadata):
+        duration_key = math.floor(scale(duration) / width) if width > 0 else duration
+        aspect_key = math.floor(aspect / ASPECT_TOLERANCE) if ASPECT_TOLERANCE > 0 and aspect is not None else None
+        buckets[(duration_key, aspect_key)].append(idx)
+
+    aspect_keys = {aspect_key for _, aspect_key in buckets}
+    blocks = defaultdict(list)
+    for (duration_key, aspect_key), members in buckets.items():
+        duration_blocks = (duration_key - 1, duration_key) if width > 0 else (duration_key,)
+        if aspect_key is None:
+            aspect_blocks = aspect_keys
+        else:
+            aspect_blocks = (aspect_key - 1, aspect_key)
+        for block_duration in duration_blocks:
+            for block_aspect in aspect_blocks:
+                blocks[(block_duration, block_aspect)].extend(members)
+
+    # Coppie distinte: bucket uguali o adiacenti in entrambe le dimensioni (gli aspetti sconosciuti sono compatibili con tutti)
+    covered_pairs = 0
+    for (duration_key, aspect_key), members in buckets.items():
+        count = len(members)
+        covered_pairs += count * (count - 1) // 2
+        neighbours = set()
+        for other_duration in ((duration_key - 1, duration_key, duration_key + 1) if width > 0 else (duration_key,)):
+            other_aspects = aspect_keys if aspect_key is None else (aspect_key - 1, aspect_key, aspect_key + 1, None)
+            for other_aspect in other_aspects:
+                neighbours.add((other_duration, other_aspect))
+        neighbours.discard((duration_key, aspect_key))
+        # Ogni coppia di bucket distinti viene contata una volta sola
+        covered_pairs += sum(count * len(buckets[key]) for key in neighbours if key in buckets) / 2
+
+    return blocks, int(covered_pairs)
+
+def find_similar_pairs_blocked(hashes, metadata, distance_threshold, method):
+    """Cerca le coppie simili solo all'interno dei blocchi di video compatibili e riporta quante coppie sono state saltate."""
+    blocks, covered_pairs = build_blocks(metadata)
+    valid = sum(1 for value in hashes if value is not None)
+    total_pairs = len(hashes) * (len(hashes) - 1) // 2
+
+    found = set()
+    with tqdm(total=len(blocks), desc=f"Confronto dei video a blocchi ({method})", unit="blocchi") as pbar:
+        for members in blocks.values():
+            if len(members) > 1:
+                members = sorted(set(members))
+                block_pairs, _ = find_similar_pairs([hashes[idx] for idx in members], distance_threshold, method, log=False)
+                for i, j, distance in block_pairs:
+                    if is_compatible(metadata[members[i]], metadata[members[j]]):
+                        found.add((members[i], members[j], distance))
+            pbar.update(1)
+
+    skipped = total_pairs - covered_pairs
+    logging.info(
+        f"Blocchi per durata e aspetto: {len(blocks)} blocchi, {skipped} coppie su {total_pairs} saltate "
+        f"({(skipped / total_pairs * 100) if total_pairs else 0:.1f}%), {valid} hash validi."
+    )
+    print(f"Coppie saltate dai blocchi: {skipped} su {total_pairs}")
+    return sorted(found)
+
+def compare_hashes_indexed(distance_threshold, method, hash_index):
+    """Confronta i video con un indice di ricerca (BK-tree, multi-index hashing) o con il motore vettoriale numpy.
+
+    Gli hash arrivano dall'indice degli hash mappato in memoria (hash_index), senza caricare i dettagli
+    dei video; il motore numpy lavora direttamente sulla colonna mappata.
+    Se la suddivisione in blocchi è attiva, si confrontano solo video con durata e aspetto compatibili.
+
+    Returns:
+    list: Coppie (id1, id2, distanza) con id1 < id2.
+    """
+    ids = hash_index.ids
+
+    if BLOCKING_ENABLED:
+        block_metadata = fetch_block_metadata()
+        pairs = find_similar_pairs_blocked(hash_index.hashes.tolist(), [block_metadata[video_id] for video_id in ids.tolist()],
+                                           distance_threshold, method)
+    else:
+        with tqdm(total=len(ids), desc=f"Confronto dei video ({method})", unit="video") as pbar:
+            pairs, stats = find_similar_pairs(hash_index.hashes, distance_threshold, method, progress=pbar.update)
+        print(f"Candidati scartati: {stats['pruned']} su {stats['total_pairs']} coppie")
+
+    return [(int(ids[i]), int(ids[j]), distance) for i, j, distance in pairs]
+
+def confirm_pairs(pairs, confirmation):
+    """
+    Secondo stadio del confronto a cascata: tiene solo le coppie confermate dagli hash di conferma.
+
+    Parameters:
+    pairs (list): Coppie (id1, id2, distanza) trovate con il phash.
+    confirmation (dict): id del video -> hash di conferma (fetch_confirmation_hashes).
+
+    Returns:
+    list: Coppie con ogni hash di conferma sotto CONFIRM_DISTANCE; un hash mancante non esclude la coppia.
+    """
+    confirmed = []
+    for id1, id2, distance in pairs:
+        hashes1, hashes2 = confirmation.get(id1, ()), confirmation.get(id2, ())
+        if all(hash1 is None or hash2 is None or bin(hash1 ^ hash2).count('1') < CONFIRM_DISTANCE
+               for hash1, hash2 in zip(hashes1, hashes2)):
+            confirmed.append((id1, id2, distance))
+    return confirmed
+
+def save_similarities(pairs, exact=False):
+    """Salva le coppie (id1, id2, distanza) nella tabella similarities, a lotti di SIMILARITY_BATCH_SIZE."""
+    for start in range(0, len(pairs), SIMILARITY_BATCH_SIZE):
+        insert_similarities([(id1, id2, distance, exact) for id1, id2, distance in pairs[start:start + SIMILARITY_BATCH_SIZE]])
+
+def save_exact_duplicates():
+    """
+    Salva le copie identiche byte per byte come duplicati esatti con distanza 0.
+
+    Le coppie con lo stesso digest del contenuto vengono riportate anche se il confronto
+    degli hash non le ha trovate; se l'avevano già trovate, vengono marcate come esatte.
+    """
+    exact_pairs = fetch_exact_duplicate_pairs()
+    save_similarities([(id1, id2, 0) for id1, id2 in exact_pairs], exact=True)
+    logging.info(f"Duplicati esatti riportati: {len(exact_pairs)} coppie.")
+
+@timed("compare")
+def compare_hashes(distance_threshold: int, method: str = "brute") -> None:
+    """
+    Confronta gli hash dei frame di tutti i video e salva le coppie simili nella tabella similarities.
+
+    Le coppie vengono salvate a lotti man mano che vengono trovate, insieme a un checkpoint: se il
+    confronto si interrompe, la volta successiva riprende da dove era arrivato, purché metodo, soglia
+    e blocchi siano gli stessi e nel frattempo non siano stati aggiunti video.
+
+    Con CONFIRM_HASHES il confronto è a cascata: il phash seleziona i candidati, dhash e average hash li confermano.
+    """
     try:
-        videos = fetch_videos()
+        run = {"method": method, "threshold": distance_threshold, "blocking": BLOCKING_ENABLED, "last_video_id": fetch_last_video_id(),
+               "confirm": f"{','.join(CONFIRM_HASHES)}:{CONFIRM_DISTANCE}" if CONFIRM_HASHES else ""}
+        state = get_compare_state()
+        resume = all(state.get(key) == str(value) for key, value in run.items())
+
+        if resume and state.get("completed") == "1":
+            logging.info("Confronto già completato per questi video, risultati invariati.")
+            print("Confronto già completato, risultati invariati.")
+        else:
+            with batched_writes():
+                if not resume:
+                    clear_similarities()
+                    set_compare_state(**run, position=0, completed=0)
+
+                confirmation = fetch_confirmation_hashes([CONFIRM_COLUMNS[name] for name in CONFIRM_HASHES]) if CONFIRM_HASHES else None
+                if confirmation is not None:
+                    logging.info(f"Confronto a cascata: conferma con {', '.join(CONFIRM_HASHES)} sotto {CONFIRM_DISTANCE} bit.")
+
+                # Solo id e hash dall'indice mappato in memoria; percorsi e metadati si leggono dopo, per i video trovati
+                with open_hash_index() as hash_index:
+                    if method == "brute" and not BLOCKING_ENABLED:
+                        ids, hashes = hash_index.ids.tolist(), hash_index.hashes.tolist()
+                        # Riprende dal primo video dopo l'ultimo checkpoint (gli id sono in ordine crescente)
+                        position = int(state.get("position", 0)) if resume else 0
+                        start = next((idx for idx, video_id in enumerate(ids) if video_id > position), len(ids))
+                        if start:
+                            logging.info(f"Ripresa del confronto dal video {start + 1} di {len(ids)}.")
+                        for video_id, pairs in compare_hashes_brute(ids, hashes, distance_threshold, start):
+                            save_similarities(pairs if confirmation is None else confirm_pairs(pairs, confirmation))
+                            set_compare_state(position=video_id)
+                    else:
+                        pairs = compare_hashes_indexed(distance_threshold, method, hash_index)
+                        if confirmation is not None:
+                            confirmed = confirm_pairs(pairs, confirmation)
+                            print(f"Coppie confermate da {', '.join(CONFIRM_HASHES)}: {len(confirmed)} su {len(pairs)}")
+                            pairs = confirmed
+                        save_similarities(pairs)
+
+                save_exact_duplicates()
+                set_compare_state(completed=1)
+    except Exception as e:
+        logging.error(f"Errore nel recupero o nel confronto dei video: {e}")
+        return
+
+    try:
+        with metrics.stage("grouping"):
+            groups = group_similarities()
+            save_duplicate_groups(groups)
+        logging.info(f"Gruppi di duplicati: {len(groups)} gruppi con {sum(len(group) for group in groups)} video.")
+        print(f"Gruppi di duplicati: {len(groups)}")
     except Exception as e:
-        logging.error(f"Errore nel recupero dei video dal database: {e}")
+        logging.error(f"Errore nel raggruppamento dei video simili: {e}")
         return
 
-    similarities = []
-    total_comparisons = (len(videos) * (len(videos) - 1)) // 2
+    if EXPORT_NDJSON:
+        export_similarities_ndjson(NDJSON_FILE)
+        write_ndjson(GROUPS_NDJSON_FILE, iter_group_records(groups))
 
-    # Iterazione senza parallelismo
-    with tqdm(total=total_comparisons, desc="Confronto dei video", unit="confronti") as pbar:
-        for i in range(len(videos)):
-            for j in range(i + 1, len(videos)):
-                result = compare_video_pair(videos[i], videos[j], distance_threshold)
-                if result:
-                    similarities.append(result)
-                pbar.update(1)
-
-    # Salva i risultati in un file JSON
+def group_similarities(max_distance=None):
+    """
+    Unisce le coppie simili in gruppi connessi (union-find) e ordina ogni gruppo per scegliere il video da tenere.
+
+    Parameters:
+    max_distance (int): Se indicato, considera solo le coppie con distanza <= max_distance.
+
+    Returns:
+    list: Gruppi di id, ciascuno dal video consigliato da tenere (risoluzione, dimensione e durata maggiori) al peggiore.
+    """
+    groups = cluster_pairs(iter_similarities(max_distance))
+    metadata = fetch_keeper_metadata({video_id for group in groups for video_id in group})
+    return [rank_group(group, metadata) for group in groups]
+
+def iter_group_records(groups, batch_size=SIMILARITY_BATCH_SIZE):
+    """
+    Completa i gruppi di id con i dettagli dei video, un lotto di gruppi alla volta.
+
+    Yields:
+    dict: group_id, keeper_id e videos (dettagli come in compare_video_pair, dal consigliato al peggiore).
+    """
+    for start in range(0, len(groups), batch_size):
+        batch = groups[start:start + batch_size]
+        videos = fetch_videos_by_ids({video_id for group in batch for video_id in group})
+        for group_id, group in enumerate(batch, start=start + 1):
+            members = [video_details(videos[video_id]) for video_id in group if video_id in videos]
+            if len(members) > 1:
+                yield {"group_id": group_id, "keeper_id": members[0]["id"], "videos": members}
+
+def load_duplicate_groups(max_distance=None):
+    """Legge i gruppi salvati dall'ultimo confronto (o li ricalcola per una distanza massima diversa) con i dettagli dei video."""
+    groups = fetch_duplicate_groups() if max_distance is None else group_similarities(max_distance)
+    return list(iter_group_records(groups))
+
+def iter_similarity_records(max_distance=None, batch_size=SIMILARITY_BATCH_SIZE):
+    """
+    Legge i risultati dalla tabella similarities e li completa con i dettagli dei video, un lotto alla volta.
+
+    Yields:
+    dict: video1, video2 (dettagli come in compare_video_pair), hamming_distance ed
+          exact_duplicate (presente solo per le copie identiche).
+    """
+    rows = iter_similarities(max_distance, batch_size)
+    while True:
+        batch = [row for _, row in zip(range(batch_size), rows)]
+        if not batch:
+            return
+        videos = fetch_videos_by_ids({video_id for row in batch for video_id in row[:2]})
+        for id1, id2, distance, exact in batch:
+            if id1 in videos and id2 in videos:
+                record = {"video1": video_details(videos[id1]), "video2": video_details(videos[id2]), "hamming_distance": distance}
+                if exact:
+                    record["exact_duplicate"] = True
+                yield record
+
+def write_ndjson(output_file, records):
+    """Scrive i record in formato NDJSON (un oggetto JSON per riga), man mano che vengono generati."""
+    try:
+        count = 0
+        with open(output_file, 'w', encoding='utf-8') as ndjson_file:
+            for record in records:
+                ndjson_file.write(json.dumps(record) + '\n')
+                count += 1
+        logging.info(f"File {output_file} creato con successo: {count} record.")
+        print(f"Risultati esportati: {output_file}")
+    except Exception as e:
+        logging.error(f"Errore durante la scrittura del file {output_file}: {e}")
+
+def export_similarities_ndjson(output_file, max_distance=None):
+    """Esporta le coppie simili in formato NDJSON, leggendole a lotti dal database."""
+    write_ndjson(output_file, iter_similarity_records(max_distance))
+
+@timed("compare_temporal")
+def compare_temporal() -> None:
+    """Allinea le impronte temporali di tutti i video e genera un file JSON con i video che condividono contenuto."""
     try:
-        with open(JSON_FILE, 'w') as json_file:
-            json.dump(similarities, json_file, indent=4)
-        logging.info(f"File {JSON_FILE} creato con successo.")
+        sequences = fetch_sequences()
     except Exception as e:
-        logging.error(f"Errore durante la scrittura del file {JSON_FILE}: {e}")
+        logging.error(f"Errore nel recupero delle impronte temporali dal database: {e}")
+        return
 
+    matches = find_temporal_matches(
+        sequences, TEMPORAL_INTERVAL, TEMPORAL_FRAME_DISTANCE, TEMPORAL_MIN_OVERLAP, TEMPORAL_MIN_FRAMES
+    )
+    videos = fetch_videos_by_ids({match[key] for match in matches for key in ("id1", "id2")})
+
+    results = []
+    for match in matches:
+        video1, video2 = videos[match["id1"]], videos[match["id2"]]
+        results.append({
+            "video1": {"id": video1[0], "video_path": video1[4], "duration": format_duration(video1[3])},
+            "video2": {"id": video2[0], "video_path": video2[4], "duration": format_duration(video2[3])},
+            "offset_seconds": match["offset"],
+            "overlap": match["overlap"],
+            "matched_frames": match["matched_frames"],
+        })
+
+    try:
+        with open(TEMPORAL_JSON_FILE, 'w') as json_file:
+            json.dump(results, json_file, indent=4)
+        logging.info(f"File {TEMPORAL_JSON_FILE} creato con successo.")
+        print(f"Corrispondenze temporali: {TEMPORAL_JSON_FILE}")
+    except Exception as e:
+        logging.error(f"Errore durante la scrittura del file {TEMPORAL_JSON_FILE}: {e}")
@@ -1,7 +1,13 @@
 import sqlite3
 import hashlib
 import configparser
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
+from moduli.metrics import metrics
 
 # Load configuration
 config = configparser.ConfigParser()
@@ -36,53 +42,652 @@ DB_FILE_PATH = db_path / DB_FILE
 DB_FILE = str(Path(DB_FILE_PATH).resolve())
 print(f"DB_FILE: {DB_FILE}")
 
+# Parametri delle scritture a lotti: numero massimo di istruzioni e secondi massimi per transazione
+WRITE_BATCH_SIZE = config['Database'].getint('WRITE_BATCH_SIZE', fallback=500)
+WRITE_FLUSH_INTERVAL = config['Database'].getfloat('WRITE_FLUSH_INTERVAL', fallback=1.0)
 
+# Pragma applicati a ogni connessione: WAL permette letture concorrenti alla scrittura,
+# synchronous=NORMAL evita un fsync per ogni commit (in WAL resta sicuro contro la corruzione)
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA foreign_keys=ON",
+)
 
-def connect_db():
-    """Crea una connessione al database SQLite."""
-    return sqlite3.connect(DB_FILE)
 
-def create_table():
-    """Crea la tabella 'videos' nel database se non esiste già."""
+def use_database(db_file):
+    """Usa un altro file di database (ad esempio quello di uno shard) per tutte le operazioni successive."""
+    global DB_FILE
+    DB_FILE = str(Path(db_file).resolve())
+    print(f"DB_FILE: {DB_FILE}")
+
+def shard_database_file(name):
+    """Percorso del database dello shard indicato, accanto al database principale: <nome>.shard-<shard>.db"""
+    db_file = Path(DB_FILE)
+    return str(db_file.with_name(f"{db_file.stem}.shard-{name}{db_file.suffix}"))
+
+def connect_db(db_file=None):
+    """Crea una connessione al database SQLite (predefinito: DB_FILE) con i pragma di CONNECTION_PRAGMAS."""
+    conn = sqlite3.connect(db_file or DB_FILE, timeout=30)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+# Connessioni di lettura, una per thread, riutilizzate tra le chiamate
+_readers = threading.local()
+
+def reader_connection():
+    """Restituisce la connessione di lettura del thread corrente, creandola al primo utilizzo."""
+    conn = getattr(_readers, "conn", None)
+    if conn is None or getattr(_readers, "db_file", None) != DB_FILE:
+        conn = connect_db()
+        _readers.conn = conn
+        _readers.db_file = DB_FILE
+    return conn
+
+
+class DatabaseWriter(threading.Thread):
+    """
+    Thread che possiede l'unica connessione di scrittura del database.
+
+    I worker inviano le istruzioni tramite una coda; il writer le esegue in transazioni
+    da al massimo batch_size istruzioni o flush_interval secondi. Oltre a (sql, parametri)
+    si può accodare una funzione che riceve la connessione, eseguita in un savepoint.
+    """
+
+    _STOP = object()
+
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL, max_queue=10000):
+        super().__init__(name="DatabaseWriter", daemon=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.failed = 0
+        self.error = None  # Errore che ha terminato il thread, se presente
+
+    def _put(self, item):
+        # Con il thread terminato nessuno svuoterebbe più la coda: put e flush resterebbero bloccati per sempre
+        while True:
+            if not self.is_alive():
+                raise RuntimeError(f"Il writer del database è terminato: {self.error}")
+            try:
+                self.queue.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+    def submit(self, sql, params=()):
+        """Accoda un'istruzione SQL o una funzione(conn); blocca se la coda è piena."""
+        self._put((sql, params))
+
+    def flush(self):
+        """
+        Attende che tutte le istruzioni accodate finora siano state salvate.
+
+        Raises:
+        RuntimeError: Se il thread del writer è terminato per un errore.
+        """
+        done = threading.Event()
+        self._put(done)
+        while not done.wait(timeout=1.0):
+            if not self.is_alive():
+                break
+        if self.error is not None:
+            raise RuntimeError(f"Il writer del database è terminato: {self.error}")
+
+    def close(self):
+        """Salva le istruzioni rimanenti e termina il thread."""
+        try:
+            self._put(self._STOP)
+        except RuntimeError:
+            pass  # Thread già terminato per un errore, già registrato
+        self.join()
+
+    def _commit(self, conn):
+        with metrics.stage("sqlite_commit"):
+            conn.commit()
+        metrics.queue_depth("db_writer", self.queue.qsize())
+
+    def run(self):
+        conn = connect_db()
+        pending = 0
+        batch_started = time.monotonic()
+        try:
+            while True:
+                timeout = max(0.0, self.flush_interval - (time.monotonic() - batch_started)) if pending else None
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                if item is self._STOP or isinstance(item, threading.Event) or item is None:
+                    if pending:
+                        self._commit(conn)
+                        pending = 0
+                    if isinstance(item, threading.Event):
+                        item.set()
+                    if item is self._STOP:
+                        return
+                    continue
+
+                sql, params = item
+                started, failed = time.perf_counter(), False
+                try:
+                    if callable(sql):
+                        run_in_savepoint(conn, sql)
+                    else:
+                        conn.execute(sql, params)
+                    self.written += 1
+                except Exception as e:
+                    # Un'istruzione non valida non deve fermare il writer, che ha in coda le scritture di tutti i worker
+                    self.failed += 1
+                    failed = True
+                    logging.error(f"Errore durante la scrittura nel database: {e}")
+                metrics.observe("sqlite_write", time.perf_counter() - started, failed)
+
+                if pending == 0:
+                    batch_started = time.monotonic()
+                pending += 1
+                if pending >= self.batch_size or time.monotonic() - batch_started >= self.flush_interval:
+                    self._commit(conn)
+                    pending = 0
+        except Exception as e:
+            self.error = e
+            logging.exception("Il writer del database si è interrotto")
+        finally:
+            try:
+                conn.commit()
+            finally:
+                conn.close()
+                self._drain()
+
+    def _drain(self):
+        # Le istruzioni rimaste in coda vanno perse: sblocca chi attende un flush e le conta come fallite
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is not self._STOP:
+                self.failed += 1
+
+def run_in_savepoint(conn, write):
+    """Esegue write(conn) in un savepoint, annullandone tutte le istruzioni in caso di errore."""
+    if not conn.in_transaction:
+        conn.execute("BEGIN")  # Altrimenti il RELEASE del savepoint esterno farebbe il commit
+    conn.execute("SAVEPOINT write_item")
+    try:
+        write(conn)
+    except Exception:
+        conn.execute("ROLLBACK TO write_item")
+        conn.execute("RELEASE write_item")
+        raise
+    conn.execute("RELEASE write_item")
+
+# Writer attivo durante una scansione; None se le scritture avvengono direttamente
+_writer = None
+
+@contextmanager
+def batched_writes(batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL):
+    """Avvia un DatabaseWriter per la durata del blocco; insert_video userà la sua coda."""
+    global _writer
+    writer = DatabaseWriter(batch_size, flush_interval)
+    writer.start()
+    _writer = writer
+    try:
+        yield writer
+    finally:
+        _writer = None
+        writer.close()
+        logging.info(f"Scritture a lotti completate: {writer.written} istruzioni, {writer.failed} errori.")
+
+def execute_write(sql, params=()):
+    """Esegue un'istruzione di scrittura (o una funzione(conn)) tramite il writer attivo o, in sua assenza, direttamente."""
+    if _writer is not None:
+        _writer.submit(sql, params)
+        return
     with connect_db() as conn:
-        cursor = conn.cursor()
+        if callable(sql):
+            run_in_savepoint(conn, sql)
+        else:
+            conn.execute(sql, params)
+        conn.commit()
+
+# Versione corrente dello schema, salvata in PRAGMA user_version
+SCHEMA_VERSION = 10
+
+# Numero di bande da 16 bit in cui viene diviso l'hash combinato a 64 bit (colonne indicizzate hash_band0..3)
+HASH_BANDS = 4
+
+# Tabelle e indici della versione corrente dello schema
+SCHEMA_STATEMENTS = (
+    """
+    CREATE TABLE IF NOT EXISTS videos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        resolution TEXT,
+        size INTEGER,
+        duration REAL,
+        video_path TEXT UNIQUE,
+        combined_hash INTEGER,
+        hash_band0 INTEGER,
+        hash_band1 INTEGER,
+        hash_band2 INTEGER,
+        hash_band3 INTEGER,
+        width INTEGER,
+        height INTEGER,
+        codec TEXT,
+        fps REAL,
+        bitrate INTEGER,
+        stream_count INTEGER,
+        mtime REAL,
+        inode INTEGER,
+        content_digest TEXT,
+        combined_dhash INTEGER,
+        combined_ahash INTEGER,
+        partial_digest TEXT,
+        shard_id INTEGER,
+        shard_video_id INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS video_frames (
+        video_id INTEGER NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+        frame_index INTEGER NOT NULL,
+        timestamp REAL,
+        frame_hash INTEGER,
+        frame_path TEXT,
+        PRIMARY KEY (video_id, frame_index)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS frame_previews (
+        video_id INTEGER NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+        frame_index INTEGER NOT NULL,
+        image BLOB NOT NULL,
+        PRIMARY KEY (video_id, frame_index)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS shards (
+        id INTEGER PRIMARY KEY,
+        path TEXT NOT NULL UNIQUE,
+        merged_at REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS video_sequences (
+        video_id INTEGER NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        timestamp REAL,
+        frame_hash INTEGER,
+        PRIMARY KEY (video_id, position)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS similarities (
+        video_id1 INTEGER NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+        video_id2 INTEGER NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+        distance INTEGER NOT NULL,
+        exact INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (video_id1, video_id2)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS compare_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS review_journal (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        action TEXT NOT NULL,
+        video_id1 INTEGER,
+        video_id2 INTEGER,
+        deleted_video_id INTEGER,
+        created_at REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS duplicate_groups (
+        video_id INTEGER PRIMARY KEY REFERENCES videos(id) ON DELETE CASCADE,
+        group_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_videos_size ON videos(size)",
+    "CREATE INDEX IF NOT EXISTS idx_videos_duration ON videos(duration)",
+    "CREATE INDEX IF NOT EXISTS idx_videos_hash_band0 ON videos(hash_band0)",
+    "CREATE INDEX IF NOT EXISTS idx_videos_hash_band1 ON videos(hash_band1)",
+    "CREATE INDEX IF NOT EXISTS idx_videos_hash_band2 ON videos(hash_band2)",
+    "CREATE INDEX IF NOT EXISTS idx_videos_hash_band3 ON videos(hash_band3)",
+    "CREATE INDEX IF NOT EXISTS idx_videos_content_digest ON videos(content_digest)",
+    "CREATE INDEX IF NOT EXISTS idx_videos_partial_digest ON videos(size, partial_digest)",
+    "CREATE INDEX IF NOT EXISTS idx_videos_shard ON videos(shard_id, shard_video_id)",
+    "CREATE INDEX IF NOT EXISTS idx_similarities_distance ON similarities(distance)",
+    "CREATE INDEX IF NOT EXISTS idx_similarities_video_id2 ON similarities(video_id2)",
+    "CREATE INDEX IF NOT EXISTS idx_duplicate_groups_group_id ON duplicate_groups(group_id, rank)",
+)
+
+# Colonne aggiunte alla tabella 'videos' della versione 1 dopo la sua prima release, con il relativo tipo
+EXTRA_COLUMNS = {
+    "width": "INTEGER",
+    "height": "INTEGER",
+    "codec": "TEXT",
+    "fps": "REAL",
+    "bitrate": "INTEGER",
+    "stream_count": "INTEGER",
+    "mtime": "REAL",
+    "inode": "INTEGER",
+}
+
+# Hash combinati di conferma aggiunti dalla versione 9 (dhash e average hash), usati dal confronto a cascata
+CONFIRM_HASH_COLUMNS = {
+    "combined_dhash": "INTEGER",
+    "combined_ahash": "INTEGER",
+}
+
+# Colonne aggiunte dalla versione 10 per gli shard: digest parziale (identità del contenuto tra shard),
+# shard di provenienza e id del video nel suo database, da cui leggere le anteprime dopo l'unione
+SHARD_COLUMNS = {
+    "partial_digest": "TEXT",
+    "shard_id": "INTEGER",
+    "shard_video_id": "INTEGER",
+}
+
+# Colonne aggiunte alla tabella 'videos' da ciascuna versione dello schema successiva alla 8
+ADDED_COLUMNS = {
+    9: CONFIRM_HASH_COLUMNS,
+    10: SHARD_COLUMNS,
+}
+
+# Colonne comuni alle versioni 1 e 2, copiate così come sono durante la migrazione
+SHARED_COLUMNS = ("id", "resolution", "size", "duration", "video_path") + tuple(EXTRA_COLUMNS)
+
+# Colonne copiate dalla riga dell'originale quando si registra una copia identica
+FINGERPRINT_COLUMNS = ("resolution, size, duration, combined_hash, hash_band0, hash_band1, hash_band2, hash_band3, "
+                       "width, height, codec, fps, bitrate, stream_count, combined_dhash, combined_ahash, partial_digest")
+
+# Colonne restituite da fetch_videos; l'hash e i percorsi dei frame vengono aggiunti in coda
+VIDEO_COLUMNS = "id, resolution, size, duration, video_path, combined_hash"
+
+def hash_to_db(value):
+    """Converte un hash senza segno a 64 bit nell'intero con segno memorizzabile da SQLite."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def hash_from_db(value):
+    """Converte l'intero con segno letto da SQLite nell'hash senza segno a 64 bit."""
+    return value + (1 << 64) if value is not None and value < 0 else value
+
+def hash_bands(value):
+    """Divide l'hash senza segno a 64 bit in HASH_BANDS bande da 16 bit."""
+    return [(value >> (16 * band)) & 0xFFFF for band in range(HASH_BANDS)]
+
+# Prefisso dei riferimenti alle anteprime salvate in frame_previews, restituiti al posto del percorso di un file
+PREVIEW_REF_PREFIX = "db:"
+
+def preview_ref(video_id, frame_index):
+    """Riferimento all'anteprima di un frame salvata nel database."""
+    return f"{PREVIEW_REF_PREFIX}{video_id}/{frame_index}"
+
+def is_preview_ref(frame_path):
+    """Indica se il percorso di un frame è in realtà un riferimento a un'anteprima nel database."""
+    return isinstance(frame_path, str) and frame_path.startswith(PREVIEW_REF_PREFIX)
+
+def add_missing_columns(cursor, columns=EXTRA_COLUMNS):
+    """Aggiunge alla tabella 'videos' le colonne mancanti nei database creati con release precedenti (di default quelle della versione 1)."""
+    cursor.execute("PRAGMA table_info(videos)")
+    existing = {row[1] for row in cursor.fetchall()}
+    for column, column_type in columns.items():
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE videos ADD COLUMN {column} {column_type}")
+
+def get_schema_version(cursor):
+    """Restituisce la versione dello schema: 0 se il database è vuoto, 1 per il vecchio formato con hash TEXT."""
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if version:
+        return version
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'videos'").fetchone()
+    return 1 if exists else 0
+
+def migrate_v1_to_v2(cursor):
+    """
+    Migra sul posto la tabella 'videos' della versione 1.
+
+    Gli hash esadecimali diventano INTEGER a 64 bit e le colonne frame_path1..3 diventano righe
+    di video_frames (con timestamp al 25/50/75% della durata, come in fase di estrazione).
+    """
+    add_missing_columns(cursor)
+    cursor.execute("ALTER TABLE videos RENAME TO videos_v1")
+    for statement in SCHEMA_STATEMENTS:
+        cursor.execute(statement)
+
+    columns = ", ".join(SHARED_COLUMNS)
+    rows = cursor.execute(f"SELECT {columns}, combined_hash, frame_path1, frame_path2, frame_path3 FROM videos_v1").fetchall()
+    migrated = skipped = 0
+    for row in rows:
+        values = row[:len(SHARED_COLUMNS)]
+        combined_hash, *frame_paths = row[len(SHARED_COLUMNS):]
+        try:
+            value = int(combined_hash, 16)
+        except (TypeError, ValueError):
+            logging.warning(f"Hash non valido durante la migrazione, video ignorato: {values[4]}")
+            skipped += 1
+            continue
 
         cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS videos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                resolution TEXT,
-                size INTEGER,
-                duration REAL,
-                video_path TEXT UNIQUE,
-                combined_hash TEXT,
-                frame_path1 TEXT,
-                frame_path2 TEXT,
-                frame_path3 TEXT
-            )
-        """
+            f"INSERT INTO videos ({columns}, combined_hash, hash_band0, hash_band1, hash_band2, hash_band3) "
+            f"VALUES ({', '.join('?' * (len(SHARED_COLUMNS) + 1 + HASH_BANDS))})",
+            (*values, hash_to_db(value), *hash_bands(value)),
         )
-        conn.commit()
+        duration = values[3] or 0.0
+        cursor.executemany(
+            "INSERT INTO video_frames (video_id, frame_index, timestamp, frame_hash, frame_path) VALUES (?, ?, ?, NULL, ?)",
+            [(values[0], idx, duration * (idx + 1) / 4, frame_path) for idx, frame_path in enumerate(frame_paths) if frame_path],
+        )
+        migrated += 1
+
+    cursor.execute("DROP TABLE videos_v1")
+    logging.info(f"Migrazione dello schema alla versione 2: {migrated} video migrati, {skipped} ignorati.")
+
+def create_table(db_file=None):
+    """Crea le tabelle del database (predefinito: DB_FILE) se non esistono già e migra i database creati con versioni precedenti."""
+    conn = connect_db(db_file)
+    conn.isolation_level = None  # Transazione esplicita: la migrazione viene applicata per intero o per niente
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        version = get_schema_version(cursor)
+        if version == 1:
+            migrate_v1_to_v2(cursor)
+        elif version in (2, 3):
+            # Dalla versione 2 alla 3 viene solo aggiunta la tabella video_sequences, creata qui sotto;
+            # la versione 4 aggiunge il digest del contenuto, che deve esistere prima del suo indice
+            cursor.execute("ALTER TABLE videos ADD COLUMN content_digest TEXT")
+        # Le versioni dalla 5 alla 8 aggiungono solo tabelle (similarities, compare_state, review_journal, duplicate_groups,
+        # frame_previews), create qui sotto
+        elif version > SCHEMA_VERSION:
+            raise RuntimeError(f"Versione dello schema del database non supportata: {version}")
+        for added_in, columns in ADDED_COLUMNS.items():
+            if 2 <= version < added_in:
+                # Le nuove colonne restano NULL per i video già elaborati
+                add_missing_columns(cursor, columns)
+        for statement in SCHEMA_STATEMENTS:
+            cursor.execute(statement)
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        cursor.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+def fetch_video_id(video_path):
+    """Restituisce l'id del video con il percorso indicato, oppure None se non è nel database."""
+    cursor = reader_connection().cursor()
+    cursor.execute("SELECT id FROM videos WHERE video_path = ?", (video_path,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def fetch_video_paths_by_size(size):
+    """Restituisce le coppie (id, percorso) dei video con la dimensione indicata."""
+    cursor = reader_connection().cursor()
+    cursor.execute("SELECT id, video_path FROM videos WHERE size = ?", (size,))
+    return cursor.fetchall()
 
 def video_exists_in_db(video_path):
     """Controlla se un video esiste già nel database in base al percorso."""
-    with connect_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM videos WHERE video_path = ?", (video_path,))
-        return cursor.fetchone() is not None
+    return fetch_video_id(video_path) is not None
 
-def insert_video(resolution, size, duration, video_path, combined_hash, frame_path1, frame_path2, frame_path3):
-    """Inserisce le informazioni del video nel database, inclusi i percorsi dei frame."""
-    with connect_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
+def insert_video(resolution, size, duration, video_path, combined_hash, frames,
+                 width=None, height=None, codec=None, fps=None, bitrate=None, stream_count=None, mtime=None, inode=None,
+                 sequence=None, combined_dhash=None, combined_ahash=None, partial_digest=None):
+    """
+    Inserisce le informazioni del video nel database insieme agli hash dei singoli frame.
+
+    Parameters:
+    combined_hash (int): Hash combinato senza segno a 64 bit.
+    combined_dhash, combined_ahash (int): dhash e average hash combinati senza segno a 64 bit, usati per confermare le coppie.
+    partial_digest (str): Digest parziale del file (moduli.exact.partial_digest), salvato dalle scansioni a shard.
+    frames (list): Tuple (timestamp, hash del frame a 64 bit o None, byte JPEG dell'anteprima o None).
+    sequence (list): Tuple (timestamp, hash a 64 bit) dell'impronta temporale, campionata a intervallo fisso.
+    """
+    video_values = (resolution, size, duration, video_path, hash_to_db(combined_hash), *hash_bands(combined_hash),
+                    width, height, codec, fps, bitrate, stream_count, mtime, inode,
+                    None if combined_dhash is None else hash_to_db(combined_dhash),
+                    None if combined_ahash is None else hash_to_db(combined_ahash), partial_digest)
+
+    def write(conn):
+        cursor = conn.execute(
             """
-            INSERT INTO videos (resolution, size, duration, video_path, combined_hash, frame_path1, frame_path2, frame_path3)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO videos (resolution, size, duration, video_path, combined_hash,
+                                hash_band0, hash_band1, hash_band2, hash_band3,
+                                width, height, codec, fps, bitrate, stream_count, mtime, inode,
+                                combined_dhash, combined_ahash, partial_digest)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
-            (resolution, size, duration, video_path, combined_hash, frame_path1, frame_path2, frame_path3),
+            video_values,
         )
-        conn.commit()
+        conn.executemany(
+            "INSERT INTO video_frames (video_id, frame_index, timestamp, frame_hash) VALUES (?, ?, ?, ?)",
+            [
+                (cursor.lastrowid, idx, timestamp, None if frame_hash is None else hash_to_db(frame_hash))
+                for idx, (timestamp, frame_hash, _) in enumerate(frames)
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO frame_previews (video_id, frame_index, image) VALUES (?, ?, ?)",
+            [(cursor.lastrowid, idx, preview) for idx, (_, _, preview) in enumerate(frames) if preview],
+        )
+        if sequence:
+            conn.executemany(
+                "INSERT INTO video_sequences (video_id, position, timestamp, frame_hash) VALUES (?, ?, ?, ?)",
+                [(cursor.lastrowid, idx, timestamp, hash_to_db(frame_hash)) for idx, (timestamp, frame_hash) in enumerate(sequence)],
+            )
+
+    execute_write(write)
+
+def insert_sequence(video_id, sequence):
+    """Salva l'impronta temporale (lista di (timestamp, hash a 64 bit)) di un video già presente nel database."""
+    params = [(video_id, idx, timestamp, hash_to_db(frame_hash)) for idx, (timestamp, frame_hash) in enumerate(sequence)]
+    execute_write(lambda conn: conn.executemany(
+        "INSERT OR REPLACE INTO video_sequences (video_id, position, timestamp, frame_hash) VALUES (?, ?, ?, ?)", params
+    ))
+
+def fetch_digest_candidates():
+    """
+    Restituisce (id, percorso, dimensione, digest parziale, digest del contenuto) dei video che potrebbero
+    avere una copia identica non ancora collegata: quelli con la stessa dimensione di altri video, in
+    gruppi dove almeno un video non ha ancora il digest del contenuto. Ordinati per dimensione e id.
+    """
+    cursor = reader_connection().cursor()
+    cursor.execute(
+        "SELECT id, video_path, size, partial_digest, content_digest FROM videos WHERE size IN "
+        "(SELECT size FROM videos WHERE size > 0 GROUP BY size HAVING COUNT(*) > 1 AND COUNT(content_digest) < COUNT(*)) "
+        "ORDER BY size, id"
+    )
+    return cursor.fetchall()
+
+def save_content_digests(partial_digests, content_digests):
+    """
+    Salva i digest calcolati per i video già presenti nel database.
+
+    Se qualche video riceve il digest del contenuto, il confronto già completato viene segnato come
+    da riprendere, così le nuove coppie di duplicati esatti vengono riportate senza rifarlo da capo.
+
+    Parameters:
+    partial_digests (list): Coppie (digest parziale, id del video).
+    content_digests (list): Coppie (digest del contenuto, id del video).
+    """
+    def write(conn):
+        conn.executemany("UPDATE videos SET partial_digest = ? WHERE id = ?", partial_digests)
+        conn.executemany("UPDATE videos SET content_digest = ? WHERE id = ?", content_digests)
+        if content_digests:
+            conn.execute("UPDATE compare_state SET value = '0' WHERE key = 'completed'")
+
+    execute_write(write)
+
+def copy_video_fingerprint(source_path, video_path, mtime=None, inode=None, content_digest=None):
+    """
+    Registra una copia identica byte per byte di un video già elaborato, riusando la sua impronta.
+
+    Metadati, hash combinato, hash e anteprime dei frame e impronta temporale vengono copiati dalla riga
+    dell'originale, senza decodificare di nuovo il video. Entrambe le righe ricevono il digest
+    del contenuto, usato dal confronto per riportarle come duplicati esatti.
+    """
+    def write(conn):
+        source = conn.execute("SELECT id FROM videos WHERE video_path = ?", (source_path,)).fetchone()
+        if source is None:
+            raise ValueError(f"Video originale non trovato nel database: {source_path}")
+        conn.execute("UPDATE videos SET content_digest = ? WHERE id = ?", (content_digest, source[0]))
+        cursor = conn.execute(
+            f"INSERT INTO videos ({FINGERPRINT_COLUMNS}, video_path, mtime, inode, content_digest) "
+            f"SELECT {FINGERPRINT_COLUMNS}, ?, ?, ?, ? FROM videos WHERE id = ?",
+            (video_path, mtime, inode, content_digest, source[0]),
+        )
+        conn.execute(
+            "INSERT INTO video_frames (video_id, frame_index, timestamp, frame_hash, frame_path) "
+            "SELECT ?, frame_index, timestamp, frame_hash, frame_path FROM video_frames WHERE video_id = ?",
+            (cursor.lastrowid, source[0]),
+        )
+        conn.execute(
+            "INSERT INTO frame_previews (video_id, frame_index, image) "
+            "SELECT ?, frame_index, image FROM frame_previews WHERE video_id = ?",
+            (cursor.lastrowid, source[0]),
+        )
+        conn.execute(
+            "INSERT INTO video_sequences (video_id, position, timestamp, frame_hash) "
+            "SELECT ?, position, timestamp, frame_hash FROM video_sequences WHERE video_id = ?",
+            (cursor.lastrowid, source[0]),
+        )
+
+    execute_write(write)
+
+def load_manifest():
+    """
+    Carica in memoria, con una sola query, i dati di stat di tutti i video nel database.
+
+    Returns:
+    dict: percorso del video -> (id, dimensione, mtime, inode)
+    """
+    cursor = reader_connection().cursor()
+    cursor.execute("SELECT video_path, id, size, mtime, inode FROM videos")
+    return {row[0]: row[1:] for row in cursor.fetchall()}
+
+def update_video_stat(video_id, mtime, inode):
+    """Salva mtime e inode di un video (tramite il writer attivo, se presente), senza toccarne l'impronta."""
+    execute_write("UPDATE videos SET mtime = ?, inode = ? WHERE id = ?", (mtime, inode, video_id))
+
+def delete_videos(video_ids):
+    """Elimina più video dal database in un'unica transazione (tramite il writer attivo, se presente)."""
+    params = [(video_id,) for video_id in video_ids]
+    execute_write(lambda conn: conn.executemany("DELETE FROM videos WHERE id = ?", params))
 
 def clean_database():
     """Pulisce i dati nel database (rimuove tutti i record)."""
@@ -98,19 +703,265 @@ def optimize_database():
         cursor.execute("VACUUM")
         conn.commit()
 
+def fetch_frame_paths(video_ids=None):
+    """
+    Restituisce un dizionario id video -> lista dei frame, in ordine di frame.
+
+    Ogni frame è un riferimento all'anteprima nel database (vedi preview_ref), oppure il percorso
+    del file JPEG per i video elaborati da versioni precedenti, oppure None se non c'è anteprima.
+    Per i video uniti da uno shard il riferimento viene sempre restituito: l'anteprima è nel database dello shard.
+    """
+    query = (
+        "SELECT f.video_id, f.frame_index, f.frame_path, "
+        "p.video_id IS NOT NULL OR (v.shard_id IS NOT NULL AND f.frame_path IS NULL) FROM video_frames f "
+        "JOIN videos v ON v.id = f.video_id "
+        "LEFT JOIN frame_previews p ON p.video_id = f.video_id AND p.frame_index = f.frame_index"
+    )
+    cursor = reader_connection().cursor()
+    if video_ids is None:
+        cursor.execute(f"{query} ORDER BY f.video_id, f.frame_index")
+        rows = cursor.fetchall()
+    else:
+        rows = []
+        video_ids = list(video_ids)
+        for start in range(0, len(video_ids), 500):
+            chunk = video_ids[start:start + 500]
+            cursor.execute(
+                f"{query} WHERE f.video_id IN ({', '.join('?' * len(chunk))}) ORDER BY f.video_id, f.frame_index",
+                chunk,
+            )
+            rows.extend(cursor.fetchall())
+
+    frame_paths = {}
+    for video_id, frame_index, frame_path, has_preview in rows:
+        frame_paths.setdefault(video_id, []).append(preview_ref(video_id, frame_index) if has_preview else frame_path)
+    return frame_paths
+
+def shard_connection(shard_file):
+    """Connessione in sola lettura al database di uno shard, una per thread e per file; None se il file non esiste più."""
+    connections = getattr(_readers, "shards", None)
+    if connections is None:
+        connections = _readers.shards = {}
+    if shard_file not in connections:
+        if not Path(shard_file).exists():
+            return None
+        connections[shard_file] = sqlite3.connect(f"{Path(shard_file).as_uri()}?mode=ro", uri=True, timeout=30)
+    return connections[shard_file]
+
+def fetch_frame_preview(frame_ref):
+    """
+    Restituisce i byte JPEG dell'anteprima indicata da un riferimento di preview_ref, oppure None se non esiste.
+
+    Le anteprime dei video uniti da uno shard non vengono copiate: si leggono dal database dello shard.
+    """
+    video_id, frame_index = (int(value) for value in frame_ref[len(PREVIEW_REF_PREFIX):].split("/"))
+    conn = reader_connection()
+    row = conn.execute("SELECT image FROM frame_previews WHERE video_id = ? AND frame_index = ?", (video_id, frame_index)).fetchone()
+    if row:
+        return row[0]
+
+    shard = conn.execute(
+        "SELECT s.path, v.shard_video_id FROM videos v JOIN shards s ON s.id = v.shard_id WHERE v.id = ?", (video_id,)
+    ).fetchone()
+    shard_conn = shard_connection(shard[0]) if shard else None
+    if shard_conn is None:
+        return None
+    try:
+        row = shard_conn.execute(
+            "SELECT image FROM frame_previews WHERE video_id = ? AND frame_index = ?", (shard[1], frame_index)
+        ).fetchone()
+    except sqlite3.Error as e:
+        logging.warning(f"Impossibile leggere l'anteprima dallo shard {shard[0]}: {e}")
+        return None
+    return row[0] if row else None
+
+def fetch_legacy_frame_paths():
+    """Restituisce (id video, indice del frame, percorso) dei frame ancora salvati come file JPEG separati."""
+    cursor = reader_connection().cursor()
+    cursor.execute("SELECT video_id, frame_index, frame_path FROM video_frames WHERE frame_path IS NOT NULL")
+    return cursor.fetchall()
+
+def fetch_frame_path_owners(frame_paths):
+    """
+    Restituisce, per ogni frame salvato come file, gli id dei video che lo usano.
+
+    Lo stesso file può appartenere a più video: le copie identiche riusano i frame dell'originale
+    e i video con lo stesso nome condividevano la cartella dei frame.
+
+    Returns:
+    dict: percorso del frame -> insieme degli id dei video
+    """
+    frame_paths = list(frame_paths)
+    owners = {frame_path: set() for frame_path in frame_paths}
+    cursor = reader_connection().cursor()
+    for start in range(0, len(frame_paths), 500):
+        chunk = frame_paths[start:start + 500]
+        cursor.execute(f"SELECT frame_path, video_id FROM video_frames WHERE frame_path IN ({', '.join('?' * len(chunk))})", chunk)
+        for frame_path, video_id in cursor.fetchall():
+            owners[frame_path].add(video_id)
+    return owners
+
+def store_frame_previews(previews):
+    """
+    Salva le anteprime dei frame nel database al posto dei file JPEG separati.
+
+    Parameters:
+    previews (list): Tuple (id video, indice del frame, byte JPEG dell'anteprima).
+    """
+    def write(conn):
+        conn.executemany("INSERT OR REPLACE INTO frame_previews (video_id, frame_index, image) VALUES (?, ?, ?)", previews)
+        conn.executemany(
+            "UPDATE video_frames SET frame_path = NULL WHERE video_id = ? AND frame_index = ?",
+            [(video_id, frame_index) for video_id, frame_index, _ in previews],
+        )
+
+    execute_write(write)
+
+def format_video_row(row, frame_paths):
+    """Compone la tupla (id, risoluzione, dimensione, durata, percorso, hash esadecimale, *percorsi dei frame)."""
+    *values, combined_hash = row
+    return (*values, format(hash_from_db(combined_hash), '016x'), *frame_paths.get(row[0], []))
+
 def fetch_videos():
-    """Recupera tutti i record dei video dal database."""
-    with connect_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM videos")
-        return cursor.fetchall()
+    """Recupera tutti i record dei video dal database, con l'hash in esadecimale e i percorsi dei frame in coda."""
+    cursor = reader_connection().cursor()
+    cursor.execute(f"SELECT {VIDEO_COLUMNS} FROM videos ORDER BY id")
+    rows = cursor.fetchall()
+    frame_paths = fetch_frame_paths()
+    return [format_video_row(row, frame_paths) for row in rows]
+
+def fetch_videos_by_ids(video_ids):
+    """Recupera i record di un insieme di video, nello stesso formato di fetch_videos. Restituisce un dizionario id -> record."""
+    video_ids = list(video_ids)
+    frame_paths = fetch_frame_paths(video_ids)
+    cursor = reader_connection().cursor()
+    videos = {}
+    for start in range(0, len(video_ids), 500):
+        chunk = video_ids[start:start + 500]
+        cursor.execute(f"SELECT {VIDEO_COLUMNS} FROM videos WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+        for row in cursor.fetchall():
+            videos[row[0]] = format_video_row(row, frame_paths)
+    return videos
+
+def fetch_hashes(since_id=0):
+    """
+    Legge solo gli id e gli hash combinati (colonna INTEGER), senza percorsi né metadati.
+
+    Parameters:
+    since_id (int): Legge solo i video con id maggiore (gli id non vengono riusati, quindi sono quelli inseriti dopo).
+
+    Returns:
+    tuple: (lista degli id, lista degli hash senza segno a 64 bit), in ordine di id.
+    """
+    cursor = reader_connection().cursor()
+    cursor.execute("SELECT id, combined_hash FROM videos WHERE id > ? ORDER BY id", (since_id,))
+    ids, hashes = [], []
+    for video_id, combined_hash in cursor.fetchall():
+        ids.append(video_id)
+        hashes.append(hash_from_db(combined_hash))
+    return ids, hashes
+
+def fetch_confirmation_hashes(columns, since_id=0):
+    """
+    Legge gli hash di conferma dei video.
+
+    Parameters:
+    columns (list): Colonne da leggere, tra quelle di CONFIRM_HASH_COLUMNS.
+    since_id (int): Legge solo i video con id maggiore, come fetch_hashes.
+
+    Returns:
+    dict: id del video -> tupla degli hash senza segno a 64 bit (None per i video elaborati prima della versione 9).
+    """
+    unknown = set(columns) - set(CONFIRM_HASH_COLUMNS)
+    if unknown:
+        raise ValueError(f"Colonne di conferma non valide: {', '.join(sorted(unknown))}")
+    cursor = reader_connection().cursor()
+    cursor.execute(f"SELECT id, {', '.join(columns)} FROM videos WHERE id > ?", (since_id,))
+    return {video_id: tuple(hash_from_db(value) for value in values) for video_id, *values in cursor.fetchall()}
+
+def fetch_exact_duplicate_pairs():
+    """Restituisce le coppie (id1, id2), con id1 < id2, di video con lo stesso digest del contenuto."""
+    cursor = reader_connection().cursor()
+    cursor.execute(
+        "SELECT a.id, b.id FROM videos a JOIN videos b ON b.content_digest = a.content_digest AND b.id > a.id "
+        "WHERE a.content_digest IS NOT NULL ORDER BY a.id, b.id"
+    )
+    return cursor.fetchall()
+
+def video_dimensions(width, height, resolution):
+    """Restituisce (larghezza, altezza), ricavandole dal testo 'LxA' per i database migrati dalla versione 1."""
+    if not (width and height) and resolution:
+        try:
+            width, height = (int(value) for value in resolution.split('x'))
+        except ValueError:
+            width = height = None
+    return width, height
+
+def fetch_keeper_metadata(video_ids):
+    """
+    Legge i campi usati per scegliere il video da tenere in un gruppo di duplicati.
+
+    Returns:
+    dict: id del video -> (pixel, dimensione in byte, durata in secondi)
+    """
+    video_ids = list(video_ids)
+    cursor = reader_connection().cursor()
+    metadata = {}
+    for start in range(0, len(video_ids), 500):
+        chunk = video_ids[start:start + 500]
+        cursor.execute(
+            f"SELECT id, width, height, resolution, size, duration FROM videos WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+        )
+        for video_id, width, height, resolution, size, duration in cursor.fetchall():
+            width, height = video_dimensions(width, height, resolution)
+            metadata[video_id] = (width * height if width and height else None, size, duration)
+    return metadata
+
+def fetch_block_metadata():
+    """
+    Legge durata e rapporto d'aspetto di tutti i video, usati per suddividere i confronti in blocchi.
+
+    Returns:
+    dict: id del video -> (durata in secondi, rapporto d'aspetto normalizzato >= 1 oppure None se sconosciuto)
+    """
+    cursor = reader_connection().cursor()
+    cursor.execute("SELECT id, duration, width, height, resolution FROM videos")
+    metadata = {}
+    for video_id, duration, width, height, resolution in cursor.fetchall():
+        width, height = video_dimensions(width, height, resolution)
+        aspect = max(width, height) / min(width, height) if width and height else None
+        metadata[video_id] = (duration or 0.0, aspect)
+    return metadata
+
+def fetch_sequences():
+    """
+    Legge le impronte temporali di tutti i video.
+
+    Returns:
+    dict: id del video -> lista di (timestamp, hash senza segno a 64 bit), in ordine di posizione.
+    """
+    cursor = reader_connection().cursor()
+    cursor.execute("SELECT video_id, timestamp, frame_hash FROM video_sequences ORDER BY video_id, position")
+    sequences = {}
+    for video_id, timestamp, frame_hash in cursor.fetchall():
+        sequences.setdefault(video_id, []).append((timestamp, hash_from_db(frame_hash)))
+    return sequences
+
+def fetch_video_ids_without_sequence():
+    """Restituisce l'insieme degli id dei video che non hanno un'impronta temporale."""
+    cursor = reader_connection().cursor()
+    cursor.execute("SELECT id FROM videos v WHERE NOT EXISTS (SELECT 1 FROM video_sequences s WHERE s.video_id = v.id)")
+    return {row[0] for row in cursor.fetchall()}
+
+def fetch_last_video_id():
+    """Restituisce l'ultimo id assegnato a un video (AUTOINCREMENT non riusa gli id), 0 se non ce ne sono."""
+    cursor = reader_connection().cursor()
+    row = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'videos'").fetchone()
+    return row[0] if row else 0
 
 def fetch_video_by_id(video_id):
     """Recupera un video specifico dal database in base all'ID."""
-    with connect_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM videos WHERE id = ?", (video_id,))
-        return cursor.fetchone()
+    return fetch_videos_by_ids([video_id]).get(video_id)
 
 def delete_video(video_id):
     """Elimina un video dal database in base all'ID."""
@@ -118,3 +969,155 @@ def delete_video(video_id):
         cursor = conn.cursor()
         cursor.execute("DELETE FROM videos WHERE id = ?", (video_id,))
         conn.commit()
+
+def insert_similarities(pairs):
+    """
+    Salva un lotto di coppie simili (tramite il writer attivo, se presente).
+
+    Parameters:
+    pairs (list): Tuple (id1, id2, distanza, esatto) con id1 < id2; una coppia già presente viene sostituita.
+    """
+    if pairs:
+        params = [(id1, id2, distance, int(exact)) for id1, id2, distance, exact in pairs]
+        execute_write(lambda conn: conn.executemany(
+            "INSERT OR REPLACE INTO similarities (video_id1, video_id2, distance, exact) VALUES (?, ?, ?, ?)", params
+        ))
+
+def clear_similarities():
+    """Elimina i risultati del confronto precedente e il relativo stato."""
+    def write(conn):
+        conn.execute("DELETE FROM similarities")
+        conn.execute("DELETE FROM compare_state")
+
+    execute_write(write)
+
+def get_compare_state():
+    """Restituisce lo stato dell'ultimo confronto (metodo, soglia, avanzamento) come dizionario di stringhe."""
+    cursor = reader_connection().cursor()
+    cursor.execute("SELECT key, value FROM compare_state")
+    return dict(cursor.fetchall())
+
+def set_compare_state(**values):
+    """Aggiorna lo stato del confronto; nella coda del writer segue le coppie già accodate, quindi fa da checkpoint."""
+    params = [(key, str(value)) for key, value in values.items()]
+    execute_write(lambda conn: conn.executemany("INSERT OR REPLACE INTO compare_state (key, value) VALUES (?, ?)", params))
+
+def save_duplicate_groups(groups):
+    """
+    Sostituisce i gruppi di duplicati salvati (tramite il writer attivo, se presente).
+
+    Parameters:
+    groups (list): Liste di id dei video, dal consigliato da tenere (rank 0) al peggiore.
+    """
+    params = [(video_id, group_id, rank) for group_id, members in enumerate(groups, start=1) for rank, video_id in enumerate(members)]
+
+    def write(conn):
+        conn.execute("DELETE FROM duplicate_groups")
+        conn.executemany("INSERT INTO duplicate_groups (video_id, group_id, rank) VALUES (?, ?, ?)", params)
+
+    execute_write(write)
+
+def fetch_duplicate_groups():
+    """Restituisce i gruppi di duplicati salvati come liste di id, dal video consigliato da tenere al peggiore."""
+    cursor = reader_connection().cursor()
+    cursor.execute("SELECT group_id, video_id FROM duplicate_groups ORDER BY group_id, rank")
+    groups = {}
+    for group_id, video_id in cursor.fetchall():
+        groups.setdefault(group_id, []).append(video_id)
+    return list(groups.values())
+
+def iter_similarities(max_distance=None, batch_size=1000):
+    """
+    Legge le coppie simili a lotti, senza caricarle tutte in memoria.
+
+    Parameters:
+    max_distance (int): Se indicato, restituisce solo le coppie con distanza <= max_distance.
+    batch_size (int): Numero di righe lette per volta.
+
+    Yields:
+    tuple: (id1, id2, distanza, esatto), prima i duplicati esatti e poi in ordine di id.
+    """
+    conn = connect_db()
+    try:
+        sql = "SELECT video_id1, video_id2, distance, exact FROM similarities"
+        params = ()
+        if max_distance is not None:
+            sql += " WHERE distance <= ?"
+            params = (max_distance,)
+        cursor = conn.execute(sql + " ORDER BY exact DESC, video_id1, video_id2", params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for id1, id2, distance, exact in rows:
+                yield id1, id2, distance, bool(exact)
+    finally:
+        conn.close()
+
+class ReviewJournal:
+    """
+    Registro append-only delle decisioni prese nella GUI di revisione.
+
+    Ogni decisione (coppia saltata o video eliminato) è un solo INSERT, indipendente dal
+    numero di coppie. Le eliminazioni vengono applicate alla tabella videos (e a cascata a
+    similarities) solo da compact(), chiamata alla chiusura della GUI: se la GUI termina
+    senza compattare, il registro viene riletto all'avvio successivo.
+    """
+
+    def __init__(self):
+        self.conn = connect_db()
+
+    def record(self, action, video_id1, video_id2, deleted_video_id=None):
+        """Salva una decisione: action è 'skip' oppure 'delete' (con l'id del video eliminato)."""
+        self.record_many([(action, video_id1, video_id2, deleted_video_id)])
+
+    def record_many(self, decisions):
+        """Salva più decisioni (action, id1, id2, id eliminato) con un solo commit."""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT INTO review_journal (action, video_id1, video_id2, deleted_video_id, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(*decision, now) for decision in decisions],
+        )
+        self.conn.commit()
+
+    def load(self):
+        """
+        Rilegge le decisioni salvate.
+
+        Returns:
+        tuple: (insieme delle coppie (id1, id2) saltate, insieme degli id dei video eliminati)
+        """
+        skipped, deleted = set(), set()
+        for action, video_id1, video_id2, deleted_video_id in self.conn.execute(
+                "SELECT action, video_id1, video_id2, deleted_video_id FROM review_journal ORDER BY id"):
+            if action == "skip":
+                skipped.add((video_id1, video_id2))
+            elif action == "delete":
+                deleted.add(deleted_video_id)
+        return skipped, deleted
+
+    def compact(self):
+        """
+        Applica le eliminazioni registrate e scarta le decisioni non più utili, in un'unica transazione.
+
+        Le coppie saltate restano registrate finché esistono entrambi i video, così una nuova
+        sessione non le ripropone.
+        """
+        with self.conn:
+            deleted = self.conn.execute(
+                "DELETE FROM videos WHERE id IN (SELECT deleted_video_id FROM review_journal WHERE action = 'delete')"
+            ).rowcount
+            self.conn.execute("DELETE FROM review_journal WHERE action = 'delete'")
+            self.conn.execute(
+                "DELETE FROM review_journal WHERE action = 'skip' AND ("
+                "video_id1 NOT IN (SELECT id FROM videos) OR video_id2 NOT IN (SELECT id FROM videos))"
+            )
+        logging.info(f"Registro di revisione compattato: {deleted} video eliminati dal database.")
+
+    def close(self, compact=True):
+        """Compatta il registro (se richiesto) e chiude la connessione."""
+        try:
+            if compact:
+                self.compact()
+        finally:
+            self.conn.close()
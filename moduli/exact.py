@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import os
+from collections import defaultdict
+from moduli.metrics import metrics
+
+# Dimensione dei blocchi letti all'inizio, a metà e alla fine del file per il digest parziale
+PARTIAL_BLOCK_SIZE = 1 << 20
+# Buffer delle letture sequenziali del digest completo: letture grandi mantengono il disco alla massima velocità
+READ_BUFFER_SIZE = 16 << 20
+
+
+def partial_digest(path, size, block_size=PARTIAL_BLOCK_SIZE):
+    """
+    Calcola il digest BLAKE2b della dimensione e dei blocchi iniziale, centrale e finale del file.
+
+    I file non più grandi di tre blocchi vengono letti per intero.
+    """
+    digest = hashlib.blake2b(size.to_bytes(8, 'little'), digest_size=16)
+    with open(path, 'rb', buffering=0) as f:
+        if size <= 3 * block_size:
+            digest.update(f.read())
+        else:
+            for offset in (0, (size - block_size) // 2, size - block_size):
+                f.seek(offset)
+                digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+
+def full_digest(path, buffer_size=READ_BUFFER_SIZE):
+    """Calcola il digest BLAKE2b dell'intero file, letto in sequenza con un buffer riutilizzato."""
+    digest = hashlib.blake2b(digest_size=32)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+    return digest.hexdigest()
+
+
+class ExactDuplicateFinder:
+    """
+    Riconosce le copie identiche byte per byte prima di qualsiasi decodifica.
+
+    I file vengono raggruppati per dimensione; solo quando due file hanno la stessa
+    dimensione si calcola il digest parziale e, se anche questo coincide, il digest
+    completo di conferma. I digest calcolati restano in cache per tutta la scansione.
+    """
+
+    def __init__(self, block_size=PARTIAL_BLOCK_SIZE, buffer_size=READ_BUFFER_SIZE):
+        self.block_size = block_size
+        self.buffer_size = buffer_size
+        self.by_size = defaultdict(list)
+        self.partial_digests = {}
+        self.full_digests = {}
+
+    def add(self, path, size):
+        """Registra un file come possibile originale delle copie trovate in seguito."""
+        self.by_size[size].append(str(path))
+
+    def _partial(self, path, size):
+        if path not in self.partial_digests:
+            with metrics.stage("digest_partial", nbytes=min(size, 3 * self.block_size)):
+                self.partial_digests[path] = partial_digest(path, size, self.block_size)
+        return self.partial_digests[path]
+
+    def _full(self, path, size):
+        if path not in self.full_digests:
+            with metrics.stage("digest_full", nbytes=size):
+                self.full_digests[path] = full_digest(path, self.buffer_size)
+        return self.full_digests[path]
+
+    def find_copy(self, path, size):
+        """
+        Cerca tra i file registrati uno identico a quello indicato.
+
+        Parameters:
+        path (Path): File da controllare.
+        size (int): Dimensione del file in byte.
+
+        Returns:
+        tuple: (percorso dell'originale, digest completo) oppure None se il file non è una copia.
+        """
+        path = str(path)
+        candidates = self.by_size.get(size)
+        if not candidates or candidates == [path]:
+            return None
+
+        try:
+            digest = self._partial(path, size)
+            for candidate in list(candidates):
+                if candidate == path:
+                    continue
+                try:
+                    if self._partial(candidate, size) != digest:
+                        continue
+                    candidate_digest = self._full(candidate, size)
+                except OSError as e:
+                    # L'originale non è più leggibile: non può più fare da riferimento
+                    logging.warning(f"File non leggibile durante il confronto esatto, ignorato: {candidate}: {e}")
+                    candidates.remove(candidate)
+                    continue
+                if candidate_digest == self._full(path, size):
+                    return candidate, candidate_digest
+        except OSError as e:
+            logging.warning(f"Impossibile calcolare il digest di {path}: {e}")
+        return None
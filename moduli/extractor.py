@@ -1,20 +1,33 @@
 import subprocess
 import re
+import json
 import imagehash
 import logging
 import io
-import time
 import cv2
 import shutil
+import tempfile
 import configparser
+import functools
+import os
+import threading
+import numpy as np
 
 from PIL import Image
 from pathlib import Path
+from collections import Counter, defaultdict
 from tqdm import tqdm
 
-from moduli.database_manager import insert_video, video_exists_in_db
-from concurrent.futures import ThreadPoolExecutor
-from moduli.hash_utils import combine_hashes_mode  # Importa la funzione per combinare gli hash
+from moduli.database_manager import (insert_video, video_exists_in_db, load_manifest, delete_videos, batched_writes, copy_video_fingerprint,
+                                     fetch_legacy_frame_paths, store_frame_previews, update_video_stat,
+                                     fetch_video_ids_without_sequence, insert_sequence, fetch_digest_candidates,
+                                     save_content_digests)
+from moduli.hash_file import update_hash_index
+from moduli.exact import ExactDuplicateFinder, partial_digest, full_digest, PARTIAL_BLOCK_SIZE
+from moduli.metrics import metrics, timed, METRICS_ENABLED
+from moduli.scheduler import run_tool, get_scheduler
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from moduli.hash_utils import hash_frame_buffers, hash_frame_sequence, encode_preview  # Decodifica, hash dei frame e hash combinato
 from pathlib import Path
 
 # Load configuration
@@ -32,10 +45,46 @@ FFMPEG_PATH = config['Paths']['FFMPEG_PATH']
 FFPROBE_PATH = config['Paths']['FFPROBE_PATH']
 FRAMES_DIR = config['Paths']['FRAMES_DIR']
 
+# Modalità di estrazione dei frame: 'legacy' (un ffmpeg per frame, PNG) o 'raw' (un solo ffmpeg, scala di grigi grezza)
+FRAME_EXTRACTION = config['Settings'].get('FRAME_EXTRACTION', 'legacy').strip().lower()
+# Ricerca veloce: decodifica solo il keyframe precedente al timestamp, ridotto dentro ffmpeg (frame non esatto, molto più rapido)
+FAST_SEEK = config['Settings'].getboolean('FAST_SEEK', fallback=False)
+# Salva le anteprime JPEG dei frame (necessarie per la GUI)
+SAVE_PREVIEWS = config['Settings'].getboolean('SAVE_PREVIEWS', fallback=True)
+# Processi ffprobe/ffmpeg contemporanei all'avvio (poi adattati dallo scheduler) e processi per la decodifica e gli hash (CPU, 0 = numero di core)
+IO_WORKERS = config['Settings'].getint('IO_WORKERS', fallback=8)
+HASH_WORKERS = config['Settings'].getint('HASH_WORKERS', fallback=0) or os.cpu_count() or 1
+# Numero massimo di video in elaborazione contemporaneamente durante la scansione
+MAX_IN_FLIGHT = config['Settings'].getint('MAX_IN_FLIGHT', fallback=IO_WORKERS * 4)
+# Scansione incrementale: rielabora i file modificati (dimensione, mtime, inode) e rimuove quelli eliminati
+INCREMENTAL_SCAN = config['Settings'].getboolean('INCREMENTAL_SCAN', fallback=True)
+# Riconosce le copie identiche (dimensione e digest BLAKE2b) e ne riusa l'impronta senza decodificarle
+EXACT_DUPLICATES = config['Settings'].getboolean('EXACT_DUPLICATES', fallback=True)
+
+# Impronta temporale: frame campionati a intervallo fisso (secondi) per allineare video tagliati o rimontati
+TEMPORAL_FINGERPRINT = config.getboolean('Temporal', 'ENABLED', fallback=False)
+TEMPORAL_INTERVAL = config.getfloat('Temporal', 'INTERVAL', fallback=2.0)
+TEMPORAL_MAX_FRAMES = config.getint('Temporal', 'MAX_FRAMES', fallback=1800)
+
+# Dimensione dei frame usata da phash (immagine 32x32 in scala di grigi) e larghezza delle anteprime
+HASH_FRAME_SIZE = 32
+PREVIEW_WIDTH = 320
+
+# Estensioni dei file considerati video
+VIDEO_EXTENSIONS = (
+    ".3gp", ".avi", ".flv", ".h264", ".hevc", ".mkv", ".mov", ".mp4",
+    ".mpeg", ".mpg", ".mpeg4", ".mts", ".mxg", ".ogv", ".ts", ".vob",
+    ".webm", ".wmv", ".divx", ".xvid", ".m4v", ".rm", ".rmvb", ".svq3",
+    ".dvd", ".mxf", ".f4v", ".amv", ".roq", ".yuv", ".cine", ".bik",
+    ".cpk", ".vdr", ".iso", ".iso9660", ".nsv", ".m2v", ".mp2", ".mpv",
+    ".mod", ".tod", ".pmp", ".ivf", ".drc", ".bmv", ".svi", ".flv", ".vp8"
+)
+
 # Print the loaded paths for verification
 print(f"FFMPEG_PATH: {FFMPEG_PATH}")
 print(f"FFPROBE_PATH: {FFPROBE_PATH}")
 print(f"FRAMES_DIR: {FRAMES_DIR}")
+print(f"FRAME_EXTRACTION: {FRAME_EXTRACTION}")
 
 # Check if the paths exist
 for path in [FFMPEG_PATH, FFPROBE_PATH, FRAMES_DIR]:
@@ -49,13 +98,14 @@ def sanitize_filename(filename: str) -> str:
     """Rimuove caratteri non validi dal nome del file."""
     return re.sub(r'[<>:"/\\|?*\x00-\x1F]', '_', filename)
 
+@timed("ffprobe", failed=lambda duration: not duration)
 def get_video_duration(video_path: Path) -> float:
     """Restituisce la durata del video in secondi."""
     command = [FFPROBE_PATH, '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', str(video_path)]
     try:
-        result = subprocess.run(command, stdout=subprocess.PIPE, text=True, check=True, stderr=subprocess.DEVNULL)
-        return float(result.stdout.strip())
-    except subprocess.CalledProcessError as e:
+        result = run_tool(command, "ffprobe", check=True)
+        return float(result.stdout.decode().strip())
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
         logging.error(f"Errore nel recuperare la durata del video {video_path}: {e}")
         return 0.0  # Restituisci 0.0 per indicare un errore
 
@@ -63,12 +113,80 @@ def get_video_resolution(video_path: Path) -> str:
     """Ottiene la risoluzione del video usando ffprobe."""
     command = [FFPROBE_PATH, '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=width,height', '-of', 'csv=p=0', str(video_path)]
     try:
-        resolution = subprocess.check_output(command, stderr=subprocess.DEVNULL).strip().decode('utf-8').split(',')
+        resolution = run_tool(command, "ffprobe", check=True).stdout.strip().decode('utf-8').split(',')
         return f"{resolution[0]}x{resolution[1]}"
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
         logging.error(f"Errore nel recuperare la risoluzione del video {video_path}: {e}")
         return "N/A"
 
+def parse_frame_rate(rate: str):
+    """Converte un frame rate di ffprobe (es. '30000/1001') in float. Restituisce None se non valido."""
+    try:
+        numerator, _, denominator = str(rate).partition('/')
+        value = float(numerator) / float(denominator or 1)
+        return round(value, 3) if value > 0 else None
+    except (ValueError, ZeroDivisionError):
+        return None
+
+@timed("ffprobe", failed=lambda probe: probe is None)
+def probe_video(video_path: Path):
+    """
+    Esegue ffprobe una sola volta con output JSON e restituisce le informazioni del video.
+
+    Returns:
+    dict: duration, width, height, resolution, codec, fps, bitrate, stream_count; None in caso di errore.
+    """
+    command = [
+        FFPROBE_PATH, '-v', 'error',
+        '-show_entries', 'format=duration,bit_rate,nb_streams:stream=codec_type,codec_name,width,height,avg_frame_rate,r_frame_rate,duration',
+        '-of', 'json', str(video_path)
+    ]
+    try:
+        result = run_tool(command, "ffprobe", check=True)
+        data = json.loads(result.stdout or '{}')
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, ValueError, OSError) as e:
+        logging.error(f"Errore nell'analisi del video {video_path} con ffprobe: {e}")
+        return None
+
+    container = data.get('format', {})
+    streams = data.get('streams', [])
+    video_stream = next((stream for stream in streams if stream.get('codec_type') == 'video'), None)
+    if video_stream is None:
+        logging.error(f"Nessuna traccia video trovata in {video_path}")
+        return None
+
+    try:
+        duration = float(container.get('duration') or video_stream.get('duration') or 0.0)
+    except ValueError:
+        duration = 0.0
+    try:
+        bitrate = int(container.get('bit_rate')) if container.get('bit_rate') else None
+    except ValueError:
+        bitrate = None
+
+    width = video_stream.get('width')
+    height = video_stream.get('height')
+    return {
+        'duration': duration,
+        'width': width,
+        'height': height,
+        'resolution': f"{width}x{height}" if width and height else "N/A",
+        'codec': video_stream.get('codec_name'),
+        'fps': parse_frame_rate(video_stream.get('avg_frame_rate')) or parse_frame_rate(video_stream.get('r_frame_rate')),
+        'bitrate': bitrate,
+        'stream_count': int(container.get('nb_streams') or len(streams)),
+    }
+
+def probe_videos(video_paths, max_workers: int = 4):
+    """
+    Analizza un gruppo di video in parallelo, restituendo (percorso, informazioni) nello stesso ordine.
+
+    I risultati vengono prodotti man mano, così lo scanner può avviare l'estrazione
+    mentre le analisi successive sono ancora in corso.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from zip(video_paths, executor.map(probe_video, video_paths))
+
 def move_video_to_problematic(video_path: Path) -> None:
     """Sposta il video in una cartella 'problematic' se si verifica un errore."""
     problem_dir = video_path.parent / "problematic"
@@ -79,23 +197,60 @@ def move_video_to_problematic(video_path: Path) -> None:
         shutil.move(str(video_path), moved_video_path)
         logging.info(f"Video spostato in problematico: {moved_video_path}")
 
-def attempt_frame_extraction(video_path: Path, timestamp: float, output_frame_path: Path) -> imagehash.ImageHash:
-    """Tenta di estrarre un frame usando ffmpeg o OpenCV e calcola l'hash."""
+def fast_seek_input_args() -> list:
+    """
+    Opzioni di ingresso di ffmpeg per la ricerca veloce.
+
+    -noaccurate_seek si ferma al keyframe precedente invece di decodificare fino al timestamp,
+    -skip_frame nokey scarta tutti i frame non chiave. Il decoder usa solo i thread per slice:
+    i thread per frame accumulano più frame prima di restituire il primo, inutile per un frame solo.
+    """
+    return ['-skip_frame', 'nokey', '-noaccurate_seek', '-thread_type', 'slice']
+
+def build_capture_command(video_path: Path, timestamp: float, fast: bool) -> list:
+    """Costruisce il comando ffmpeg che estrae un frame come PNG su stdout; in modalità veloce il frame è ridotto a PREVIEW_WIDTH."""
+    command = [FFMPEG_PATH, '-v', 'error']
+    if fast:
+        command += fast_seek_input_args()
+    command += ['-ss', str(timestamp), '-i', str(video_path), '-vframes', '1']
+    if fast:
+        # Riduce il frame nello stesso processo: meno byte da codificare in PNG e da decodificare con PIL
+        command += ['-vf', f"scale='min({PREVIEW_WIDTH},iw)':-2:flags=area"]
+    return command + ['-f', 'image2pipe', '-vcodec', 'png', '-y', 'pipe:1']
+
+def run_capture_command(command):
+    """Esegue il comando di estrazione e restituisce i byte PNG, oppure None se ffmpeg fallisce o supera il timeout."""
+    try:
+        result = run_tool(command, "ffmpeg_frame")
+    except subprocess.TimeoutExpired:
+        return None
+    if result.returncode == 0 and result.stdout:
+        return result.stdout
+
+    # Log dell'errore di ffmpeg
+    logging.warning(f"ffmpeg ha restituito un errore: {result.stderr.decode(errors='replace').strip()}")
+    return None
+
+@timed("ffmpeg_frame", failed=lambda image_data: image_data is None, nbytes=len)
+def capture_frame(video_path: Path, timestamp: float, fast: bool = None):
+    """
+    Estrae un frame usando ffmpeg o OpenCV e restituisce i byte dell'immagine PNG, senza decodificarla.
+
+    Con fast=True (predefinito: FAST_SEEK) usa la ricerca veloce al keyframe e, se fallisce,
+    ripete l'estrazione precisa prima di ricorrere a OpenCV.
+    """
+    if fast is None:
+        fast = FAST_SEEK
     try:
         # Prova con ffmpeg
-        command = [
-            FFMPEG_PATH, '-ss', str(timestamp), '-i', str(video_path),
-            '-vframes', '1', '-f', 'image2pipe', '-vcodec', 'png', '-y', 'pipe:1'
-        ]
-        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
-            image_data, err = proc.communicate()
-            if proc.returncode == 0:
-                pil_image = Image.open(io.BytesIO(image_data))
-                pil_image.save(output_frame_path)
-                return imagehash.phash(pil_image)
-
-            # Log dell'errore di ffmpeg
-            logging.warning(f"ffmpeg ha restituito un errore: {err.decode().strip()}")
+        if fast:
+            image_data = run_capture_command(build_capture_command(video_path, timestamp, True))
+            if image_data is not None:
+                return image_data
+            logging.info(f"Ricerca veloce fallita per {video_path}, nuovo tentativo con la ricerca precisa.")
+        image_data = run_capture_command(build_capture_command(video_path, timestamp, False))
+        if image_data is not None:
+            return image_data
 
         # Se ffmpeg fallisce, prova con OpenCV
         cap = cv2.VideoCapture(str(video_path))
@@ -104,9 +259,9 @@ def attempt_frame_extraction(video_path: Path, timestamp: float, output_frame_pa
         cap.release()
 
         if success:
-            pil_image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            pil_image.save(output_frame_path)
-            return imagehash.phash(pil_image)
+            encoded, buffer = cv2.imencode('.png', frame)
+            if encoded:
+                return buffer.tobytes()
         logging.error(f"OpenCV ha fallito per il video {video_path}")
 
     except Exception as e:
@@ -114,6 +269,169 @@ def attempt_frame_extraction(video_path: Path, timestamp: float, output_frame_pa
 
     return None
 
+def attempt_frame_extraction(video_path: Path, timestamp: float, output_frame_path: Path, fast: bool = None) -> imagehash.ImageHash:
+    """Tenta di estrarre un frame usando ffmpeg o OpenCV e calcola l'hash (fast: vedi capture_frame)."""
+    image_data = capture_frame(video_path, timestamp, fast)
+    if image_data is None:
+        return None
+
+    try:
+        pil_image = Image.open(io.BytesIO(image_data))
+        pil_image.save(output_frame_path)
+        return imagehash.phash(pil_image)
+    except Exception as e:
+        logging.error(f"Errore durante l'estrazione del frame: {e}")
+    return None
+
+def build_raw_extraction_command(video_path: Path, timestamps, preview_paths=None) -> list:
+    """
+    Costruisce un comando ffmpeg che estrae tutti i timestamp in una sola invocazione.
+
+    Ogni timestamp è un input separato con seek veloce (-ss prima di -i); i frame vengono
+    ridotti a HASH_FRAME_SIZE x HASH_FRAME_SIZE in scala di grigi dentro ffmpeg e concatenati
+    in un unico flusso rawvideo su stdout. Se richiesto, le anteprime JPEG vengono scritte
+    dallo stesso processo. Con FAST_SEEK ogni input decodifica solo il keyframe precedente al timestamp.
+    """
+    command = [FFMPEG_PATH, '-v', 'error']
+    for timestamp in timestamps:
+        if FAST_SEEK:
+            command += fast_seek_input_args()
+        command += ['-ss', str(timestamp), '-i', str(video_path)]
+
+    filters = []
+    hash_labels = ''
+    for idx in range(len(timestamps)):
+        chain = f"[{idx}:v:0]trim=end_frame=1,setpts=PTS-STARTPTS"
+        if preview_paths:
+            filters.append(f"{chain},split=2[s{idx}][p{idx}]")
+            filters.append(f"[p{idx}]scale={PREVIEW_WIDTH}:-2[q{idx}]")
+            chain = f"[s{idx}]"
+        else:
+            chain += ","
+        filters.append(f"{chain}scale={HASH_FRAME_SIZE}:{HASH_FRAME_SIZE}:flags=area,format=gray,setsar=1[h{idx}]")
+        hash_labels += f"[h{idx}]"
+    filters.append(f"{hash_labels}concat=n={len(timestamps)}:v=1:a=0[hash]")
+
+    command += [
+        '-filter_complex', ';'.join(filters),
+        '-map', '[hash]', '-vsync', '0', '-frames:v', str(len(timestamps)), '-f', 'rawvideo', '-pix_fmt', 'gray', 'pipe:1'
+    ]
+    if preview_paths:
+        for idx, preview_path in enumerate(preview_paths):
+            command += ['-map', f'[q{idx}]', '-frames:v', '1', '-y', str(preview_path)]
+    return command
+
+@timed("ffmpeg_raw", failed=lambda frames: frames is None, nbytes=lambda frames: frames.nbytes)
+def extract_frames_raw(video_path: Path, timestamps, preview_paths=None):
+    """
+    Estrae tutti i frame richiesti con un solo processo ffmpeg.
+
+    Returns:
+    np.ndarray: Array uint8 di forma (n, HASH_FRAME_SIZE, HASH_FRAME_SIZE), oppure None in caso di errore.
+    """
+    command = build_raw_extraction_command(video_path, timestamps, preview_paths)
+    frame_bytes = HASH_FRAME_SIZE * HASH_FRAME_SIZE
+    try:
+        result = run_tool(command, "ffmpeg_raw")
+    except subprocess.TimeoutExpired:
+        return None
+    except OSError as e:
+        logging.error(f"Errore durante l'avvio di ffmpeg per {video_path}: {e}")
+        return None
+
+    if result.returncode != 0 or len(result.stdout) != frame_bytes * len(timestamps):
+        logging.warning(f"Estrazione in un solo passaggio fallita per {video_path}: {result.stderr.decode(errors='replace').strip()}")
+        return None
+    return np.frombuffer(result.stdout, dtype=np.uint8).reshape(len(timestamps), HASH_FRAME_SIZE, HASH_FRAME_SIZE)
+
+@timed("ffmpeg_sequence", failed=lambda data: data is None, nbytes=len)
+def extract_sequence_raw(video_path: Path):
+    """
+    Campiona un frame ogni TEMPORAL_INTERVAL secondi con un solo processo ffmpeg.
+
+    Returns:
+    bytes: Frame grezzi HASH_FRAME_SIZE x HASH_FRAME_SIZE in scala di grigi concatenati, oppure None in caso di errore.
+    """
+    command = [
+        FFMPEG_PATH, '-v', 'error', '-i', str(video_path),
+        '-vf', f"fps=1/{TEMPORAL_INTERVAL},scale={HASH_FRAME_SIZE}:{HASH_FRAME_SIZE}:flags=area,format=gray",
+        '-vsync', '0', '-frames:v', str(TEMPORAL_MAX_FRAMES), '-an', '-f', 'rawvideo', '-pix_fmt', 'gray', 'pipe:1'
+    ]
+    frame_bytes = HASH_FRAME_SIZE * HASH_FRAME_SIZE
+    try:
+        result = run_tool(command, "ffmpeg_sequence")
+    except subprocess.TimeoutExpired:
+        return None
+    except OSError as e:
+        logging.error(f"Errore durante l'avvio di ffmpeg per {video_path}: {e}")
+        return None
+
+    if result.returncode != 0 or not result.stdout or len(result.stdout) % frame_bytes:
+        logging.warning(f"Estrazione dell'impronta temporale fallita per {video_path}: {result.stderr.decode(errors='replace').strip()}")
+        return None
+    return result.stdout
+
+def extract_temporal_sequence(video_path: Path, hash_executor=None):
+    """Estrae l'impronta temporale del video: lista di (timestamp, hash a 64 bit), oppure None in caso di errore."""
+    data = extract_sequence_raw(video_path)
+    if data is None:
+        return None
+
+    try:
+        with metrics.stage("phash_sequence"):
+            if hash_executor is not None:
+                metrics.queue_changed("hash_pool", 1)
+                try:
+                    frame_hashes = hash_executor.submit(hash_frame_sequence, data, HASH_FRAME_SIZE).result()
+                finally:
+                    metrics.queue_changed("hash_pool", -1)
+            else:
+                frame_hashes = hash_frame_sequence(data, HASH_FRAME_SIZE)
+    except Exception as e:
+        logging.error(f"Errore nel calcolo dell'impronta temporale di {video_path}: {e}")
+        return None
+    return [(idx * TEMPORAL_INTERVAL, frame_hash) for idx, frame_hash in enumerate(frame_hashes)]
+
+def backfill_temporal_sequence(video_path: Path, video_id: int, hash_executor=None) -> bool:
+    """
+    Calcola e salva solo l'impronta temporale di un video già nel database, senza rielaborarne i frame.
+
+    Usata quando l'impronta temporale viene attivata su una libreria già scansionata. Restituisce True se salvata.
+    """
+    sequence = extract_temporal_sequence(video_path, hash_executor)
+    if not sequence:
+        logging.warning(f"Impronta temporale non calcolata per {video_path}, si riproverà alla prossima scansione.")
+        return False
+    insert_sequence(video_id, sequence)
+    return True
+
+def capture_frames_raw(video_path: Path, timestamps):
+    """
+    Estrae i frame in modalità 'raw'. Restituisce (byte grezzi di ciascun frame, byte JPEG delle anteprime) oppure None.
+
+    ffmpeg scrive le anteprime in una cartella temporanea dentro FRAMES_DIR, eliminata subito dopo averle lette.
+    """
+    if not SAVE_PREVIEWS:
+        frames = extract_frames_raw(video_path, timestamps)
+        return None if frames is None else ([frame.tobytes() for frame in frames], [None] * len(timestamps))
+
+    Path(FRAMES_DIR).mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="frames_", dir=FRAMES_DIR) as temp_dir:
+        preview_paths = [Path(temp_dir) / f"frame_{idx + 1}.jpg" for idx in range(len(timestamps))]
+        frames = extract_frames_raw(video_path, timestamps, preview_paths)
+        if frames is None:
+            return None
+        previews = [path.read_bytes() if path.exists() else None for path in preview_paths]
+    return [frame.tobytes() for frame in frames], previews
+
+def report_extraction_failure(video_path: Path) -> None:
+    """Logga il video problematico, lo sposta nella cartella 'problematic' e lo aggiunge a error_videos.log."""
+    logging.error(f"Errore irreversibile: impossibile estrarre frame da {video_path}")
+    move_video_to_problematic(video_path)
+
+    with open("error_videos.log", "a") as log_file:
+        log_file.write(f"{video_path}\n")
+
 def extract_frame(video_path: Path, timestamp: float, output_frame_path: Path) -> imagehash.ImageHash:
     """Prova l'estrazione di frame e gestisce errori spostando video problematici."""
     phash = attempt_frame_extraction(video_path, timestamp, output_frame_path)
@@ -121,62 +439,132 @@ def extract_frame(video_path: Path, timestamp: float, output_frame_path: Path) -
         return phash
 
     # Se fallisce, logga il video problematico e sposta il video
-    logging.error(f"Errore irreversibile: impossibile estrarre frame da {video_path}")
-    move_video_to_problematic(video_path)
-
-    with open("error_videos.log", "a") as log_file:
-        log_file.write(f"{video_path}\n")
-    
+    report_extraction_failure(video_path)
     return None
 
-def extract_video_info(video_path: Path) -> bool:
-    """Estrae informazioni dal video e le inserisce nel database."""
-    if video_exists_in_db(str(video_path)):
-        return False
-
-    resolution = get_video_resolution(video_path)
-    size = video_path.stat().st_size
-    duration = get_video_duration(video_path)
+def capture_frames_legacy(video_path: Path, timestamps, report_failures: bool = True):
+    """
+    Estrae i frame con un processo ffmpeg per timestamp, restituendo i byte codificati senza decodificarli.
+
+    Restituisce una lista di (byte dell'immagine, larghezza dell'anteprima da creare o None),
+    oppure None se un frame non può essere estratto. Con report_failures il video che non
+    si riesce a leggere viene spostato tra i problematici.
+    """
+    frames = []
+    for timestamp in timestamps:
+        image_data = capture_frame(video_path, timestamp)
+        if image_data is None:
+            if report_failures:
+                report_extraction_failure(video_path)
+            return None
+        frames.append((image_data, PREVIEW_WIDTH if SAVE_PREVIEWS else None))
+    return frames
+
+def fingerprint_video(video_path: Path, probe: dict = None, hash_executor=None, report_failures: bool = True,
+                      with_sequence: bool = TEMPORAL_FINGERPRINT):
+    """
+    Calcola l'impronta di un video (metadati, hash dei frame, hash combinati, anteprime) senza scriverla nel database.
+
+    Parameters:
+    video_path (Path): Video da elaborare.
+    probe (dict): Risultato di probe_video, se già calcolato.
+    hash_executor: Pool di processi opzionale in cui eseguire la decodifica e gli hash dei frame.
+    report_failures (bool): Se False un video illeggibile non viene spostato tra i problematici.
+    with_sequence (bool): Calcola anche l'impronta temporale.
+
+    Returns:
+    dict: Argomenti di insert_video, oppure None se il video non può essere elaborato.
+    """
+    if probe is None:
+        probe = probe_video(video_path)
+    if probe is None:
+        return None
+
+    resolution = probe['resolution']
+    stat = video_path.stat()
+    duration = probe['duration']
 
     if duration == 0.0 or resolution == "N/A":
-        return False
-
-    sanitized_folder_name = sanitize_filename(video_path.stem)
-    frames_folder = Path(FRAMES_DIR) / sanitized_folder_name
-    frames_folder.mkdir(parents=True, exist_ok=True)
+        return None
 
     timestamps = [duration * (i + 1) / 4 for i in range(3)]
-    frame_hashes = []
-    frame_paths = []
 
-    for idx, timestamp in enumerate(timestamps):
-        output_frame_path = frames_folder / f"frame_{idx + 1}.jpg"
-        
-        # Controlla se il frame esiste già
-        if output_frame_path.exists():
-            # Se esiste, calcola l'hash dal file esistente
-            pil_image = Image.open(output_frame_path)
-            frame_hash = imagehash.phash(pil_image)
-            frame_hashes.append(frame_hash)
-            frame_paths.append(str(output_frame_path))
-        else:
-            frame_hash = extract_frame(video_path, timestamp, output_frame_path)
-            if frame_hash is not None:
-                frame_hashes.append(frame_hash)
-                frame_paths.append(str(output_frame_path))
-
-    # Controlla se ci sono hash non validi
-    if len(frame_hashes) < 3:
-        logging.warning(f"Errore: uno o più hash dei frame sono None per {video_path}.")
+    # Modalità 'raw': un solo ffmpeg per tutti i timestamp, con ripiego sulla modalità classica in caso di errore
+    raw_result = capture_frames_raw(video_path, timestamps) if FRAME_EXTRACTION == 'raw' else None
+    if raw_result is not None:
+        raw_frames, raw_previews = raw_result
+        frames, frame_size = [(data, None) for data in raw_frames], HASH_FRAME_SIZE
+    else:
+        frames, frame_size = capture_frames_legacy(video_path, timestamps, report_failures), None
+        if frames is None:
+            logging.warning(f"Errore: uno o più hash dei frame sono None per {video_path}.")
+            return None
+
+    # Decodifica e hash (lavoro CPU) nel pool di processi, se disponibile; "hash" include l'attesa di un processo libero
+    try:
+        with metrics.stage("hash"):
+            if hash_executor is not None:
+                metrics.queue_changed("hash_pool", 1)
+                try:
+                    result = hash_executor.submit(hash_frame_buffers, frames, frame_size, METRICS_ENABLED).result()
+                finally:
+                    metrics.queue_changed("hash_pool", -1)
+            else:
+                result = hash_frame_buffers(frames, frame_size, METRICS_ENABLED)
+    except Exception as e:
+        logging.error(f"Errore nel calcolo degli hash dei frame di {video_path}: {e}")
+        return None
+    if METRICS_ENABLED:
+        combined_hash, frame_hashes, previews, (combined_dhash, combined_ahash), (decode_seconds, phash_seconds) = result
+        metrics.observe("decode", decode_seconds)
+        metrics.observe("phash", phash_seconds)
+    else:
+        combined_hash, frame_hashes, previews, (combined_dhash, combined_ahash) = result
+    if raw_result is not None:
+        previews = raw_previews
+
+    # Impronta temporale opzionale, usata per trovare video tagliati o con durata diversa
+    sequence = extract_temporal_sequence(video_path, hash_executor) if with_sequence else None
+
+    return {
+        "resolution": resolution, "size": stat.st_size, "duration": duration, "video_path": str(video_path),
+        "combined_hash": combined_hash, "frames": list(zip(timestamps, frame_hashes, previews)),  # Hash e anteprime dei frame
+        "width": probe['width'], "height": probe['height'], "codec": probe['codec'],
+        "fps": probe['fps'], "bitrate": probe['bitrate'], "stream_count": probe['stream_count'],
+        "mtime": stat.st_mtime, "inode": stat.st_ino, "sequence": sequence,
+        "combined_dhash": combined_dhash, "combined_ahash": combined_ahash,
+    }
+
+def extract_video_info(video_path: Path, probe: dict = None, hash_executor=None, check_existing: bool = True,
+                       store_partial_digest: bool = False) -> bool:
+    """
+    Estrae informazioni dal video e le inserisce nel database.
+
+    Accetta il risultato di probe_video se già calcolato e, facoltativamente, un pool di processi
+    in cui eseguire la decodifica e il calcolo degli hash dei frame. Con check_existing=False
+    non controlla il database (lo scanner ha già confrontato il video con il manifest).
+    Con store_partial_digest salva anche il digest parziale del file, con cui l'unione degli shard riconosce le copie.
+    """
+    if check_existing and video_exists_in_db(str(video_path)):
+        return False
+
+    fingerprint = fingerprint_video(video_path, probe, hash_executor)
+    if fingerprint is None:
         return False
 
-    combined_hash = combine_hashes_mode(*frame_hashes)  # Combina gli hash
-    insert_video(resolution, size, duration, str(video_path), str(combined_hash), *frame_paths)  # Passa anche i percorsi dei frame
+    if store_partial_digest:
+        size = fingerprint["size"]
+        try:
+            with metrics.stage("digest_partial", nbytes=min(size, 3 * PARTIAL_BLOCK_SIZE)):
+                fingerprint["partial_digest"] = partial_digest(video_path, size)
+        except OSError as e:
+            logging.warning(f"Impossibile calcolare il digest parziale di {video_path}: {e}")
 
+    insert_video(**fingerprint)
     return True
 
-def process_video(video_path: Path) -> None:
-    """Processa il video per estrarre e controllare i frame.""" 
+def sanitize_video_path(video_path: Path) -> Path:
+    """Rinomina il video con un nome valido, se necessario, e restituisce il nuovo percorso."""
     sanitized_video_name = sanitize_filename(video_path.name)
     sanitized_video_path = video_path.parent / sanitized_video_name
 
@@ -184,53 +572,291 @@ def process_video(video_path: Path) -> None:
     if sanitized_video_name != video_path.name:
         video_path.rename(sanitized_video_path)
         video_path = sanitized_video_path
+    return video_path
+
+def is_video_unchanged(stat, manifest_entry) -> bool:
+    """
+    Confronta dimensione, mtime e inode del file con i valori salvati nel database.
+
+    mtime e inode NULL (video elaborati prima della scansione incrementale) non vengono confrontati:
+    basta la dimensione, e lo scanner salva poi i valori attuali.
+    """
+    _, size, mtime, inode = manifest_entry
+    return size == stat.st_size and mtime in (None, stat.st_mtime) and inode in (None, stat.st_ino)
+
+def pack_legacy_frames(writer=None) -> None:
+    """
+    Sposta nel database le anteprime dei frame salvate come file JPEG dalle versioni precedenti.
+
+    Ogni file viene ridotto a PREVIEW_WIDTH, salvato in frame_previews ed eliminato, insieme alla
+    sua cartella se resta vuota. I file mancanti o illeggibili restano com'erano nel database.
+    Con un DatabaseWriter attivo, i file vengono eliminati solo dopo che le anteprime sono state salvate.
+    """
+    legacy_frames = {}
+    for video_id, frame_index, frame_path in fetch_legacy_frame_paths():
+        legacy_frames.setdefault(frame_path, []).append((video_id, frame_index))
+    if not legacy_frames:
+        return
 
-    # Controlla se i frame esistono già
-    frames_folder = Path(FRAMES_DIR) / sanitized_video_name
-    if frames_folder.exists() and any(frames_folder.glob("*.jpg")):
-        extract_video_info(video_path)  # Inserisci le informazioni del video
-    else:
-        # Se non ci sono frame esistenti, procedi all'estrazione
-        extract_video_info(video_path)
-
-def process_videos_in_directory(directory: str) -> None:
-    """Processa tutti i video in una cartella e nelle sue sottocartelle usando multithreading.""" 
-    video_extensions = (
-        ".3gp", ".avi", ".flv", ".h264", ".hevc", ".mkv", ".mov", ".mp4",
-        ".mpeg", ".mpg", ".mpeg4", ".mts", ".mxg", ".ogv", ".ts", ".vob",
-        ".webm", ".wmv", ".divx", ".xvid", ".m4v", ".rm", ".rmvb", ".svq3",
-        ".dvd", ".mxf", ".f4v", ".amv", ".roq", ".yuv", ".cine", ".bik", 
-        ".cpk", ".vdr", ".iso", ".iso9660", ".nsv", ".m2v", ".mp2", ".mpv",
-        ".mod", ".tod", ".pmp", ".ivf", ".drc", ".bmv", ".svi", ".flv", ".vp8"
-    )
-    
+    packed = []
+    for frame_path, frame_keys in tqdm(legacy_frames.items(), desc="Spostamento anteprime nel database", unit="file"):
+        try:
+            with Image.open(frame_path) as image:
+                preview = encode_preview(image, PREVIEW_WIDTH)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Anteprima non spostata nel database: {frame_path}: {e}")
+            continue
+        # Le copie identiche condividono lo stesso file, che viene letto una sola volta
+        store_frame_previews([(video_id, frame_index, preview) for video_id, frame_index in frame_keys])
+        packed.append(frame_path)
+
+    if writer is not None:
+        writer.flush()
+    for frame_path in packed:
+        try:
+            os.remove(frame_path)
+            os.rmdir(os.path.dirname(frame_path))
+        except OSError:
+            pass  # File già rimosso, non spostato o cartella non ancora vuota
+    logging.info(f"Anteprime spostate nel database: {len(packed)} file su {len(legacy_frames)}.")
+
+@timed("video", failed=lambda processed: not processed)
+def process_video(video_path: Path, probe: dict = None, hash_executor=None, check_existing: bool = True,
+                  store_partial_digest: bool = False) -> bool:
+    """Processa il video per estrarre e controllare i frame. Restituisce True se il video è stato inserito."""
+    video_path = sanitize_video_path(video_path)
+    return extract_video_info(video_path, probe, hash_executor, check_existing, store_partial_digest)
+
+def iter_video_files(directory: str, extensions=VIDEO_EXTENSIONS):
+    """
+    Percorre la directory con os.scandir e restituisce i video man mano che vengono trovati.
+
+    Non costruisce mai la lista completa dei file: la memoria usata dipende dalla profondità
+    dell'albero, non dal numero di file.
+    """
+    stack = [str(directory)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in extensions and entry.is_file():
+                            yield Path(entry.path)
+                    except OSError as e:
+                        logging.error(f"Errore nell'accesso a {entry.path}: {e}")
+        except OSError as e:
+            logging.error(f"Errore nella lettura della directory {current}: {e}")
+
+def register_exact_copies(copies, submit_video, pbar) -> None:
+    """
+    Registra le copie identiche trovate durante la scansione riusando l'impronta dell'originale.
+
+    Va chiamata dopo che tutti i video inviati sono stati elaborati e salvati. Se l'originale
+    non è nel database (ad esempio perché l'estrazione è fallita), la copia viene elaborata normalmente.
+    """
+    registered = 0
+    for video_path, stat, source_path, content_digest in copies:
+        if video_exists_in_db(source_path):
+            copy_video_fingerprint(source_path, str(video_path), stat.st_mtime, stat.st_ino, content_digest)
+            registered += 1
+            pbar.update(1)
+        else:
+            submit_video(video_path)
+
+    logging.info(f"Copie identiche registrate senza decodifica: {registered} su {len(copies)}")
+    print(f"Copie identiche riconosciute: {registered}")
+
+def link_existing_copies() -> int:
+    """
+    Collega le copie identiche che erano già nel database prima di essere riconosciute.
+
+    La scansione confronta i file nuovi con quelli già noti, ma non i video già presenti tra loro
+    (ad esempio quelli elaborati prima di EXACT_DUPLICATES). Qui i video con la stessa dimensione
+    vengono confrontati con il digest parziale e, se coincide, con il digest completo, salvato come
+    content_digest. Anche i digest parziali vengono salvati, quindi ogni file viene letto una volta sola:
+    alle scansioni successive restano da leggere solo i video nuovi.
+
+    Returns:
+    int: Numero di video collegati ad almeno una copia identica.
+    """
+    by_size = defaultdict(list)
+    for row in fetch_digest_candidates():
+        by_size[row[2]].append(row)
+
+    partial_digests = []
+    content_digests = []
+    linked = 0
+    for size, members in by_size.items():
+        by_partial = defaultdict(list)
+        for video_id, video_path, _, partial, content in members:
+            if partial is None:
+                try:
+                    with metrics.stage("digest_partial", nbytes=min(size, 3 * PARTIAL_BLOCK_SIZE)):
+                        partial = partial_digest(video_path, size)
+                except OSError as e:
+                    logging.debug(f"Digest non calcolato per il collegamento delle copie: {video_path}: {e}")
+                    continue
+                partial_digests.append((partial, video_id))
+            by_partial[partial].append((video_id, video_path, content))
+
+        for group in by_partial.values():
+            if len(group) < 2:
+                continue
+            digests = {}
+            computed = []
+            for video_id, video_path, content in group:
+                if content is None:
+                    try:
+                        with metrics.stage("digest_full", nbytes=size):
+                            content = full_digest(video_path)
+                    except OSError as e:
+                        logging.debug(f"Digest non calcolato per il collegamento delle copie: {video_path}: {e}")
+                        continue
+                    computed.append(video_id)
+                digests[video_id] = content
+            counts = Counter(digests.values())
+            content_digests += [(digests[video_id], video_id) for video_id in computed]
+            linked += sum(1 for video_id in computed if counts[digests[video_id]] > 1)
+
+    if partial_digests or content_digests:
+        save_content_digests(partial_digests, content_digests)
+    return linked
+
+def process_videos_in_directory(directory: str, shard=None) -> None:
+    """
+    Processa tutti i video in una cartella e nelle sue sottocartelle usando multithreading.
+
+    I video vengono inviati ai worker man mano che la scansione li trova, con al massimo
+    MAX_IN_FLIGHT video in elaborazione contemporaneamente. Ogni video ha il suo thread, ma i
+    processi ffprobe/ffmpeg che girano davvero sono decisi dallo scheduler (moduli/scheduler.py).
+
+    Con uno shard (moduli.sharding.ShardSelector) elabora solo i video che gli appartengono
+    e salva il digest parziale di ciascuno, usato poi dall'unione degli shard.
+    """
     if not Path(directory).exists():
         logging.error(f"La directory specificata non esiste: {directory}")
         return
-    
-    video_files = list(Path(directory).rglob('*'))
-    total_files = sum(1 for file in video_files if file.suffix.lower() in video_extensions)
-
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        futures = []
-        start_time = time.time()  # Inizia il timer totale
-        with tqdm(total=total_files, desc="Elaborazione video", unit="file") as pbar:
-            for video_path in video_files:
-                if video_path.suffix.lower() in video_extensions:
-                    futures.append(executor.submit(process_video, video_path))
-
-            for processed_files, future in enumerate(futures, start=1):
-                try:
-                    future.result()
-                except Exception as e:
-                    logging.error(f"Errore nel processare il video {video_path}: {e}")
-
-                # Calcola il tempo rimanente e il tempo totale trascorso
-                #elapsed_time = time.time() - start_time
-                #time_remaining = (total_files - processed_files) * (elapsed_time / processed_files) if processed_files > 0 else 0
-                #elapsed_time_str = format_duration(elapsed_time)
-                #logging.info(f"File processati: {processed_files}/{total_files}, Tempo rimanente stimato: {format_duration(time_remaining)}, Tempo trascorso: {elapsed_time_str}")
 
+    # Confronta la scansione con i dati del database, caricati una sola volta
+    manifest = load_manifest()
+    in_flight = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+
+    # I video già nel database possono fare da originale per le copie identiche trovate ora
+    exact_finder = ExactDuplicateFinder() if EXACT_DUPLICATES else None
+    if exact_finder is not None:
+        for path, (_, size, _, _) in manifest.items():
+            exact_finder.add(path, size)
+    copies = []
+
+    # Attivando l'impronta temporale su una libreria esistente, i video invariati ricevono solo la sequenza
+    missing_sequences = fetch_video_ids_without_sequence() if TEMPORAL_FINGERPRINT else set()
+    backfilled = 0
+
+    # Pipeline a stadi: i thread affidano ffprobe/ffmpeg allo scheduler asyncio, i processi decodificano e calcolano
+    # gli hash senza contendersi il GIL; gli inserimenti passano per un unico writer con transazioni a lotti
+    with batched_writes() as writer, ProcessPoolExecutor(max_workers=HASH_WORKERS) as hash_executor, \
+            ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT) as executor, \
+            tqdm(total=0, desc="Elaborazione video", unit="file") as pbar:
+        pack_legacy_frames(writer)
+
+        def on_video_done(future, video_path):
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"Errore nel processare il video {video_path}: {e}")
+            pbar.update(1)
+            # Il posto si libera per ultimo: chi attende i video in elaborazione trova la barra già aggiornata
+            metrics.queue_changed("in_flight", -1)
+            in_flight.release()
+
+        def submit_task(video_path, function, *args):
+            # Attende che si liberi un posto prima di inviare il video successivo
+            in_flight.acquire()
+            metrics.queue_changed("in_flight", 1)
+            future = executor.submit(function, *args)
+            future.add_done_callback(functools.partial(on_video_done, video_path=video_path))
+
+        def submit_video(video_path):
+            submit_task(video_path, process_video, video_path, None, hash_executor, False, shard is not None)
+
+        def wait_in_flight():
+            # Attende la fine di tutti i video in elaborazione, compresi i loro callback
+            for _ in range(MAX_IN_FLIGHT):
+                in_flight.acquire()
+            for _ in range(MAX_IN_FLIGHT):
+                in_flight.release()
+
+        for video_path in iter_video_files(directory):
+            # Lo shard decide sul nome già normalizzato, che è quello salvato nel database
+            if shard is not None and not shard.accepts(video_path.parent / sanitize_filename(video_path.name)):
+                continue
+            # Il totale della barra cresce man mano che la scansione trova nuovi video
+            pbar.total += 1
+            pbar.refresh()
+            try:
+                video_path = sanitize_video_path(video_path)
+                stat = video_path.stat()
+            except OSError as e:
+                logging.error(f"Errore nell'accesso al video {video_path}: {e}")
                 pbar.update(1)
-
+                continue
+
+            manifest_entry = manifest.pop(str(video_path), None)
+            if manifest_entry is not None:
+                if not INCREMENTAL_SCAN or is_video_unchanged(stat, manifest_entry):
+                    if INCREMENTAL_SCAN and (manifest_entry[2] is None or manifest_entry[3] is None):
+                        # Video di una versione precedente: salva mtime e inode invece di rielaborarlo
+                        update_video_stat(manifest_entry[0], stat.st_mtime, stat.st_ino)
+                    if manifest_entry[0] in missing_sequences:
+                        submit_task(video_path, backfill_temporal_sequence, video_path, manifest_entry[0], hash_executor)
+                        backfilled += 1
+                    else:
+                        pbar.update(1)
+                    continue
+                logging.info(f"Video modificato, verrà rielaborato: {video_path}")
+                delete_videos([manifest_entry[0]])
+
+            if exact_finder is not None:
+                # Le copie identiche vengono registrate alla fine, quando l'originale è già nel database
+                match = exact_finder.find_copy(video_path, stat.st_size)
+                if match is not None:
+                    copies.append((video_path, stat, *match))
+                    continue
+                exact_finder.add(video_path, stat.st_size)
+
+            submit_video(video_path)
+
+        if copies:
+            # L'originale deve essere già elaborato e salvato nel database
+            wait_in_flight()
+            writer.flush()
+            register_exact_copies(copies, submit_video, pbar)
+
+        if INCREMENTAL_SCAN:
+            # I video rimasti nel manifest sotto questa directory non esistono più o non appartengono più allo shard
+            root = Path(directory)
+            removed = [entry[0] for path, entry in manifest.items()
+                       if root in Path(path).parents and (not Path(path).exists() or (shard is not None and not shard.accepts(path)))]
+            if removed:
+                logging.info(f"Rimozione di {len(removed)} video non più presenti in {directory}")
+                delete_videos(removed)
+
+        # La barra si chiude uscendo dal blocco, prima che gli executor attendano i propri task
+        wait_in_flight()
+
+    if backfilled:
+        logging.info(f"Impronte temporali calcolate per {backfilled} video già presenti nel database.")
+    if exact_finder is not None and shard is None:
+        # Gli shard vengono collegati dall'unione (moduli.sharding.link_exact_copies)
+        linked = link_existing_copies()
+        if linked:
+            logging.info(f"Copie identiche già presenti nel database collegate: {linked} video.")
+            print(f"Copie identiche già presenti collegate: {linked}")
+    logging.info(f"Scheduler dei processi: {get_scheduler().summary()}")
+    if shard is None:
+        # Gli shard non vengono confrontati: l'indice si aggiorna nel database principale dopo l'unione
+        update_hash_index()
     logging.info("Elaborazione video completata.")
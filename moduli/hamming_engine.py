@@ -0,0 +1,103 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Dimensione predefinita dei blocchi: 512 x 512 distanze uint64 occupano 2 MB, quindi restano in cache L2/L3
+DEFAULT_TILE_SIZE = 512
+
+# Tabella dei bit impostati per ogni byte, usata se numpy non offre bitwise_count (numpy < 2.0)
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount64(values):
+    """Conta i bit impostati per ogni elemento di un array uint64."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    values = np.ascontiguousarray(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def pack_hashes(hashes):
+    """
+    Converte una lista di hash interi (o un array uint64, usato così com'è) in un array contiguo uint64.
+
+    Returns:
+    tuple: (array uint64 degli hash validi, array int64 con l'indice originale di ciascun hash)
+    """
+    if isinstance(hashes, np.ndarray):
+        # Colonna già contigua (ad esempio dall'indice degli hash mappato in memoria): nessuna copia
+        return np.ascontiguousarray(hashes, dtype=np.uint64), np.arange(len(hashes), dtype=np.int64)
+    positions = [idx for idx, value in enumerate(hashes) if value is not None]
+    packed = np.fromiter((hashes[idx] for idx in positions), dtype=np.uint64, count=len(positions))
+    return packed, np.asarray(positions, dtype=np.int64)
+
+
+def _scan_row_block(packed, row_start, tile_size, distance_threshold):
+    """Confronta un blocco di righe con tutte le colonne successive, un tile alla volta."""
+    count = len(packed)
+    row_end = min(row_start + tile_size, count)
+    rows = packed[row_start:row_end, None]
+    found_i, found_j, found_d = [], [], []
+
+    for col_start in range(row_start, count, tile_size):
+        col_end = min(col_start + tile_size, count)
+        distances = popcount64(rows ^ packed[None, col_start:col_end])
+        mask = distances < distance_threshold
+        if col_start == row_start:
+            # Nel tile diagonale tiene solo le coppie con i < j
+            mask &= np.triu(np.ones(mask.shape, dtype=bool), k=1)
+        ii, jj = np.nonzero(mask)
+        if len(ii):
+            found_i.append(ii + row_start)
+            found_j.append(jj + col_start)
+            found_d.append(distances[ii, jj])
+
+    if not found_i:
+        return None
+    return np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_d)
+
+
+def find_similar_pairs_numpy(hashes, distance_threshold, tile_size=DEFAULT_TILE_SIZE, max_workers=None, progress=None):
+    """
+    Calcola XOR e popcount su tutte le coppie a blocchi, senza mai tenere in memoria l'intera matrice.
+
+    I blocchi di righe vengono distribuiti su più thread: le ufunc di numpy rilasciano il GIL.
+
+    Parameters:
+    hashes (list): Hash interi a 64 bit, le voci None vengono ignorate; oppure array numpy uint64.
+    distance_threshold (int): Soglia esclusiva sulla distanza Hamming.
+    tile_size (int): Lato del blocco di confronto.
+    max_workers (int): Numero di thread; per impostazione predefinita il numero di core.
+    progress (callable): Funzione opzionale chiamata con il numero di hash completati.
+
+    Returns:
+    tuple: (coppie (i, j, distanza) ordinate, numero di coppie confrontate)
+    """
+    packed, positions = pack_hashes(hashes)
+    count = len(packed)
+    total_pairs = count * (count - 1) // 2
+    if distance_threshold <= 0 or count < 2:
+        if progress:
+            progress(len(hashes))
+        return [], total_pairs
+
+    max_workers = max_workers or os.cpu_count() or 1
+    pairs = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            (row_start, executor.submit(_scan_row_block, packed, row_start, tile_size, distance_threshold))
+            for row_start in range(0, count, tile_size)
+        ]
+        for row_start, future in futures:
+            block = future.result()
+            if block is not None:
+                ii, jj, dd = block
+                pairs.extend(zip(positions[ii].tolist(), positions[jj].tolist(), dd.tolist()))
+            if progress:
+                progress(min(tile_size, count - row_start))
+
+    if progress and count < len(hashes):
+        progress(len(hashes) - count)
+
+    pairs.sort()
+    return pairs, total_pairs
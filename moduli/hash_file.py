@@ -0,0 +1,227 @@
+import logging
+import mmap
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from moduli import database_manager
+from moduli.database_manager import connect_db, reader_connection
+
+# Intestazione a dimensione fissa: firma, versione del formato, capacità (righe allocate per colonna),
+# voci valide, righe del database coperte (anche quelle senza hash) e id più alto coperto
+MAGIC = b"VDHASHIX"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIxxxxQQQQ")
+HEADER_SIZE = 64
+
+# Colonne del file, una dopo l'altra, ciascuna di capacità x 8 byte
+COLUMNS = (("hashes", "<u8"), ("ids", "<i8"), ("durations", "<f8"), ("sizes", "<i8"))
+ROW_SIZE = 8
+
+# Capacità minima e spazio lasciato libero a ogni ricostruzione, per aggiungere video senza riscrivere il file
+MIN_CAPACITY = 1024
+GROWTH = 1.25
+
+# Righe lette da SQLite per volta durante la costruzione
+READ_BATCH_SIZE = 65536
+
+
+def hash_index_file(db_file=None):
+    """Percorso dell'indice degli hash del database indicato (predefinito: DB_FILE): <nome>.hashes.idx accanto al database."""
+    db_file = Path(db_file or database_manager.DB_FILE)
+    return str(db_file.with_name(f"{db_file.stem}.hashes.idx"))
+
+
+def column_offset(position, capacity):
+    return HEADER_SIZE + position * capacity * ROW_SIZE
+
+
+def read_header(path):
+    """Restituisce l'intestazione (capacità, voci, righe coperte, ultimo id) oppure None se il file manca o non è valido."""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read(HEADER_SIZE)
+            file_size = os.fstat(f.fileno()).st_size
+    except OSError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    magic, version, capacity, count, rows, last_id = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION or count > capacity or file_size < column_offset(len(COLUMNS), capacity):
+        return None
+    return {"capacity": capacity, "count": count, "rows": rows, "last_id": last_id}
+
+
+def database_state(conn):
+    """Restituisce (numero di video, id più alto) del database: se cambiano, l'indice non è più allineato."""
+    count, last_id = conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM videos").fetchone()
+    return count, last_id
+
+
+def read_columns(conn, since_id, until_id):
+    """
+    Legge dal database le colonne dell'indice per i video con hash valorizzato e id in (since_id, until_id].
+
+    Returns:
+    dict: Nome della colonna -> array numpy, in ordine di id.
+    """
+    cursor = conn.execute(
+        "SELECT id, combined_hash, duration, size FROM videos WHERE id > ? AND id <= ? AND combined_hash IS NOT NULL ORDER BY id",
+        (since_id, until_id),
+    )
+    chunks = {name: [] for name, _ in COLUMNS}
+    while True:
+        rows = cursor.fetchmany(READ_BATCH_SIZE)
+        if not rows:
+            break
+        ids, hashes, durations, sizes = zip(*rows)
+        # Gli hash sono salvati come interi con segno: la vista uint64 li riporta senza segno senza copiarli
+        chunks["hashes"].append(np.array(hashes, dtype=np.int64).view(np.uint64))
+        chunks["ids"].append(np.array(ids, dtype=np.int64))
+        chunks["durations"].append(np.array([np.nan if value is None else value for value in durations], dtype=np.float64))
+        chunks["sizes"].append(np.array([0 if value is None else value for value in sizes], dtype=np.int64))
+    return {name: np.concatenate(chunks[name]).astype(dtype, copy=False) if chunks[name] else np.empty(0, dtype=dtype)
+            for name, dtype in COLUMNS}
+
+
+def write_hash_index(path, conn):
+    """
+    Ricostruisce l'indice dal database, in un file temporaneo che poi sostituisce quello esistente.
+
+    Returns:
+    int: Numero di voci scritte.
+    """
+    rows, last_id = database_state(conn)
+    columns = read_columns(conn, 0, last_id)
+    count = len(columns["ids"])
+    capacity = max(MIN_CAPACITY, int(count * GROWTH))
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, capacity, count, rows, last_id).ljust(HEADER_SIZE, b'\0'))
+        for position, (name, _) in enumerate(COLUMNS):
+            f.seek(column_offset(position, capacity))
+            f.write(columns[name].tobytes())
+        f.truncate(column_offset(len(COLUMNS), capacity))
+    os.replace(temp_path, path)
+    return count
+
+
+def append_hash_index(path, header, conn):
+    """
+    Aggiunge in coda all'indice i video inseriti dopo l'ultimo id coperto, senza riscrivere il file.
+
+    Le colonne vengono scritte prima dell'intestazione, quindi un lettore che apre il file nel
+    frattempo vede ancora il numero di voci precedente.
+
+    Returns:
+    int: Numero di voci aggiunte, oppure None se lo spazio libero non basta e serve una ricostruzione.
+    """
+    rows, last_id = database_state(conn)
+    columns = read_columns(conn, header["last_id"], last_id)
+    added = len(columns["ids"])
+    count = header["count"] + added
+    if count > header["capacity"]:
+        return None
+
+    with open(path, 'r+b') as f:
+        for position, (name, _) in enumerate(COLUMNS):
+            f.seek(column_offset(position, header["capacity"]) + header["count"] * ROW_SIZE)
+            f.write(columns[name].tobytes())
+        f.flush()
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, header["capacity"], count, rows, last_id))
+    return added
+
+
+def update_hash_index(db_file=None):
+    """
+    Allinea l'indice degli hash al database, chiamata alla fine della scansione e dell'unione degli shard.
+
+    Se dopo l'ultimo aggiornamento sono stati solo aggiunti video, le nuove voci vengono scritte in
+    coda; se qualche video è stato eliminato o manca lo spazio, il file viene ricostruito.
+    """
+    path = hash_index_file(db_file)
+    conn = connect_db(db_file)
+    try:
+        header = read_header(path)
+        if header is not None:
+            covered = conn.execute("SELECT COUNT(*) FROM videos WHERE id <= ?", (header["last_id"],)).fetchone()[0]
+            if covered == header["rows"]:
+                added = append_hash_index(path, header, conn)
+                if added is not None:
+                    if added:
+                        logging.info(f"Indice degli hash aggiornato: {added} video aggiunti a {path}.")
+                    return
+        count = write_hash_index(path, conn)
+        logging.info(f"Indice degli hash ricostruito: {count} video in {path}.")
+    finally:
+        conn.close()
+
+
+class HashIndex:
+    """
+    Indice degli hash aperto in sola lettura con mmap.
+
+    Gli attributi hashes (uint64), ids (int64), durations (float64) e sizes (int64) sono array numpy
+    che puntano direttamente al file mappato in memoria: aprirlo non copia né decodifica nulla,
+    e le pagine vengono lette dal sistema operativo solo quando servono. Percorsi e metadati
+    vanno letti da SQLite solo per i video trovati.
+    """
+
+    def __init__(self, path):
+        header = read_header(path)
+        if header is None:
+            raise ValueError(f"Indice degli hash non valido: {path}")
+        self.path = path
+        self.count = header["count"]
+        self.rows = header["rows"]
+        self.last_id = header["last_id"]
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for position, (name, dtype) in enumerate(COLUMNS):
+            setattr(self, name, np.frombuffer(self.map, dtype=dtype, count=self.count,
+                                              offset=column_offset(position, header["capacity"])))
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        # Gli array devono essere rilasciati prima della mappa, che altrimenti non si può chiudere
+        for name, _ in COLUMNS:
+            setattr(self, name, None)
+        try:
+            self.map.close()
+        except BufferError:
+            # Qualche vista della mappa è ancora viva (ad esempio in un traceback o nel motore numpy):
+            # la mappa verrà chiusa dal garbage collector quando l'ultima vista sarà rilasciata
+            logging.debug(f"Indice degli hash {self.path} ancora in uso, chiusura rimandata.")
+        self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.close()
+        except Exception:
+            if exc_type is None:
+                raise
+            # Non nasconde l'eccezione già in corso, che è quella da riportare
+            logging.exception(f"Errore nella chiusura dell'indice degli hash {self.path}")
+
+
+def open_hash_index():
+    """
+    Apre l'indice degli hash del database corrente, aggiornandolo prima se non corrisponde più al database.
+
+    Returns:
+    HashIndex: Da chiudere con close (o da usare in un blocco with).
+    """
+    path = hash_index_file()
+    header = read_header(path)
+    if header is None or (header["rows"], header["last_id"]) != database_state(reader_connection()):
+        update_hash_index()
+    return HashIndex(path)
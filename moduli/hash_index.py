@@ -0,0 +1,238 @@
+import logging
+import numpy as np
+from moduli.hamming_engine import find_similar_pairs_numpy
+
+# Metodi di ricerca disponibili per il confronto degli hash
+COMPARE_METHODS = ("brute", "bktree", "mih", "numpy")
+
+
+def hex_to_int(hash_hex):
+    """Converte un hash esadecimale in intero. Restituisce None se l'hash non è valido."""
+    try:
+        return int(str(hash_hex), 16)
+    except (TypeError, ValueError):
+        return None
+
+
+def popcount(value):
+    """Conta i bit impostati a 1 in un intero."""
+    return bin(value).count('1')
+
+
+class LinearScan:
+    """Indice a forza bruta: confronta l'hash cercato con tutti gli hash inseriti."""
+
+    def __init__(self):
+        self.items = []
+        self.distance_computations = 0
+
+    def add(self, value, item):
+        """Aggiunge un hash (intero) con l'elemento associato."""
+        self.items.append((value, item))
+
+    def query(self, value, radius):
+        """Restituisce la lista di (elemento, distanza) con distanza <= raggio."""
+        self.distance_computations += len(self.items)
+        matches = []
+        for other, item in self.items:
+            distance = popcount(other ^ value)
+            if distance <= radius:
+                matches.append((item, distance))
+        return matches
+
+
+class BKTree:
+    """
+    Albero BK (Burkhard-Keller) per la ricerca di hash entro una distanza Hamming.
+
+    Ogni nodo è una lista [valore, elemento, figli], dove i figli sono indicizzati
+    dalla distanza dal nodo padre. La disuguaglianza triangolare permette di
+    visitare solo i rami con distanza compresa in [d - raggio, d + raggio].
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+        self.distance_computations = 0
+
+    def add(self, value, item):
+        """Aggiunge un hash (intero) con l'elemento associato."""
+        self.size += 1
+        if self.root is None:
+            self.root = [value, item, {}]
+            return
+
+        node = self.root
+        while True:
+            distance = popcount(node[0] ^ value)
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, item, {}]
+                return
+            node = child
+
+    def query(self, value, radius):
+        """Restituisce la lista di (elemento, distanza) con distanza <= raggio."""
+        if self.root is None:
+            return []
+
+        matches = []
+        stack = [self.root]
+        while stack:
+            node_value, node_item, children = stack.pop()
+            distance = popcount(node_value ^ value)
+            self.distance_computations += 1
+            if distance <= radius:
+                matches.append((node_item, distance))
+
+            low, high = distance - radius, distance + radius
+            for child_distance, child in children.items():
+                if low <= child_distance <= high:
+                    stack.append(child)
+        return matches
+
+
+class MultiIndexHashTable:
+    """
+    Tabella hash multi-indice: l'hash viene diviso in (raggio + 1) bande contigue.
+
+    Per il principio dei cassetti, due hash con distanza <= raggio coincidono
+    esattamente in almeno una banda, quindi basta verificare i candidati che
+    condividono almeno un bucket.
+    """
+
+    def __init__(self, radius, bits=64):
+        if radius < 0:
+            raise ValueError("Il raggio deve essere maggiore o uguale a zero.")
+
+        self.radius = radius
+        self.bits = bits
+        self.values = {}
+        self.distance_computations = 0
+
+        band_count = min(radius + 1, bits)
+        base, extra = divmod(bits, band_count)
+        self.bands = []  # Lista di (shift, maschera)
+        shift = 0
+        for idx in range(band_count):
+            width = base + (1 if idx < extra else 0)
+            self.bands.append((shift, (1 << width) - 1))
+            shift += width
+        self.tables = [{} for _ in self.bands]
+
+    def _band_keys(self, value):
+        return [(value >> shift) & mask for shift, mask in self.bands]
+
+    def add(self, value, item):
+        """Aggiunge un hash (intero) con l'elemento associato."""
+        self.values[item] = value
+        for table, key in zip(self.tables, self._band_keys(value)):
+            table.setdefault(key, []).append(item)
+
+    def remove(self, item):
+        """Rimuove l'elemento indicato, se presente."""
+        value = self.values.pop(item, None)
+        if value is None:
+            return
+        for table, key in zip(self.tables, self._band_keys(value)):
+            bucket = table[key]
+            bucket.remove(item)
+            if not bucket:
+                del table[key]
+
+    def __len__(self):
+        return len(self.values)
+
+    def query(self, value, radius=None):
+        """Restituisce la lista di (elemento, distanza) con distanza <= raggio."""
+        if radius is None:
+            radius = self.radius
+        if radius > self.radius:
+            raise ValueError(f"Il raggio {radius} supera quello della tabella ({self.radius}).")
+
+        candidates = set()
+        for table, key in zip(self.tables, self._band_keys(value)):
+            candidates.update(table.get(key, ()))
+
+        matches = []
+        for item in candidates:
+            distance = popcount(self.values[item] ^ value)
+            self.distance_computations += 1
+            if distance <= radius:
+                matches.append((item, distance))
+        return matches
+
+
+def build_index(method, radius, bits=64):
+    """Crea l'indice di ricerca corrispondente al metodo richiesto."""
+    if method == "brute":
+        return LinearScan()
+    if method == "bktree":
+        return BKTree()
+    if method == "mih":
+        return MultiIndexHashTable(radius, bits)
+    raise ValueError(f"Metodo di confronto non supportato: {method}")
+
+
+def find_similar_pairs(hashes, distance_threshold, method="bktree", progress=None, log=True, **engine_options):
+    """
+    Trova tutte le coppie (i, j, distanza) con i < j e distanza < soglia.
+
+    Parameters:
+    hashes (list): Hash interi, le voci None vengono ignorate; oppure array numpy uint64 (colonna dell'indice degli hash).
+    distance_threshold (int): Soglia esclusiva, come nel confronto a forza bruta.
+    method (str): "brute", "bktree", "mih" oppure "numpy".
+    progress (callable): Funzione opzionale chiamata con il numero di hash elaborati.
+    log (bool): Se False non scrive il riepilogo nel log (utile quando si confrontano molti blocchi).
+    **engine_options: Opzioni del motore numpy (tile_size, max_workers).
+
+    Returns:
+    tuple: (coppie ordinate per (i, j), statistiche del confronto)
+    """
+    radius = distance_threshold - 1
+    if isinstance(hashes, np.ndarray):
+        if method != "numpy":
+            hashes = hashes.tolist()  # Gli indici lavorano su interi Python
+        valid = len(hashes)
+    else:
+        valid = sum(1 for h in hashes if h is not None)
+    stats = {
+        "method": method,
+        "total_pairs": valid * (valid - 1) // 2,
+        "distance_computations": 0,
+        "pruned": 0,
+        "matches": 0,
+    }
+
+    pairs = []
+    bits = 64 if isinstance(hashes, np.ndarray) else max([64] + [h.bit_length() for h in hashes if h is not None])
+    if method == "numpy" and bits > 64:
+        logging.warning("Il motore numpy supporta solo hash a 64 bit, verrà usato 'mih'.")
+        method = stats["method"] = "mih"
+
+    if method == "numpy":
+        pairs, stats["distance_computations"] = find_similar_pairs_numpy(hashes, distance_threshold, progress=progress, **engine_options)
+    elif radius >= 0 and valid > 1:
+        index = build_index(method, radius, bits)
+
+        for idx, value in enumerate(hashes):
+            if value is not None:
+                for other, distance in index.query(value, radius):
+                    pairs.append((other, idx, distance))
+                index.add(value, idx)
+            if progress:
+                progress(1)
+
+        pairs.sort()
+        stats["distance_computations"] = index.distance_computations
+    elif progress:
+        progress(len(hashes))
+
+    stats["pruned"] = stats["total_pairs"] - stats["distance_computations"]
+    stats["matches"] = len(pairs)
+    if log:
+        logging.info(
+            f"Confronto '{method}': {stats['distance_computations']} distanze calcolate su "
+            f"{stats['total_pairs']} coppie, {stats['pruned']} candidati scartati, {stats['matches']} corrispondenze."
+        )
+    return pairs, stats
@@ -1,6 +1,9 @@
+import io
+import time
 import imagehash
 import numpy as np
 from PIL import Image
+from moduli.batch_hash import PHASH_IMAGE_SIZE, combine_bits_mode, hash_stack, phash_stack
 
 def combine_hashes_mode(*hashes):
     """
@@ -49,6 +52,92 @@ def combine_hashes_mode(*hashes):
     return combined_hash
 
 
+# Qualità JPEG delle anteprime salvate nel database
+PREVIEW_QUALITY = 80
+
+
+def encode_preview(image, width):
+    """Riduce l'immagine alla larghezza indicata (senza ingrandirla) e la codifica in JPEG. Restituisce i byte."""
+    preview = image.convert('RGB')
+    if preview.width > width:
+        preview = preview.resize((width, max(1, round(preview.height * width / preview.width))), Image.BILINEAR)
+    buffer = io.BytesIO()
+    preview.save(buffer, format='JPEG', quality=PREVIEW_QUALITY)
+    return buffer.getvalue()
+
+
+def decode_hash_frame(data, frame_size=None):
+    """
+    Decodifica un frame per il calcolo degli hash.
+
+    Returns:
+    tuple: (immagine PIL, array uint8 32x32 in scala di grigi ridimensionato come in imagehash.phash)
+    """
+    if frame_size:
+        image = Image.fromarray(np.frombuffer(data, dtype=np.uint8).reshape(frame_size, frame_size), mode='L')
+    else:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    gray = image.convert('L')
+    if gray.size != (PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE):
+        gray = gray.resize((PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), Image.LANCZOS)
+    return image, np.asarray(gray)
+
+
+def hash_frame_buffers(frames, frame_size=None, with_timings=False):
+    """
+    Calcola phash, dhash e average hash di un gruppo di frame e i loro hash combinati.
+
+    Ogni frame viene decodificato una sola volta in un buffer 32x32 in scala di grigi; i tre hash
+    di tutti i frame vengono poi calcolati insieme da batch_hash.hash_stack. Il phash è identico,
+    bit per bit, a quello di imagehash.phash; dhash e average hash sono calcolati sullo stesso buffer
+    (uguali a imagehash sul buffer 32x32, non sul frame originale).
+
+    Pensata per essere eseguita in un processo separato: riceve e restituisce solo
+    byte e interi, così il passaggio tra processi resta compatto.
+
+    Parameters:
+    frames (list): Tuple (byte del frame, larghezza dell'anteprima da creare o None).
+    frame_size (int): Se indicato, i byte sono frame grezzi in scala di grigi frame_size x frame_size;
+                      altrimenti sono immagini codificate (PNG/JPEG).
+    with_timings (bool): Restituisce anche i secondi spesi in decodifica (PIL) e negli hash, misurati nel processo che esegue il lavoro.
+
+    Returns:
+    tuple: (phash combinato a 64 bit, lista dei phash dei frame a 64 bit, lista dei byte JPEG delle anteprime o None,
+           (dhash combinato, average hash combinato)), più (secondi di decodifica, secondi degli hash) con with_timings
+    """
+    start = time.perf_counter()
+    buffers = []
+    previews = []
+    for data, preview_width in frames:
+        image, gray = decode_hash_frame(data, frame_size)
+        buffers.append(gray)
+        previews.append(encode_preview(image, preview_width) if preview_width else None)
+    decoded = time.perf_counter()
+
+    phashes, dhashes, ahashes = hash_stack(np.stack(buffers))
+    result = (combine_bits_mode(phashes), [int(value) for value in phashes], previews,
+              (combine_bits_mode(dhashes), combine_bits_mode(ahashes)))
+    if with_timings:
+        return (*result, (decoded - start, time.perf_counter() - decoded))
+    return result
+
+
+def hash_frame_sequence(data, frame_size):
+    """
+    Calcola l'hash perceptuale di ogni frame di una sequenza grezza in scala di grigi.
+
+    Parameters:
+    data (bytes): Frame frame_size x frame_size concatenati.
+    frame_size (int): Lato dei frame.
+
+    Returns:
+    list: Hash a 64 bit dei frame, nello stesso ordine.
+    """
+    frames = np.frombuffer(data, dtype=np.uint8).reshape(-1, frame_size, frame_size)
+    return [int(value) for value in phash_stack(frames)]
+
+
 def calculate_phash(image):
     """Calcola l'hash perceptuale dell'immagine."""
     return imagehash.phash(image)
@@ -0,0 +1,274 @@
+import configparser
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+
+# Load configuration
+config = configparser.ConfigParser()
+
+# Check if the config file exists
+config_file = Path('config.ini')
+if not config_file.exists():
+    raise FileNotFoundError(f"Il file di configurazione 'config.ini' non è stato trovato.")
+
+config.read(config_file)
+
+# Misura tempi, errori e byte di ogni fase; disattivata, le funzioni non vengono nemmeno avvolte
+METRICS_ENABLED = config.getboolean('Metrics', 'ENABLED', fallback=False)
+# File in cui salvare le metriche a fine esecuzione: .json oppure .prom (textfile di Prometheus); vuoto = solo riepilogo
+METRICS_FILE = config.get('Metrics', 'OUTPUT', fallback='').strip()
+
+# Limiti superiori (secondi) degli intervalli dell'istogramma delle latenze
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Prefisso dei nomi delle metriche Prometheus
+METRIC_PREFIX = "video_duplicator"
+
+
+class StageStats:
+    """Contatori di una fase: chiamate, errori, tempo totale e massimo, byte letti e istogramma delle latenze."""
+
+    __slots__ = ("count", "failures", "total", "max", "bytes", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # l'ultimo intervallo raccoglie le latenze oltre l'ultimo limite
+
+    def observe(self, seconds, failed=False, nbytes=0):
+        self.count += 1
+        self.failures += bool(failed)
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.bytes += nbytes
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def percentile(self, fraction):
+        """Stima il percentile dall'istogramma: restituisce il limite superiore dell'intervallo che lo contiene."""
+        target = fraction * self.count
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            cumulative += count
+            if count and cumulative >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "failures": self.failures,
+            "total_seconds": self.total,
+            "mean_seconds": self.total / self.count if self.count else 0.0,
+            "p50_seconds": self.percentile(0.5),
+            "p95_seconds": self.percentile(0.95),
+            "max_seconds": self.max,
+            "bytes": self.bytes,
+            "buckets": dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], self.buckets)),
+        }
+
+
+class QueueStats:
+    """Profondità di una coda: valore corrente, massimo e media dei campioni."""
+
+    __slots__ = ("current", "max", "samples", "total")
+
+    def __init__(self):
+        self.current = 0
+        self.max = 0
+        self.samples = 0
+        self.total = 0
+
+    def sample(self, depth):
+        self.current = depth
+        self.max = max(self.max, depth)
+        self.samples += 1
+        self.total += depth
+
+    def to_dict(self):
+        return {"current": self.current, "max": self.max, "mean": self.total / self.samples if self.samples else 0.0}
+
+
+class Metrics:
+    """
+    Raccoglie le metriche di tutte le fasi dell'elaborazione; sicura tra thread.
+
+    Le fasi vengono create al primo utilizzo, quindi non serve registrarle in anticipo.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.queues = {}
+        self.started = time.perf_counter()
+
+    def observe(self, stage, seconds, failed=False, nbytes=0):
+        """Registra una chiamata della fase con la sua durata in secondi."""
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+            stats.observe(seconds, failed, nbytes)
+
+    @contextmanager
+    def stage(self, stage, nbytes=0):
+        """Misura il blocco come una chiamata della fase; un'eccezione conta come errore."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(stage, time.perf_counter() - start, failed=True)
+            raise
+        self.observe(stage, time.perf_counter() - start, nbytes=nbytes)
+
+    def queue_depth(self, queue, depth):
+        """Registra la profondità attuale di una coda."""
+        with self.lock:
+            stats = self.queues.get(queue)
+            if stats is None:
+                stats = self.queues[queue] = QueueStats()
+            stats.sample(depth)
+
+    def queue_changed(self, queue, delta):
+        """Aggiorna la profondità di una coda di cui si contano gli ingressi (+1) e le uscite (-1)."""
+        with self.lock:
+            stats = self.queues.get(queue)
+            if stats is None:
+                stats = self.queues[queue] = QueueStats()
+            stats.sample(stats.current + delta)
+
+    def snapshot(self):
+        """Restituisce tutte le metriche come dizionario serializzabile in JSON."""
+        with self.lock:
+            return {
+                "elapsed_seconds": time.perf_counter() - self.started,
+                "stages": {stage: stats.to_dict() for stage, stats in sorted(self.stages.items())},
+                "queues": {queue: stats.to_dict() for queue, stats in sorted(self.queues.items())},
+            }
+
+    def summary(self):
+        """Riepilogo testuale delle metriche, una riga per fase e per coda."""
+        snapshot = self.snapshot()
+        elapsed = snapshot["elapsed_seconds"]
+        lines = [f"Metriche dell'esecuzione ({elapsed:.1f}s):",
+                 f"  {'fase':<18}{'chiamate':>9}{'errori':>8}{'totale s':>10}{'media ms':>10}"
+                 f"{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'MB':>9}{'/s':>8}"]
+        for stage, stats in snapshot["stages"].items():
+            lines.append(
+                f"  {stage:<18}{stats['count']:>9}{stats['failures']:>8}{stats['total_seconds']:>10.2f}"
+                f"{stats['mean_seconds'] * 1000:>10.1f}{stats['p50_seconds'] * 1000:>9.1f}{stats['p95_seconds'] * 1000:>9.1f}"
+                f"{stats['max_seconds'] * 1000:>9.1f}{stats['bytes'] / 2 ** 20:>9.1f}{stats['count'] / elapsed if elapsed else 0:>8.1f}"
+            )
+        for queue, stats in snapshot["queues"].items():
+            lines.append(f"  coda {queue}: massimo {stats['max']}, media {stats['mean']:.1f}")
+        return "\n".join(lines)
+
+    def to_prometheus(self):
+        """Metriche nel formato testuale di Prometheus (per il textfile collector di node_exporter)."""
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {METRIC_PREFIX}_stage_seconds Durata delle chiamate di ogni fase.",
+            f"# TYPE {METRIC_PREFIX}_stage_seconds histogram",
+        ]
+        for stage, stats in snapshot["stages"].items():
+            cumulative = 0
+            for bound, count in stats["buckets"].items():
+                cumulative += count
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {stats["total_seconds"]}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        for name, key, help_text in (("stage_failures_total", "failures", "Chiamate fallite di ogni fase."),
+                                     ("stage_bytes_total", "bytes", "Byte letti o prodotti da ogni fase.")):
+            lines += [f"# HELP {METRIC_PREFIX}_{name} {help_text}", f"# TYPE {METRIC_PREFIX}_{name} counter"]
+            lines += [f'{METRIC_PREFIX}_{name}{{stage="{stage}"}} {stats[key]}' for stage, stats in snapshot["stages"].items()]
+        lines += [f"# HELP {METRIC_PREFIX}_queue_depth_max Profondità massima di ogni coda.",
+                  f"# TYPE {METRIC_PREFIX}_queue_depth_max gauge"]
+        lines += [f'{METRIC_PREFIX}_queue_depth_max{{queue="{queue}"}} {stats["max"]}' for queue, stats in snapshot["queues"].items()]
+        lines += [f"# HELP {METRIC_PREFIX}_run_seconds Durata dell'esecuzione.",
+                  f"# TYPE {METRIC_PREFIX}_run_seconds gauge",
+                  f"{METRIC_PREFIX}_run_seconds {snapshot['elapsed_seconds']}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, output_file):
+        """Salva le metriche in JSON oppure, se il file termina con .prom, nel formato di Prometheus."""
+        output_file = Path(output_file)
+        content = self.to_prometheus() if output_file.suffix == ".prom" else json.dumps(self.snapshot(), indent=2)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        # Scrittura atomica: il collector non deve mai leggere un file a metà
+        partial = output_file.with_name(f".{output_file.name}.tmp")
+        partial.write_text(content)
+        os.replace(partial, output_file)
+
+
+class NullMetrics:
+    """Sostituisce Metrics quando le metriche sono disattivate: ogni operazione è vuota."""
+
+    _context = nullcontext()
+
+    def observe(self, stage, seconds, failed=False, nbytes=0):
+        pass
+
+    def stage(self, stage, nbytes=0):
+        return self._context
+
+    def queue_depth(self, queue, depth):
+        pass
+
+    def queue_changed(self, queue, delta):
+        pass
+
+
+metrics = Metrics() if METRICS_ENABLED else NullMetrics()
+
+
+def timed(stage, failed=None, nbytes=None):
+    """
+    Decoratore che misura ogni chiamata della funzione come una chiamata della fase.
+
+    Con le metriche disattivate restituisce la funzione invariata.
+
+    Parameters:
+    stage (str): Nome della fase.
+    failed (callable): Riceve il risultato e restituisce True se la chiamata è fallita; le eccezioni contano sempre come errori.
+    nbytes (callable): Riceve il risultato (se non è None) e restituisce i byte letti o prodotti.
+    """
+    def decorator(function):
+        if not METRICS_ENABLED:
+            return function
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException:
+                metrics.observe(stage, time.perf_counter() - start, failed=True)
+                raise
+            metrics.observe(stage, time.perf_counter() - start,
+                            failed=bool(failed and failed(result)),
+                            nbytes=nbytes(result) if nbytes and result is not None else 0)
+            return result
+        return wrapper
+    return decorator
+
+
+def report_metrics(output_file=METRICS_FILE):
+    """Stampa il riepilogo delle metriche e, se indicato, le salva su file. Non fa nulla se le metriche sono disattivate."""
+    if not METRICS_ENABLED:
+        return
+    summary = metrics.summary()
+    print(summary)
+    logging.info(summary)
+    if output_file:
+        try:
+            metrics.write(output_file)
+            logging.info(f"Metriche salvate in {output_file}")
+        except OSError as e:
+            logging.error(f"Impossibile salvare le metriche in {output_file}: {e}")
@@ -0,0 +1,264 @@
+import configparser
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from moduli.compare import CONFIRM_HASHES, CONFIRM_COLUMNS, CONFIRM_DISTANCE
+from moduli.database_manager import (fetch_hashes, fetch_confirmation_hashes, fetch_videos_by_ids, fetch_video_paths_by_size,
+                                     insert_video)
+from moduli.extractor import fingerprint_video, TEMPORAL_FINGERPRINT
+from moduli.hash_index import MultiIndexHashTable, popcount
+from moduli.hash_file import open_hash_index
+
+# Load configuration
+config = configparser.ConfigParser()
+
+# Check if the config file exists
+config_file = Path('config.ini')
+if not config_file.exists():
+    raise FileNotFoundError(f"Il file di configurazione 'config.ini' non è stato trovato.")
+
+config.read(config_file)
+
+DISTANCE_THRESHOLD = int(config['Settings']['DISTANCE_THRESHOLD'])
+# Servizio HTTP delle interrogazioni: ascolta solo sull'indirizzo locale indicato
+QUERY_HOST = config.get('Query', 'HOST', fallback='127.0.0.1').strip()
+QUERY_PORT = config.getint('Query', 'PORT', fallback=8765)
+
+
+def same_file(path1, path2):
+    """
+    Indica se due percorsi indicano lo stesso file.
+
+    La scansione salva i percorsi così come li costruisce da DIR_TO_PROCESS (anche relativi o sotto un
+    link simbolico), quindi entrambi vengono risolti e normalizzati (separatori e maiuscole su Windows).
+    """
+    return os.path.normcase(os.path.realpath(path1)) == os.path.normcase(os.path.realpath(path2))
+
+
+def find_library_entry(fingerprint):
+    """Restituisce l'id del video della libreria che corrisponde allo stesso file dell'impronta, oppure None."""
+    for video_id, video_path in fetch_video_paths_by_size(fingerprint["size"]):
+        if same_file(video_path, fingerprint["video_path"]):
+            return video_id
+    return None
+
+
+class DuplicateIndex:
+    """
+    Indice residente degli hash combinati della libreria, per sapere subito se un video è un duplicato.
+
+    Gli hash vengono caricati una volta dall'indice degli hash mappato in memoria in una tabella
+    multi-indice con raggio DISTANCE_THRESHOLD - 1. Prima di ogni ricerca l'indice legge solo i video con id maggiore
+    dell'ultimo caricato (gli id non vengono riusati), quindi i video inseriti da una scansione o
+    da add compaiono senza ricostruirlo; quelli eliminati vengono tolti quando una ricerca li trova.
+    È condiviso tra i thread del servizio HTTP.
+    """
+
+    def __init__(self, distance_threshold=DISTANCE_THRESHOLD, confirm_hashes=CONFIRM_HASHES):
+        unknown = [name for name in confirm_hashes if name not in CONFIRM_COLUMNS]
+        if unknown:
+            raise ValueError(f"Hash di conferma non supportati: {', '.join(unknown)}")
+        self.distance_threshold = distance_threshold
+        self.confirm_hashes = list(confirm_hashes)
+        self.index = MultiIndexHashTable(distance_threshold - 1)
+        self.confirmation = {}
+        self.last_id = 0
+        self.lock = threading.Lock()
+        self.add_lock = threading.Lock()  # Due aggiunte dello stesso file non devono inserirlo due volte
+
+        start = time.perf_counter()
+        with open_hash_index() as hash_index:
+            for video_id, value in zip(hash_index.ids.tolist(), hash_index.hashes.tolist()):
+                self.index.add(value, video_id)
+            self.last_id = hash_index.last_id
+        if self.confirm_hashes:
+            self.confirmation = fetch_confirmation_hashes([CONFIRM_COLUMNS[name] for name in self.confirm_hashes], 0)
+        self.refresh()
+        logging.info(f"Indice delle interrogazioni caricato: {len(self.index)} video in {time.perf_counter() - start:.2f}s.")
+
+    def refresh(self):
+        """Aggiunge all'indice i video inseriti nel database dopo l'ultimo caricamento. Restituisce quanti sono."""
+        with self.lock:
+            ids, hashes = fetch_hashes(self.last_id)
+            if not ids:
+                return 0
+            if self.confirm_hashes:
+                columns = [CONFIRM_COLUMNS[name] for name in self.confirm_hashes]
+                self.confirmation.update(fetch_confirmation_hashes(columns, self.last_id))
+            for video_id, value in zip(ids, hashes):
+                if value is not None:
+                    self.index.add(value, video_id)
+            self.last_id = ids[-1]
+            return len(ids)
+
+    def is_confirmed(self, video_id, confirmation):
+        """Applica gli hash di conferma come nel confronto a cascata; un hash mancante non esclude il video."""
+        return all(hash1 is None or hash2 is None or popcount(hash1 ^ hash2) < CONFIRM_DISTANCE
+                   for hash1, hash2 in zip(self.confirmation.get(video_id, ()), confirmation))
+
+    def lookup(self, fingerprint):
+        """
+        Cerca nell'indice i video simili a un'impronta calcolata da fingerprint_video.
+
+        Returns:
+        list: Dizionari {"id", "distance", "video_path"} ordinati per distanza, escluso il file stesso.
+        """
+        self.refresh()
+        confirmation = [fingerprint.get(CONFIRM_COLUMNS[name]) for name in self.confirm_hashes]
+        with self.lock:
+            matches = [(video_id, distance) for video_id, distance in self.index.query(fingerprint["combined_hash"])
+                       if self.is_confirmed(video_id, confirmation)]
+
+        videos = fetch_videos_by_ids(video_id for video_id, _ in matches)
+        results = []
+        for video_id, distance in sorted(matches, key=lambda match: (match[1], match[0])):
+            video = videos.get(video_id)
+            if video is None:
+                # Video eliminato dal database dopo il caricamento
+                with self.lock:
+                    self.index.remove(video_id)
+                    self.confirmation.pop(video_id, None)
+                continue
+            if not same_file(video[4], fingerprint["video_path"]):
+                results.append({"id": video_id, "distance": distance, "video_path": video[4]})
+        return results
+
+    def query(self, video_path, add=False):
+        """
+        Calcola l'impronta di un file e cerca i video simili già presenti nella libreria.
+
+        Parameters:
+        video_path (str): File da controllare; non viene spostato né rinominato.
+        add (bool): Inserisce anche il video nel database (e quindi nell'indice), se non è già presente.
+
+        Returns:
+        dict: Percorso, hash, corrispondenze, id inserito (o None) e tempi in millisecondi.
+
+        Raises:
+        FileNotFoundError: Se il file non esiste.
+        ValueError: Se non è possibile calcolare l'impronta del video.
+        """
+        video_path = Path(video_path).resolve()
+        if not video_path.is_file():
+            raise FileNotFoundError(f"File non trovato: {video_path}")
+
+        start = time.perf_counter()
+        fingerprint = fingerprint_video(video_path, report_failures=False, with_sequence=add and TEMPORAL_FINGERPRINT)
+        if fingerprint is None:
+            raise ValueError(f"Impossibile calcolare l'impronta di {video_path}")
+        fingerprinted = time.perf_counter()
+        matches = self.lookup(fingerprint)
+        looked_up = time.perf_counter()
+
+        added = None
+        if add:
+            with self.add_lock:
+                if find_library_entry(fingerprint) is None:
+                    insert_video(**fingerprint)
+                    self.refresh()
+                    added = find_library_entry(fingerprint)
+
+        return {
+            "video_path": fingerprint["video_path"],
+            "hash": format(fingerprint["combined_hash"], '016x'),
+            "duplicate": bool(matches),
+            "matches": matches,
+            "added_id": added,
+            "fingerprint_ms": round((fingerprinted - start) * 1000, 1),
+            "lookup_ms": round((looked_up - fingerprinted) * 1000, 3),
+        }
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """
+    Gestisce le richieste HTTP del servizio:
+
+    GET  /query?path=<file>               oppure POST /query con {"path": ..., "add": false}
+    POST /add con {"path": ...}           come /query, inserendo anche il video nella libreria
+    GET  /status                          numero di video nell'indice
+    """
+
+    index = None  # DuplicateIndex condiviso, impostato da serve
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_query(self, params, add):
+        path = params.get('path')
+        if not path:
+            self.send_json(400, {"error": "Parametro 'path' mancante"})
+            return
+        try:
+            self.send_json(200, self.index.query(path, add=add))
+        except FileNotFoundError as e:
+            self.send_json(404, {"error": str(e)})
+        except ValueError as e:
+            self.send_json(422, {"error": str(e)})
+        except Exception as e:
+            logging.error(f"Errore durante l'interrogazione di {path}: {e}")
+            self.send_json(500, {"error": str(e)})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == '/query':
+            self.handle_query(params, False)
+        elif url.path == '/status':
+            self.send_json(200, {"videos": len(self.index.index), "last_id": self.index.last_id})
+        else:
+            self.send_json(404, {"error": f"Percorso sconosciuto: {url.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path not in ('/query', '/add'):
+            self.send_json(404, {"error": f"Percorso sconosciuto: {url.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            params = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_json(400, {"error": "Corpo JSON non valido"})
+            return
+        if not isinstance(params, dict):
+            self.send_json(400, {"error": "Il corpo deve essere un oggetto JSON"})
+            return
+        self.handle_query(params, url.path == '/add' or bool(params.get('add')))
+
+    def log_message(self, format, *args):
+        logging.info(f"Interrogazione HTTP {self.address_string()}: {format % args}")
+
+
+def query_files(paths, add=False):
+    """Interroga l'indice per ciascun file e stampa il risultato in JSON, una riga per file."""
+    index = DuplicateIndex()
+    for path in paths:
+        try:
+            result = index.query(path, add=add)
+        except (FileNotFoundError, ValueError) as e:
+            result = {"video_path": str(path), "error": str(e)}
+        print(json.dumps(result, ensure_ascii=False))
+
+
+def serve(host=QUERY_HOST, port=QUERY_PORT):
+    """Carica l'indice e avvia il servizio HTTP delle interrogazioni fino a Ctrl+C."""
+    QueryRequestHandler.index = DuplicateIndex()
+    server = ThreadingHTTPServer((host, port), QueryRequestHandler)
+    server.daemon_threads = True
+    print(f"Servizio di interrogazione in ascolto su http://{host}:{server.server_port} ({len(QueryRequestHandler.index.index)} video)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,253 @@
+import asyncio
+import collections
+import configparser
+import logging
+import os
+import statistics
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+from moduli.metrics import metrics
+
+# Load configuration
+config = configparser.ConfigParser()
+
+# Check if the config file exists
+config_file = Path('config.ini')
+if not config_file.exists():
+    raise FileNotFoundError(f"Il file di configurazione 'config.ini' non è stato trovato.")
+
+config.read(config_file)
+
+# Processi ffprobe/ffmpeg contemporanei: valore iniziale (IO_WORKERS se non indicato), minimo e massimo (0 = 4 per core)
+INITIAL_PROCESSES = config.getint('Scheduler', 'INITIAL_PROCESSES', fallback=0) or config.getint('Settings', 'IO_WORKERS', fallback=8)
+MIN_PROCESSES = max(1, config.getint('Scheduler', 'MIN_PROCESSES', fallback=1))
+MAX_PROCESSES = config.getint('Scheduler', 'MAX_PROCESSES', fallback=0) or 4 * (os.cpu_count() or 1)
+# Utilizzo della CPU (0-1) oltre il quale il limite scende di un processo
+TARGET_CPU = config.getfloat('Scheduler', 'TARGET_CPU', fallback=0.9)
+# Latenza media dei processi, rispetto alla migliore osservata, oltre la quale il limite viene ridotto di un quarto
+LATENCY_TOLERANCE = config.getfloat('Scheduler', 'LATENCY_TOLERANCE', fallback=2.0)
+# Secondi tra due aggiustamenti del limite
+ADJUST_INTERVAL = config.getfloat('Scheduler', 'ADJUST_INTERVAL', fallback=1.0)
+# Timeout in secondi di ogni processo, per tipo: un ffmpeg bloccato su un file corrotto viene terminato
+TIMEOUTS = {
+    "ffprobe": config.getfloat('Scheduler', 'PROBE_TIMEOUT', fallback=30.0),
+    "ffmpeg_frame": config.getfloat('Scheduler', 'FRAME_TIMEOUT', fallback=60.0),
+    "ffmpeg_raw": config.getfloat('Scheduler', 'FRAME_TIMEOUT', fallback=60.0),
+    "ffmpeg_sequence": config.getfloat('Scheduler', 'SEQUENCE_TIMEOUT', fallback=600.0),
+}
+
+# Crescita per finestra della latenza di riferimento, così un minimo troppo vecchio viene dimenticato
+BASELINE_DRIFT = 0.05
+# Tipi esclusi dal segnale di latenza: la sequenza temporale decodifica l'intero file, quindi la sua durata
+# dipende dalla lunghezza del video e non dal carico del disco
+LATENCY_EXCLUDED_KINDS = ("ffmpeg_sequence",)
+
+
+class CpuSampler:
+    """
+    Misura l'utilizzo della CPU (0-1) tra due chiamate di sample.
+
+    Usa /proc/stat (tutto il sistema) se disponibile; altrimenti i tempi di CPU di questo
+    processo e dei processi figli già terminati, cioè dei ffmpeg eseguiti.
+    """
+
+    def __init__(self):
+        self.cpu_count = os.cpu_count() or 1
+        self.last = self.read()
+
+    def read(self):
+        """Restituisce (tempo di CPU occupato, tempo di CPU disponibile) cumulativi."""
+        try:
+            with open('/proc/stat') as stat:
+                fields = [float(value) for value in stat.readline().split()[1:]]
+            idle = fields[3] + fields[4]  # idle e iowait
+            return sum(fields) - idle, sum(fields)
+        except (OSError, ValueError, IndexError):
+            times = os.times()
+            return times.user + times.system + times.children_user + times.children_system, time.monotonic() * self.cpu_count
+
+    def sample(self):
+        busy, total = self.read()
+        last_busy, last_total = self.last
+        self.last = (busy, total)
+        if total <= last_total:
+            return None
+        return min(1.0, max(0.0, (busy - last_busy) / (total - last_total)))
+
+
+class AdaptiveLimiter:
+    """
+    Limite variabile al numero di processi contemporanei, da usare dentro l'event loop.
+
+    Ogni ADJUST_INTERVAL secondi confronta la latenza mediana dei processi terminati con la migliore
+    osservata per lo stesso tipo: se la CPU è oltre TARGET_CPU il limite scende di uno, se la latenza
+    è cresciuta oltre LATENCY_TOLERANCE (disco saturo) scende di un quarto, altrimenti sale di uno
+    se nella finestra c'erano processi in attesa. La mediana non si lascia spostare da un singolo
+    file lento; i tipi di LATENCY_EXCLUDED_KINDS non contano per la latenza.
+    """
+
+    def __init__(self, initial=INITIAL_PROCESSES, minimum=MIN_PROCESSES, maximum=MAX_PROCESSES):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.active = 0
+        self.waiters = collections.deque()
+        self.cpu = CpuSampler()
+        self.baseline = {}
+        self.window = collections.defaultdict(list)
+        self.window_start = time.monotonic()
+        self.saturated = False
+
+    async def acquire(self):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+        self.saturated = True
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # Il posto era già stato assegnato
+            else:
+                self.waiters.remove(waiter)
+            raise
+
+    def release(self):
+        self.active -= 1
+        self.wake()
+
+    def wake(self):
+        while self.waiters and self.active < self.limit:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(None)
+
+    def observe(self, kind, seconds):
+        """Registra la durata di un processo terminato e, alla fine della finestra, aggiusta il limite."""
+        if kind not in LATENCY_EXCLUDED_KINDS:
+            self.window[kind].append(seconds)
+        if time.monotonic() - self.window_start >= ADJUST_INTERVAL:
+            self.adjust()
+
+    def adjust(self):
+        cpu = self.cpu.sample()
+        ratios = []
+        for kind, samples in self.window.items():
+            median = statistics.median(samples)
+            baseline = self.baseline.get(kind, median)
+            ratios += [median / baseline if baseline > 0 else 1.0] * len(samples)
+            self.baseline[kind] = min(median, baseline * (1 + BASELINE_DRIFT))
+        latency_ratio = sum(ratios) / len(ratios) if ratios else 1.0
+
+        previous = self.limit
+        if cpu is not None and cpu > TARGET_CPU:
+            self.limit = max(self.minimum, self.limit - 1)
+        elif latency_ratio > LATENCY_TOLERANCE:
+            self.limit = max(self.minimum, int(self.limit * 0.75))
+        elif self.saturated:
+            self.limit = min(self.maximum, self.limit + 1)
+        if self.limit != previous:
+            logging.debug(f"Processi contemporanei: {previous} -> {self.limit} (CPU {cpu if cpu is not None else 0:.0%}, "
+                          f"latenza x{latency_ratio:.2f})")
+        metrics.queue_depth("subprocess_limit", self.limit)
+
+        self.window.clear()
+        self.window_start = time.monotonic()
+        self.saturated = bool(self.waiters)
+        self.wake()
+
+
+class SubprocessScheduler:
+    """
+    Esegue ffprobe e ffmpeg con asyncio.create_subprocess_exec in un event loop su un thread dedicato.
+
+    I thread della pipeline inviano i comandi con run e attendono il risultato, ma non decidono
+    quanti processi girano: lo decide AdaptiveLimiter. Ogni processo ha un timeout per tipo.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.limiter = AdaptiveLimiter()
+        self.timeouts = 0
+        self.thread = threading.Thread(target=self.loop.run_forever, name="subprocess-scheduler", daemon=True)
+        self.thread.start()
+
+    async def execute(self, command, kind, timeout):
+        queued = time.perf_counter()
+        await self.limiter.acquire()
+        metrics.observe("subprocess_wait", time.perf_counter() - queued)
+        metrics.queue_depth("subprocesses", self.limiter.active)
+        start = time.perf_counter()
+        started = timed_out = False
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            started = True
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+            except asyncio.TimeoutError:
+                timed_out = True
+                self.timeouts += 1
+                process.kill()
+                await process.wait()
+                logging.warning(f"{kind}: processo terminato dopo {timeout:.0f}s senza risposta: {' '.join(map(str, command))}")
+                raise subprocess.TimeoutExpired(command, timeout)
+            return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+        finally:
+            self.limiter.release()
+            # I processi mai avviati (OSError) o terminati per timeout non dicono nulla sul carico
+            # e falserebbero la latenza di riferimento
+            if started and not timed_out:
+                self.limiter.observe(kind, time.perf_counter() - start)
+
+    def run(self, command, kind, timeout=None, check=False):
+        """
+        Esegue il comando e ne attende la fine; può essere chiamata da qualsiasi thread tranne quello dell'event loop.
+
+        Parameters:
+        command (list): Programma e argomenti.
+        kind (str): Tipo di processo (chiave di TIMEOUTS), usato per il timeout e per la latenza di riferimento.
+        timeout (float): Secondi massimi; predefinito TIMEOUTS[kind].
+        check (bool): Solleva subprocess.CalledProcessError se il codice di uscita non è 0, come subprocess.run.
+
+        Returns:
+        subprocess.CompletedProcess: Con stdout e stderr in byte.
+
+        Raises:
+        subprocess.TimeoutExpired: Se il processo supera il timeout (viene terminato).
+        OSError: Se il programma non può essere avviato.
+        """
+        if timeout is None:
+            timeout = TIMEOUTS.get(kind)
+        result = asyncio.run_coroutine_threadsafe(self.execute(command, kind, timeout), self.loop).result()
+        if check and result.returncode:
+            raise subprocess.CalledProcessError(result.returncode, command, result.stdout, result.stderr)
+        return result
+
+    def summary(self):
+        return f"limite finale {self.limiter.limit} processi (tra {self.limiter.minimum} e {self.limiter.maximum}), {self.timeouts} terminati per timeout"
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Restituisce lo scheduler condiviso, avviandolo al primo utilizzo."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = SubprocessScheduler()
+        return _scheduler
+
+
+def run_tool(command, kind, timeout=None, check=False):
+    """Esegue ffprobe/ffmpeg tramite lo scheduler condiviso (vedi SubprocessScheduler.run)."""
+    return get_scheduler().run(command, kind, timeout, check)
@@ -0,0 +1,235 @@
+import configparser
+import hashlib
+import logging
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from moduli import database_manager
+from moduli.database_manager import connect_db, create_table
+from moduli.exact import full_digest
+from moduli.hash_file import update_hash_index
+
+# Load configuration
+config = configparser.ConfigParser()
+
+# Check if the config file exists
+config_file = Path('config.ini')
+if not config_file.exists():
+    raise FileNotFoundError(f"Il file di configurazione 'config.ini' non è stato trovato.")
+
+config.read(config_file)
+
+# Scansione a shard: questo processo elabora solo i video con hash del percorso % COUNT == INDEX
+# e/o sotto uno dei PREFIXES (relativi alla cartella elaborata), in un database a parte
+SHARD_INDEX = config.getint('Shard', 'INDEX', fallback=0)
+SHARD_COUNT = config.getint('Shard', 'COUNT', fallback=1)
+SHARD_PREFIXES = [prefix.strip() for prefix in config.get('Shard', 'PREFIXES', fallback='').split(',') if prefix.strip()]
+SHARD_NAME = config.get('Shard', 'NAME', fallback='').strip()
+
+# Colonne della tabella 'videos' che non vengono copiate così come sono dall'unione degli shard
+MERGE_EXCLUDED_COLUMNS = ("id", "shard_id", "shard_video_id")
+
+
+class ShardSelector:
+    """
+    Decide quali video appartengono a uno shard.
+
+    La chiave di un video è il suo percorso relativo alla cartella elaborata, quindi è la stessa
+    per tutti i processi e i nodi che montano la libreria nella stessa struttura. Con count > 1
+    lo shard prende i video il cui hash della chiave, modulo count, vale index; con prefixes solo
+    quelli la cui chiave inizia con uno dei prefissi. I due criteri si possono combinare.
+    """
+
+    def __init__(self, root, index=0, count=1, prefixes=None, name=None):
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"Shard non valido: indice {index} su {count}")
+        self.root = Path(root)
+        self.index = index
+        self.count = count
+        self.prefixes = [prefix.replace('\\', '/').lstrip('/') for prefix in prefixes or []]
+        if not name:
+            name = f"{index}of{count}"
+            if self.prefixes:
+                name += "-" + hashlib.blake2b(",".join(sorted(self.prefixes)).encode(), digest_size=4).hexdigest()
+        self.name = name
+
+    @property
+    def active(self):
+        """True se lo shard esclude qualche video, cioè se la scansione a shard è attiva."""
+        return self.count > 1 or bool(self.prefixes)
+
+    def key(self, video_path):
+        """Percorso del video relativo alla cartella elaborata, con separatori '/'."""
+        try:
+            return Path(video_path).relative_to(self.root).as_posix()
+        except ValueError:
+            return Path(video_path).as_posix()
+
+    def accepts(self, video_path):
+        """Indica se il video appartiene a questo shard."""
+        key = self.key(video_path)
+        if self.prefixes and not any(key.startswith(prefix) for prefix in self.prefixes):
+            return False
+        if self.count > 1:
+            return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big') % self.count == self.index
+        return True
+
+
+def merge_shard(conn, shard_file, columns):
+    """
+    Unisce un database shard, già collegato come 'shard', nel database principale.
+
+    Copia video, hash dei frame e impronte temporali con istruzioni INSERT ... SELECT, senza le
+    anteprime, che restano nello shard. Un video presente con lo stesso percorso in più shard
+    viene tenuto una volta sola, nella versione con mtime più recente; unire di nuovo uno shard
+    sostituisce i video copiati in precedenza.
+
+    Returns:
+    tuple: (video aggiunti, video sostituiti, video ignorati perché già presenti in versione più recente)
+    """
+    conn.execute("INSERT OR IGNORE INTO shards (path) VALUES (?)", (shard_file,))
+    shard_id = conn.execute("SELECT id FROM shards WHERE path = ?", (shard_file,)).fetchone()[0]
+    conn.execute("DELETE FROM main.videos WHERE shard_id = ?", (shard_id,))
+
+    replaced = conn.execute(
+        "DELETE FROM main.videos WHERE id IN (SELECT m.id FROM main.videos m JOIN shard.videos s ON s.video_path = m.video_path "
+        "WHERE COALESCE(s.mtime, 0) >= COALESCE(m.mtime, 0))"
+    ).rowcount
+    column_list = ", ".join(columns)
+    added = conn.execute(
+        f"INSERT INTO main.videos ({column_list}, shard_id, shard_video_id) "
+        f"SELECT {', '.join('s.' + column for column in columns)}, ?, s.id FROM shard.videos s "
+        f"WHERE NOT EXISTS (SELECT 1 FROM main.videos m WHERE m.video_path = s.video_path) ORDER BY s.id",
+        (shard_id,),
+    ).rowcount
+    total = conn.execute("SELECT COUNT(*) FROM shard.videos").fetchone()[0]
+
+    conn.execute(
+        "INSERT INTO main.video_frames (video_id, frame_index, timestamp, frame_hash, frame_path) "
+        "SELECT m.id, f.frame_index, f.timestamp, f.frame_hash, f.frame_path FROM shard.video_frames f "
+        "JOIN main.videos m ON m.shard_id = ? AND m.shard_video_id = f.video_id",
+        (shard_id,),
+    )
+    conn.execute(
+        "INSERT INTO main.video_sequences (video_id, position, timestamp, frame_hash) "
+        "SELECT m.id, q.position, q.timestamp, q.frame_hash FROM shard.video_sequences q "
+        "JOIN main.videos m ON m.shard_id = ? AND m.shard_video_id = q.video_id",
+        (shard_id,),
+    )
+    conn.execute("UPDATE shards SET merged_at = ? WHERE id = ?", (time.time(), shard_id))
+    return added, replaced, total - added
+
+
+def file_digest(path):
+    """Digest completo del file, oppure None se il file non è leggibile da questo nodo."""
+    try:
+        return full_digest(path)
+    except OSError:
+        return None
+
+
+def link_exact_copies(conn):
+    """
+    Riconosce le copie identiche finite in shard diversi e assegna loro lo stesso content_digest.
+
+    I candidati hanno la stessa dimensione e lo stesso digest parziale. L'identità si conferma
+    con il digest completo, già salvato oppure calcolato se il file è leggibile da questo nodo.
+    Un file non leggibile viene unito a un gruppo solo se ha anche lo stesso hash combinato;
+    un gruppo senza alcun digest completo riceve come identità "partial:<dimensione>:<digest parziale>:<hash combinato>".
+
+    Returns:
+    int: Numero di gruppi di copie identiche.
+    """
+    rows = conn.execute(
+        "SELECT id, video_path, size, partial_digest, content_digest, combined_hash FROM videos "
+        "WHERE partial_digest IS NOT NULL AND (size, partial_digest) IN "
+        "(SELECT size, partial_digest FROM videos WHERE partial_digest IS NOT NULL GROUP BY size, partial_digest HAVING COUNT(*) > 1) "
+        "ORDER BY size, partial_digest, id"
+    ).fetchall()
+    candidates = defaultdict(list)
+    for row in rows:
+        candidates[row[2], row[3]].append(row)
+
+    updates = []
+    groups = 0
+    for (size, partial), members in candidates.items():
+        by_digest = defaultdict(list)
+        unreadable = []
+        for video_id, video_path, _, _, content_digest, combined_hash in members:
+            digest = content_digest if content_digest and not content_digest.startswith("partial:") else file_digest(video_path)
+            if digest is None:
+                unreadable.append((video_id, combined_hash))
+            else:
+                by_digest[digest].append((video_id, combined_hash))
+
+        for video_id, combined_hash in unreadable:
+            match = next((digest for digest, group in by_digest.items() if any(value == combined_hash for _, value in group)), None)
+            by_digest[match or f"partial:{size}:{partial}:{combined_hash}"].append((video_id, combined_hash))
+
+        for digest, group in by_digest.items():
+            if len(group) > 1:
+                groups += 1
+                updates += [(digest, video_id) for video_id, _ in group]
+
+    conn.executemany("UPDATE videos SET content_digest = ? WHERE id = ?", updates)
+    return groups
+
+
+def merge_shards(shard_files, require_all=False):
+    """
+    Unisce i database degli shard nel database principale (DB_FILE), da confrontare poi come un'unica libreria.
+
+    Ogni shard viene prima migrato alla versione corrente dello schema e unito in una transazione.
+    Le anteprime dei frame non vengono copiate: la GUI le legge dal database dello shard, che
+    deve quindi restare nello stesso percorso.
+
+    Parameters:
+    shard_files (list): Percorsi dei database degli shard.
+    require_all (bool): Se True, uno shard mancante è un errore e nessuno shard viene unito.
+
+    Raises:
+    FileNotFoundError: Con require_all, se manca il database di qualche shard.
+    """
+    if require_all:
+        missing = [str(shard_file) for shard_file in shard_files if not Path(shard_file).exists()]
+        if missing:
+            raise FileNotFoundError(f"Database degli shard mancanti, unione annullata: {', '.join(missing)}")
+    create_table()
+    conn = connect_db()
+    conn.isolation_level = None  # Transazioni esplicite: ATTACH non è ammesso dentro una transazione
+    try:
+        columns = [row[1] for row in conn.execute("PRAGMA main.table_info(videos)") if row[1] not in MERGE_EXCLUDED_COLUMNS]
+        for shard_file in shard_files:
+            shard_file = str(Path(shard_file).resolve())
+            if shard_file == database_manager.DB_FILE or not Path(shard_file).exists():
+                logging.warning(f"Shard ignorato (inesistente o uguale al database principale): {shard_file}")
+                print(f"Shard ignorato: {shard_file}")
+                continue
+            create_table(shard_file)
+            conn.execute("ATTACH DATABASE ? AS shard", (shard_file,))
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    added, replaced, skipped = merge_shard(conn, shard_file, columns)
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            finally:
+                conn.execute("DETACH DATABASE shard")
+            logging.info(f"Shard {shard_file}: {added} video aggiunti ({replaced} sostituiti), {skipped} già presenti in versione più recente.")
+            print(f"Shard {Path(shard_file).name}: {added} video aggiunti, {skipped} ignorati")
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            groups = link_exact_copies(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        logging.info(f"Unione degli shard completata: {groups} gruppi di copie identiche.")
+        print(f"Copie identiche tra gli shard: {groups} gruppi")
+    finally:
+        conn.close()
+    update_hash_index()
@@ -0,0 +1,102 @@
+import logging
+from collections import defaultdict
+from moduli.hash_index import MultiIndexHashTable, popcount
+
+
+def is_low_information_hash(value, bits=64, margin=4):
+    """Riconosce hash quasi uniformi (frame neri, bianchi o in dissolvenza), che combacerebbero con troppi frame."""
+    ones = popcount(value)
+    return ones <= margin or ones >= bits - margin
+
+
+def build_frame_index(sequences, frame_distance):
+    """
+    Crea l'indice invertito di tutti i frame delle impronte temporali.
+
+    Parameters:
+    sequences (dict): id del video -> lista di (timestamp, hash).
+    frame_distance (int): Distanza Hamming massima tra due frame considerati uguali.
+
+    Returns:
+    MultiIndexHashTable: Indice con elementi (id del video, posizione del frame).
+    """
+    index = MultiIndexHashTable(frame_distance)
+    for video_id, sequence in sequences.items():
+        for position, (_, frame_hash) in enumerate(sequence):
+            if frame_hash is not None and not is_low_information_hash(frame_hash):
+                index.add(frame_hash, (video_id, position))
+    return index
+
+
+def best_alignment(offset_votes):
+    """
+    Sceglie lo scostamento con più frame allineati, unendo gli scostamenti adiacenti.
+
+    Il campionamento a intervallo fisso di due video tagliati in punti diversi può cadere a
+    cavallo di due posizioni, quindi i voti di offset-1, offset e offset+1 vengono uniti.
+
+    Returns:
+    tuple: (scostamento in posizioni, insieme delle posizioni allineate del primo video)
+    """
+    best_offset, best_positions = None, set()
+    for offset in sorted(offset_votes, key=abs):
+        positions = offset_votes[offset] | offset_votes.get(offset - 1, set()) | offset_votes.get(offset + 1, set())
+        if len(positions) > len(best_positions):
+            best_offset, best_positions = offset, positions
+    return best_offset, best_positions
+
+
+def find_temporal_matches(sequences, interval, frame_distance=6, min_overlap=0.5, min_frames=3, max_postings=200):
+    """
+    Trova i video che condividono una porzione di contenuto, anche se tagliati o rimontati.
+
+    Per ogni frame di ogni video cerca nell'indice invertito i frame simili degli altri video e
+    vota lo scostamento temporale (posizione nell'altro video - posizione nel video corrente).
+    Solo le coppie di video che condividono almeno un frame vengono considerate, quindi non
+    serve allineare tutte le coppie.
+
+    Parameters:
+    sequences (dict): id del video -> lista di (timestamp, hash).
+    interval (float): Intervallo di campionamento in secondi.
+    frame_distance (int): Distanza Hamming massima tra frame corrispondenti.
+    min_overlap (float): Frazione minima del video più corto che deve essere allineata.
+    min_frames (int): Numero minimo di frame allineati.
+    max_postings (int): I frame che combaciano con più frame di così (es. loghi, sigle) vengono ignorati.
+
+    Returns:
+    list: Dizionari con id1, id2, offset (secondi da aggiungere ai tempi di id1 per ottenere quelli di id2),
+          overlap (frazione del video più corto) e matched_frames, ordinati per id.
+    """
+    index = build_frame_index(sequences, frame_distance)
+    matches = []
+    skipped_frames = 0
+
+    for video_id in sorted(sequences):
+        sequence = sequences[video_id]
+        votes = defaultdict(lambda: defaultdict(set))  # altro video -> scostamento -> posizioni del video corrente
+        for position, (_, frame_hash) in enumerate(sequence):
+            if frame_hash is None or is_low_information_hash(frame_hash):
+                continue
+            candidates = index.query(frame_hash)
+            if len(candidates) > max_postings:
+                skipped_frames += 1
+                continue
+            for (other_id, other_position), _ in candidates:
+                if other_id > video_id:
+                    votes[other_id][other_position - position].add(position)
+
+        for other_id, offset_votes in votes.items():
+            offset, positions = best_alignment(offset_votes)
+            shorter = min(len(sequence), len(sequences[other_id]))
+            overlap = len(positions) / shorter if shorter else 0.0
+            if len(positions) >= min_frames and overlap >= min_overlap:
+                matches.append({
+                    "id1": video_id,
+                    "id2": other_id,
+                    "offset": round(offset * interval, 3),
+                    "overlap": round(min(overlap, 1.0), 3),
+                    "matched_frames": len(positions),
+                })
+
+    logging.info(f"Allineamento temporale: {len(matches)} corrispondenze, {skipped_frames} frame troppo comuni ignorati.")
+    return sorted(matches, key=lambda match: (match["id1"], match["id2"]))
@@ -1,11 +1,16 @@
-import json
+import io
 import os
+import queue
+import threading
 import tkinter as tk
 from tkinter import messagebox
 from PIL import Image, ImageTk
-from moduli.database_manager import delete_video  # Presupponendo che ci sia una funzione per cancellare i video dal database
-import hashlib
+from moduli.database_manager import ReviewJournal, is_preview_ref, fetch_frame_preview, fetch_frame_path_owners  # Registro delle decisioni, applicate al database alla chiusura
+from moduli.compare import load_duplicate_groups
+from moduli.hash_utils import hamming_distance
 import configparser
+from collections import OrderedDict
+from itertools import islice
 from pathlib import Path
 
 # Load configuration
@@ -18,45 +23,138 @@ if not config_file.exists():
 
 config.read(config_file)
 
-# Load directory to process
-try:
-    DIR_TO_PROCESS = config['Paths']['DIR_TO_PROCESS']
-except KeyError:
-    raise KeyError("La configurazione 'DIR_TO_PROCESS' non è stata trovata nel file 'config.ini'.")
-
-# Calcola il nome del file del database usando un hash Blake2b a 128 bit, se non è definito nel file di configurazione
-DB_FILE = config['Database'].get('DB_FILE', None)
-JSON_FILE = "similarities.json"
-if not DB_FILE:
-    # Calcola hash Blake2b con output di 128 bit per creare il nome del DB
-    JSON_FILE = hashlib.blake2b(DIR_TO_PROCESS.encode(), digest_size=16).hexdigest() + '.json'
+# Distanza massima delle coppie da mostrare (vuoto = tutte quelle salvate dal confronto)
+MAX_DISTANCE = config.get('GUI', 'REVIEW_MAX_DISTANCE', fallback='').strip()
+MAX_DISTANCE = int(MAX_DISTANCE) if MAX_DISTANCE else None
+
+# Anteprime preparate in anticipo: frame delle prossime PREFETCH_PAIRS coppie, al massimo THUMBNAIL_CACHE_SIZE in memoria
+PREFETCH_PAIRS = config.getint('GUI', 'PREFETCH_PAIRS', fallback=8)
+THUMBNAIL_CACHE_SIZE = config.getint('GUI', 'THUMBNAIL_CACHE_SIZE', fallback=256)
+
+def pair_key(video1, video2):
+    """Chiave della coppia di video nel registro di revisione, indipendente dall'ordine."""
+    return min(video1["id"], video2["id"]), max(video1["id"], video2["id"])
+
+# Dimensioni fisse delle anteprime
+THUMBNAIL_SIZE = (300, 300)
+
+
+def open_frame(frame_path):
+    """Restituisce il file da aprire con PIL: l'anteprima salvata nel database oppure il file JPEG. None se manca."""
+    if is_preview_ref(frame_path):
+        preview = fetch_frame_preview(frame_path)
+        return io.BytesIO(preview) if preview is not None else None
+    return frame_path if frame_path and os.path.exists(frame_path) else None
+
+def load_thumbnail(frame_path, size=THUMBNAIL_SIZE):
+    """Apre un frame e lo ridimensiona. Restituisce un'immagine PIL, oppure None se il frame manca o non è valido."""
+    try:
+        source = open_frame(frame_path)
+        if source is None:
+            print(f"Il frame non esiste: {frame_path}")
+            return None
+        with Image.open(source) as image:
+            # Controllo se l'immagine ha dimensioni valide
+            if image.size[0] <= 0 or image.size[1] <= 0:
+                print(f"L'immagine ha dimensioni non valide: {frame_path}")
+                return None
+            image.draft('RGB', size)  # Per i JPEG la decodifica avviene già a scala ridotta
+            return image.convert('RGB').resize(size, Image.LANCZOS)  # Usa LANCZOS per un ridimensionamento di alta qualità
+    except Exception as e:
+        print(f"Errore nel caricamento dell'immagine {frame_path}: {e}")
+        return None
+
+
+class ThumbnailCache:
+    """
+    Cache LRU delle anteprime pronte per Tk, con un thread che le prepara in anticipo.
+
+    Il thread apre e ridimensiona i frame; i PhotoImage vengono creati solo nel thread
+    principale, perché Tk non è thread-safe, quando le immagini pronte vengono raccolte.
+    """
+
+    def __init__(self, capacity=THUMBNAIL_CACHE_SIZE):
+        self.capacity = capacity
+        self.images = OrderedDict()  # percorso -> PhotoImage, dal meno al più recente
+        self.pending = set()
+        self.requests = queue.Queue()
+        self.ready = queue.Queue()
+        self.worker = threading.Thread(target=self._run, name="ThumbnailPrefetch", daemon=True)
+        self.worker.start()
+
+    def _run(self):
+        while True:
+            frame_path = self.requests.get()
+            if frame_path is None:
+                return
+            self.ready.put((frame_path, load_thumbnail(frame_path)))
+
+    def _store(self, frame_path, photo):
+        self.images[frame_path] = photo
+        self.images.move_to_end(frame_path)
+        while len(self.images) > self.capacity:
+            self.images.popitem(last=False)
+
+    def prefetch(self, frame_paths):
+        """Accoda al thread i frame non ancora in cache."""
+        for frame_path in frame_paths:
+            if frame_path and frame_path not in self.images and frame_path not in self.pending:
+                self.pending.add(frame_path)
+                self.requests.put(frame_path)
+
+    def collect(self):
+        """Converte in PhotoImage le anteprime preparate dal thread. Va chiamata dal thread di Tk."""
+        while True:
+            try:
+                frame_path, image = self.ready.get_nowait()
+            except queue.Empty:
+                return
+            self.pending.discard(frame_path)
+            if image is not None:
+                self._store(frame_path, ImageTk.PhotoImage(image))
+
+    def get(self, frame_path):
+        """Restituisce il PhotoImage del frame (None se non disponibile); se non è ancora pronto lo carica subito."""
+        self.collect()
+        photo = self.images.get(frame_path)
+        if photo is not None:
+            self.images.move_to_end(frame_path)
+            return photo
+
+        image = load_thumbnail(frame_path)
+        if image is None:
+            return None
+        photo = ImageTk.PhotoImage(image)
+        self._store(frame_path, photo)
+        return photo
+
+    def close(self):
+        """Termina il thread di caricamento."""
+        self.requests.put(None)
 
-# Crea la directory per il database se non esiste
-db_path = Path("database")
-db_path.mkdir(parents=True, exist_ok=True)
 
-# Costruisci il percorso completo del file del database
+class VideoComparerApp(tk.Tk):
+    def __init__(self, max_distance=None):
+        super().__init__()
+        self.max_distance = max_distance
 
-JSON_FILE = db_path / JSON_FILE
-# Converte il nome del file del database in un percorso assoluto e stampa
-JSON_FILE = str(Path(JSON_FILE).resolve())
-print(f"JSON_FILE: {JSON_FILE}")
+        # Riprende la revisione: le coppie già saltate e i video eliminati non vengono riproposti
+        self.journal = ReviewJournal()
+        self.skipped, self.deleted_ids = self.journal.load()
 
+        # I video vengono rivisti per gruppi: il video consigliato da tenere contro ciascun altro membro
+        self.groups = self.load_groups()
+        self.group_index = 0
+        self.keeper = None
+        self.pending = []
 
-class VideoComparerApp(tk.Tk):
-    def __init__(self, similarities_file):
-        super().__init__()
-        self.similarities_file = similarities_file
-        
-        # Controlla se il file JSON esiste e non è vuoto
-        if not os.path.exists(self.similarities_file) or os.path.getsize(self.similarities_file) == 0:
-            messagebox.showerror("Errore", f"Il file {self.similarities_file} non esiste o è vuoto.")
+        # Controlla che il confronto abbia salvato dei gruppi nel database
+        if not self.next_comparison():
+            messagebox.showerror("Errore", "Nel database non ci sono gruppi di video simili da confrontare.")
             self.quit()
             return
-        
-        self.similarities = self.load_similarities()
-        self.current_index = 0
-        
+        self.thumbnails = ThumbnailCache()
+
         self.title("Confronto Video")
         width = int(self.winfo_screenwidth())
         height = int(self.winfo_screenheight()*0.80)
@@ -76,8 +174,38 @@ class VideoComparerApp(tk.Tk):
         self.remaining_files_label = tk.Label(self.nav_frame, text="", font=("Arial", 14), bg='#121212', fg='#FFFFFF')
         self.remaining_files_label.pack(pady=10)
 
+        # I widget vengono creati una sola volta e aggiornati a ogni confronto
+        self.columns = [self.build_video_column(0), self.build_video_column(1)]
+        self.build_navigation()
+
         # Mostra il primo confronto
         self.show_comparison()
+        self.poll_thumbnails()
+
+    def destroy(self):
+        """Chiude la finestra e il thread delle anteprime, e applica al database le decisioni registrate."""
+        if hasattr(self, "thumbnails"):
+            self.thumbnails.close()
+        if hasattr(self, "journal"):
+            self.journal.close()
+        super().destroy()
+
+    def poll_thumbnails(self):
+        """Raccoglie periodicamente le anteprime pronte, così il cambio di coppia non deve crearle."""
+        self.thumbnails.collect()
+        self.after(50, self.poll_thumbnails)
+
+    def upcoming_videos(self):
+        """Restituisce, in ordine di revisione, i video dei confronti successivi a quello corrente."""
+        yield from self.pending[1:]
+        for group in self.groups[self.group_index + 1:]:
+            yield from group["videos"]
+
+    def prefetch_next(self):
+        """Chiede al thread delle anteprime i frame dei video dei prossimi PREFETCH_PAIRS confronti."""
+        self.thumbnails.prefetch(
+            frame_path for video in islice(self.upcoming_videos(), PREFETCH_PAIRS + 1) for frame_path in video["frame_paths"]
+        )
 
     def configure_grid(self):
         """Configura il layout della finestra per adattarsi."""
@@ -86,132 +214,154 @@ class VideoComparerApp(tk.Tk):
         self.grid_rowconfigure(0, weight=1)
         self.grid_rowconfigure(1, weight=0)
 
-    def load_similarities(self):
-        with open(self.similarities_file, 'r') as file:
-            return json.load(file)
+    def load_groups(self):
+        """Legge i gruppi di duplicati dal database, con i dettagli dei video dal consigliato al peggiore."""
+        return load_duplicate_groups(self.max_distance)
+
+    def next_comparison(self):
+        """
+        Trova il prossimo confronto da rivedere, a partire dal gruppo corrente.
+
+        I video eliminati e le coppie saltate vengono esclusi solo qui, quando il gruppo viene
+        mostrato: il costo di ogni azione dipende dalla dimensione del gruppo, non dal numero di coppie.
+        Se il video consigliato è stato eliminato, il suo posto passa al migliore dei rimanenti.
+
+        Returns:
+        bool: False se non ci sono più confronti.
+        """
+        while self.group_index < len(self.groups):
+            alive = [video for video in self.groups[self.group_index]["videos"] if video["id"] not in self.deleted_ids]
+            if alive:
+                keeper = alive[0]
+                pending = [video for video in alive[1:] if pair_key(keeper, video) not in self.skipped]
+                if pending:
+                    self.keeper, self.pending = keeper, pending
+                    return True
+            self.group_index += 1
+        return False
 
     def show_comparison(self):
-        """Mostra i dettagli e i frame dei due video correnti."""
-        if self.current_index >= len(self.similarities):
+        """Mostra i dettagli e i frame del video consigliato e del membro del gruppo da confrontare."""
+        if not self.next_comparison():
             messagebox.showinfo("Fine", "Non ci sono più video da confrontare.")
             self.destroy()  # Chiude l'intera finestra
             return
 
-        similarity = self.similarities[self.current_index]
-        video1_info = similarity["video1"]
-        video2_info = similarity["video2"]
-        hamming_distance = similarity["hamming_distance"]
-        
+        video1_info = self.keeper
+        video2_info = self.pending[0]
+
         # Mostra il nome dei video come titolo
         n1 = Path(video1_info['video_path'])
-        video1_name =  n1.name  # Estrae il nome del file dal percorso
+        video1_name = f"{n1.name} (consigliato)"  # Estrae il nome del file dal percorso
         n2 = Path(video2_info['video_path'])
         video2_name = n2.name  # Estrae il nome del file dal percorso
 
         # Frame per i video e le informazioni in due colonne
         self.display_video_column(video1_info, 0, video1_name)  # Passa il nome del video 1
         self.display_video_column(video2_info, 1, video2_name)  # Passa il nome del video 2
-        self.display_navigation(hamming_distance)
+        self.display_navigation(hamming_distance(video1_info["combined_hash"], video2_info["combined_hash"]))
 
-        # Aggiorna il conteggio dei file rimanenti
-        remaining_files = len(self.similarities) - self.current_index - 1
-        self.remaining_files_label.config(text=f"File rimanenti: {remaining_files}")
+        # Aggiorna il conteggio dei gruppi e dei video rimanenti
+        remaining_groups = len(self.groups) - self.group_index - 1
+        self.remaining_files_label.config(
+            text=f"Gruppi rimanenti: {remaining_groups}, video da confrontare nel gruppo: {len(self.pending)}"
+        )
 
-    def display_video_column(self, video_info, column, title):
-        """Mostra i frame e le informazioni di un video in una colonna specifica."""
+        self.prefetch_next()
+
+    def build_video_column(self, column):
+        """Crea i widget di una colonna: titolo, riquadro dei frame e informazioni sul video."""
         column_frame = tk.Frame(self, bg="#121212")
         column_frame.grid(row=0, column=column, sticky="nsew", padx=10, pady=10)
         self.grid_columnconfigure(column, weight=1)
 
         # Titolo centrato
-        tk.Label(column_frame, text=title, font=("Arial", 14, "bold"), bg="#121212", fg="#FFFFFF").pack(pady=5)
+        title_label = tk.Label(column_frame, text="", font=("Arial", 14, "bold"), bg="#121212", fg="#FFFFFF")
+        title_label.pack(pady=5)
 
-        # Frame per mostrare i 3 frame del video
+        # Frame per mostrare i frame del video
         frames_frame = tk.Frame(column_frame, bg="#121212")
         frames_frame.pack(pady=10)
 
-        # Mantiene i percorsi e le label per visualizzare i frame
-        self.frames_data = []
-        for frame_path in video_info["frame_paths"]:
-            img_label = tk.Label(frames_frame, bg="#121212")
-            #img_label.pack(pady=5)
-            img_label.pack(side="left", padx=5)  # Usa side="left" per disporre orizzontalmente
-            self.frames_data.append((frame_path, img_label))
-        
-        # Carica e visualizza le immagini con dimensioni fisse
-        self.update_frame_images()
-        
         # Informazioni centrate
-        info_label = tk.Label(column_frame, text=f"Path: {video_info['video_path']}", wraplength=400, anchor="center", bg="#121212", fg="#FFFFFF",font=("Arial", 14))
+        info_label = tk.Label(column_frame, text="", wraplength=400, anchor="center", bg="#121212", fg="#FFFFFF", font=("Arial", 14))
         info_label.pack(fill="x", pady=5)
 
-        detail_label = tk.Label(column_frame, text=f"Risoluzione: {video_info['resolution']}, "
-                                                f"Dimensione: {video_info['size']}, Durata: {video_info['duration']}",
-                                bg="#121212", fg="#FFFFFF", font=("Arial", 14))
+        detail_label = tk.Label(column_frame, text="", bg="#121212", fg="#FFFFFF", font=("Arial", 14))
         detail_label.pack(anchor="center", pady=5)
 
-    def update_frame_images(self):
-        """Aggiorna le immagini dei frame."""
-        fixed_size = (300, 300)  # Dimensioni fisse per le immagini
-
-        for frame_path, img_label in self.frames_data:
-            if not os.path.exists(frame_path):
-                print(f"Il file non esiste: {frame_path}")
-                continue  # Salta se il file non esiste
-
-            try:
-                image = Image.open(frame_path)
-
-                # Controllo se l'immagine ha dimensioni valide
-                if image.size[0] <= 0 or image.size[1] <= 0:
-                    print(f"L'immagine ha dimensioni non valide: {frame_path}")
-                    continue  # Salta se l'immagine ha dimensioni non valide
-
-                image = image.resize(fixed_size, Image.LANCZOS)  # Usa LANCZOS per un ridimensionamento di alta qualità
-                image_tk = ImageTk.PhotoImage(image)
-                img_label.config(image=image_tk, bg='#121212')
-                img_label.image = image_tk  # Mantiene un riferimento per evitare la garbage collection
-            except Exception as e:
-                print(f"Errore nel caricamento dell'immagine {frame_path}: {e}")
-
-    def display_navigation(self, hamming_distance):
-        """Crea i pulsanti di navigazione e mostra la distanza Hamming."""
-        for widget in self.nav_frame.winfo_children():
-            if widget != self.remaining_files_label:
-                widget.destroy()
+        return {"title": title_label, "frames": frames_frame, "images": [], "info": info_label, "detail": detail_label}
 
-        tk.Label(self.nav_frame, text=f"Distanza Hamming: {hamming_distance}", bg='#121212', fg='#FFFFFF', font=("Arial", 14)).pack()
+    def display_video_column(self, video_info, column, title):
+        """Mostra i frame e le informazioni di un video in una colonna specifica, riusandone i widget."""
+        widgets = self.columns[column]
+        widgets["title"].config(text=title)
+        self.update_frame_images(widgets, video_info["frame_paths"])
+        widgets["info"].config(text=f"Path: {video_info['video_path']}")
+        widgets["detail"].config(text=f"Risoluzione: {video_info['resolution']}, "
+                                      f"Dimensione: {video_info['size']}, Durata: {video_info['duration']}")
+
+    def update_frame_images(self, widgets, frame_paths):
+        """Aggiorna le immagini dei frame, creando nuove label solo se il video ha più frame di quelle esistenti."""
+        labels = widgets["images"]
+        while len(labels) < len(frame_paths):
+            labels.append(tk.Label(widgets["frames"], bg="#121212"))
+
+        for idx, img_label in enumerate(labels):
+            if idx >= len(frame_paths):
+                img_label.pack_forget()
+                continue
+            if not img_label.winfo_manager():
+                img_label.pack(side="left", padx=5)  # Usa side="left" per disporre orizzontalmente
+            image_tk = self.thumbnails.get(frame_paths[idx])
+            img_label.config(image=image_tk or "")
+            img_label.image = image_tk  # Mantiene un riferimento per evitare la garbage collection
+
+    def build_navigation(self):
+        """Crea i pulsanti di navigazione e la label della distanza Hamming."""
+        self.distance_label = tk.Label(self.nav_frame, text="", bg='#121212', fg='#FFFFFF', font=("Arial", 14))
+        self.distance_label.pack()
 
         # Pulsanti per eliminare uno dei due video
         button_frame = tk.Frame(self.nav_frame, bg='#121212')
         button_frame.pack(pady=10)
 
-        tk.Button(button_frame, text="Elimina Video 1", command=lambda: self.delete_video(self.similarities[self.current_index]["video1"]), bg='#cb3234', fg='#FFFFFF', width=15, height=2, font=("Arial", 14)).grid(row=0, column=0, padx=10)
-        tk.Button(button_frame, text="Elimina Video 2", command=lambda: self.delete_video(self.similarities[self.current_index]["video2"]), bg='#cb3234', fg='#FFFFFF', width=15, height=2, font=("Arial", 14)).grid(row=0, column=1, padx=10)
+        tk.Button(button_frame, text="Elimina Video 1", command=lambda: self.delete_video(self.keeper), bg='#cb3234', fg='#FFFFFF', width=15, height=2, font=("Arial", 14)).grid(row=0, column=0, padx=10)
+        tk.Button(button_frame, text="Elimina Video 2", command=lambda: self.delete_video(self.pending[0]), bg='#cb3234', fg='#FFFFFF', width=15, height=2, font=("Arial", 14)).grid(row=0, column=1, padx=10)
         tk.Button(button_frame, text="Salta", command=self.skip_comparison, bg='#337AB7', fg='#FFFFFF', width=15, height=2, font=("Arial", 14)).grid(row=0, column=2, padx=10)
+        tk.Button(button_frame, text="Tieni il consigliato", command=self.keep_suggested, bg='#2E7D32', fg='#FFFFFF', width=18, height=2, font=("Arial", 14)).grid(row=0, column=3, padx=10)
+
+    def display_navigation(self, hamming_distance):
+        """Mostra la distanza Hamming della coppia corrente."""
+        self.distance_label.config(text=f"Distanza Hamming: {hamming_distance}")
+
+    def remove_video_files(self, video_info):
+        """
+        Elimina il file del video e gli eventuali frame salvati come file; le anteprime nel database vengono eliminate con il video.
+
+        Un frame salvato come file viene eliminato solo se nessun altro video ancora presente lo usa
+        (copie identiche, video con lo stesso nome); altrimenti resta e pack_legacy_frames lo sposterà nel database.
+        """
+        os.remove(video_info["video_path"])
+        frame_paths = [frame_path for frame_path in video_info["frame_paths"] if frame_path and not is_preview_ref(frame_path)]
+        removed_ids = self.deleted_ids | {video_info["id"]}
+        for frame_path, owners in fetch_frame_path_owners(frame_paths).items():
+            if owners <= removed_ids and os.path.exists(frame_path):
+                os.remove(frame_path)
 
     def delete_video(self, video_info):
-        """Elimina il video selezionato e i relativi frame dalla directory e dal database, e aggiorna il file JSON."""
+        """Elimina il video selezionato e i relativi frame dalla directory e registra l'eliminazione, applicata al database alla chiusura."""
         video_path = video_info["video_path"]
         video_id = video_info["id"]
-        frames_directory = os.path.join("frames", os.path.splitext(os.path.basename(video_path))[0])
 
         if messagebox.askyesno("Conferma Eliminazione", f"Sei sicuro di voler eliminare il video: {video_path}?"):
             try:
-                os.remove(video_path)
-                if os.path.exists(frames_directory):
-                    import shutil
-                    shutil.rmtree(frames_directory)
-                
-                delete_video(video_id)
-                self.update_similarities_json(video_id)
-
-                # Aggiorna l'indice corrente se necessario
-                if self.current_index >= len(self.similarities):
-                    self.current_index = len(self.similarities) - 1
-                
+                self.remove_video_files(video_info)
+                self.journal.record("delete", *pair_key(self.keeper, self.pending[0]), video_id)
+                self.deleted_ids.add(video_id)
+
                 # Se non ci sono più video, chiudi l'app
-                if self.current_index < 0:
+                if not self.next_comparison():
                     messagebox.showinfo("Eliminazione", "Non ci sono più video da confrontare.")
                     self.destroy()
                     return
@@ -221,17 +371,32 @@ class VideoComparerApp(tk.Tk):
             except Exception as e:
                 messagebox.showerror("Errore", f"Errore durante l'eliminazione: {e}")
 
-    def update_similarities_json(self, video_id):
-        """Aggiorna il file JSON rimuovendo le somiglianze associate al video eliminato."""
-        self.similarities = [sim for sim in self.similarities if sim["video1"]["id"] != video_id and sim["video2"]["id"] != video_id]
-        with open(self.similarities_file, 'w') as file:
-            json.dump(self.similarities, file, indent=4)
+    def keep_suggested(self):
+        """Tiene il video consigliato ed elimina, con una sola conferma, tutti gli altri video del gruppo ancora da rivedere."""
+        others = list(self.pending)
+        if not messagebox.askyesno("Conferma Eliminazione",
+                                   f"Sei sicuro di voler tenere {self.keeper['video_path']} ed eliminare {len(others)} video?"):
+            return
+
+        decisions = []
+        try:
+            for video_info in others:
+                self.remove_video_files(video_info)
+                decisions.append(("delete", *pair_key(self.keeper, video_info), video_info["id"]))
+                self.deleted_ids.add(video_info["id"])
+        except Exception as e:
+            messagebox.showerror("Errore", f"Errore durante l'eliminazione: {e}")
+        finally:
+            self.journal.record_many(decisions)
+        self.show_comparison()
 
     def skip_comparison(self):
-        """Salta il confronto corrente e passa al successivo."""
-        self.current_index += 1
+        """Salta il confronto corrente, lo registra come rivisto e passa al successivo."""
+        key = pair_key(self.keeper, self.pending[0])
+        self.journal.record("skip", *key)
+        self.skipped.add(key)
         self.show_comparison()
 
 if __name__ == "__main__":
-    app = VideoComparerApp(JSON_FILE)
+    app = VideoComparerApp(MAX_DISTANCE)
     app.mainloop()